@@ -0,0 +1,210 @@
+"""Vectorized Pong physics: steps many matches at once with NumPy.
+
+Each match is one index into a set of flat arrays. `step()` applies the ball
+physics of `MatchSimulation.step` (move, wall bounce, paddle hits with spin and
+speed-up, speed cap, scoring) to every match that is playing, with no
+per-match Python, float for float (`pong_bench.py batch` checks it). The court,
+paddle sizes, speed curve and win score come from the MatchConfig like the
+simulation's.
+
+This is a standalone engine for the batch benchmarks; the server does not run
+on it. Next to MatchSimulation it leaves out:
+
+- more than one ball or one player a side (it raises ValueError for those rules);
+- seeded serves: directions come from its own NumPy RNG, not the (seed, serves)
+  stream, so a batch match is not replayable;
+- lag compensation: there is no rewind window and no `crossing` state, so a
+  miss scores at once;
+- inputs, READY / play again, suspension and everything else outside the
+  ball's flight: callers set the paddle arrays and `playing` themselves.
+
+    physics = BatchPhysics(10000)
+    physics.reset_balls(np.ones(10000, dtype=bool))
+    physics.playing[:] = True
+    scored = physics.step()
+"""
+import numpy as np
+
+from pong_protocol import RULES_TICK_RATE
+from pong_rules import CLASSIC
+from pong_sim import MatchSimulation
+
+# What a ball hit during one pass of BatchPhysics.move_balls
+TOP, BOTTOM, LEFT, RIGHT = 1, 2, 3, 4
+
+
+class BatchPhysics:
+    """N matches held in NumPy arrays; one call to step() advances all of them one tick"""
+
+    def __init__(self, count, rules=CLASSIC, tick_rate=RULES_TICK_RATE, seed=None):
+        if rules.balls != 1 or rules.team_size != 1:
+            raise ValueError("BatchPhysics plays one ball and one player a side")
+        self.count = count
+        self.rules = rules
+        self.width = rules.width
+        self.height = rules.height
+        self.paddle_height = rules.paddle_height
+        self.radius = rules.ball_radius
+        self.win_score = rules.win_score
+        self.step_scale = RULES_TICK_RATE / tick_rate
+        self.rng = np.random.default_rng(seed)
+
+        rest = (rules.height - rules.paddle_height) / 2
+        self.ball_x = np.full(count, rules.width / 2)
+        self.ball_y = np.full(count, rules.height / 2)
+        self.ball_dx = np.full(count, float(rules.base_speed))
+        self.ball_dy = np.full(count, float(rules.base_speed))
+        self.multiplier = np.ones(count)
+        self.paddle1_y = np.full(count, rest)
+        self.paddle2_y = np.full(count, rest)
+        self.score1 = np.zeros(count, dtype=np.int64)
+        self.score2 = np.zeros(count, dtype=np.int64)
+        self.playing = np.zeros(count, dtype=bool)
+        self.winner = np.full(count, -1, dtype=np.int64)  # -1 while nobody has won
+
+    def load_room(self, index, game_state):
+        """Copy one room's game_state dict into slot `index`"""
+        ball = game_state['balls'][0]
+        self.ball_x[index] = ball['x']
+        self.ball_y[index] = ball['y']
+        self.ball_dx[index] = ball['dx']
+        self.ball_dy[index] = ball['dy']
+        self.multiplier[index] = ball['multiplier']
+        self.paddle1_y[index], self.paddle2_y[index] = (paddle['y'] for paddle in game_state['paddles'])
+        self.score1[index], self.score2[index] = game_state['scores']
+        self.playing[index] = game_state['status'] == 'playing'
+        self.winner[index] = -1 if game_state['winner'] is None else game_state['winner']
+
+    def store_room(self, index, game_state):
+        """Write slot `index` back into a room's game_state dict"""
+        ball = game_state['balls'][0]
+        ball['x'] = float(self.ball_x[index])
+        ball['y'] = float(self.ball_y[index])
+        ball['dx'] = float(self.ball_dx[index])
+        ball['dy'] = float(self.ball_dy[index])
+        ball['multiplier'] = float(self.multiplier[index])
+        game_state['scores'] = [int(self.score1[index]), int(self.score2[index])]
+        if self.winner[index] >= 0:
+            game_state['winner'] = int(self.winner[index])
+            game_state['status'] = 'game_over'
+
+    def reset_balls(self, mask):
+        """Serve from the centre for every match in `mask`, like MatchSimulation.reset_ball"""
+        count = int(mask.sum())
+        self.ball_x[mask] = self.width / 2
+        self.ball_y[mask] = self.height / 2
+        self.ball_dx[mask] = self.rules.base_speed * self.rng.choice((-1, 1), count)
+        spread = MatchSimulation.SERVE_SPREAD
+        self.ball_dy[mask] = self.rng.uniform(-spread, spread, count)
+
+    def step(self):
+        """Advance every playing match one tick.
+
+        Returns (scored1, scored2): masks of the matches where player 1 / player 2
+        scored this tick. Matches that reach win_score stop playing and get a winner;
+        the others have their speed reset and the ball served again.
+        """
+        on = self.playing
+        self.move_balls(on)
+        x = self.ball_x
+
+        # Scoring
+        scored2 = on & (x <= 0)
+        scored1 = on & ~scored2 & (x >= self.width)
+        self.score2 += scored2
+        self.score1 += scored1
+
+        won1 = scored1 & (self.score1 >= self.win_score)
+        won2 = scored2 & (self.score2 >= self.win_score)
+        self.winner[won1] = 0
+        self.winner[won2] = 1
+        self.playing &= ~(won1 | won2)
+
+        serve = (scored1 | scored2) & ~(won1 | won2)
+        if serve.any():
+            self.multiplier[serve] = 1.0
+            self.reset_balls(serve)
+        return scored1, scored2
+
+    def move_balls(self, on):
+        """Sweep every ball in `on` through one tick, like MatchSimulation.move_ball.
+
+        Each pass finds, per match, the earliest wall or paddle-face impact left in
+        the tick and resolves it; matches drop out once they have no impact left.
+        """
+        x, y, dx, dy = self.ball_x, self.ball_y, self.ball_dx, self.ball_dy
+        top = self.radius
+        bottom = self.height - self.radius
+        left_face, right_face = self.rules.faces
+        ph = self.paddle_height
+
+        remaining = np.ones(self.count)  # Fraction of the tick still to simulate
+        active = on.copy()
+        for _ in range(MatchSimulation.MAX_BOUNCES):
+            if not active.any():
+                break
+            speed = self.multiplier * self.step_scale
+            vx = dx * speed
+            vy = dy * speed
+
+            # Earliest impact before the tick ends; same tests, same order as the scalar code
+            impact = np.full(self.count, np.inf)
+            hit = np.zeros(self.count, dtype=np.int8)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = (top - y) / vy
+                cand = active & (vy < 0) & (y + vy * remaining <= top)
+                impact[cand], hit[cand] = t[cand], TOP
+
+                t = (bottom - y) / vy
+                cand = active & (vy > 0) & (y + vy * remaining >= bottom) & (t < impact)
+                impact[cand], hit[cand] = t[cand], BOTTOM
+
+                t = (left_face - x) / vx
+                level = (self.paddle1_y <= y + vy * t) & (y + vy * t <= self.paddle1_y + ph)
+                cand = (active & (vx < 0) & (x >= left_face) & (x + vx * remaining <= left_face) &
+                        (t < impact) & level)
+                impact[cand], hit[cand] = t[cand], LEFT
+
+                t = (right_face - x) / vx
+                level = (self.paddle2_y <= y + vy * t) & (y + vy * t <= self.paddle2_y + ph)
+                cand = (active & (vx > 0) & (x <= right_face) & (x + vx * remaining >= right_face) &
+                        (t < impact) & level)
+                impact[cand], hit[cand] = t[cand], RIGHT
+
+            free = active & (hit == 0)
+            x[free] += vx[free] * remaining[free]
+            y[free] += vy[free] * remaining[free]
+            active &= hit != 0
+
+            np.minimum(impact, remaining, out=impact)
+            np.maximum(impact, 0.0, out=impact)
+            remaining[active] -= impact[active]
+
+            # Ball collision with top/bottom
+            wall = (hit == TOP) | (hit == BOTTOM)
+            x[wall] += vx[wall] * impact[wall]
+            y[hit == TOP] = top
+            y[hit == BOTTOM] = bottom
+            dy[wall] = -dy[wall]
+
+            # Paddle collisions
+            for side, face, paddle_y, direction in ((LEFT, left_face, self.paddle1_y, 1),
+                                                    (RIGHT, right_face, self.paddle2_y, -1)):
+                struck = hit == side
+                x[struck] = face
+                y[struck] += vy[struck] * impact[struck]
+                dx[struck] = direction * np.abs(dx[struck])
+                self.paddle_hit(struck, paddle_y)
+
+    def paddle_hit(self, hit, paddle_y):
+        """Speed up, spin and cap the ball for every match in `hit`"""
+        if not hit.any():
+            return
+        self.multiplier[hit] += self.rules.speed_up
+        hit_pos = (self.ball_y[hit] - paddle_y[hit]) / self.paddle_height
+        self.ball_dy[hit] += (hit_pos - 0.5) * MatchSimulation.SPIN
+
+        cap = self.rules.max_speed
+        for d in (self.ball_dx, self.ball_dy):
+            over = hit & (np.abs(d) > cap)
+            d[over] = np.copysign(cap, d[over])
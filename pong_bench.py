@@ -0,0 +1,1476 @@
+"""Benchmarks for the Pong server.
+
+    python pong_bench.py rooms --rooms 1 10 100 500 --seconds 5
+    python pong_bench.py protocol
+    python pong_bench.py delta --clients 200
+    python pong_bench.py freeze --loss 0.01 0.03 0.05
+    python pong_bench.py batch --matches 1 100 10000
+    python pong_bench.py tunnel --multipliers 1 10 100 1000
+    python pong_bench.py particles --counts 1000 5000 10000
+    python pong_bench.py sim --matches 100 --ticks 10000
+    python pong_bench.py spectators --viewers 100 1000 --async
+    python pong_bench.py metrics --rooms 100 500
+    python pong_bench.py lag --rtt 0 50 100 150
+    python pong_bench.py inputs --pairs 10 50
+    python pong_bench.py stress --threads 4 32
+    python pong_bench.py resume --sessions 100000
+    python pong_bench.py bots --matches 100 500
+    python pong_bench.py rules --ticks 20000
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import logging
+import os
+import random
+import selectors
+import signal
+import socket
+import pickle
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import timeit
+import tracemalloc
+from collections import Counter, deque
+
+from pong_protocol import (DATAGRAM_TOKEN, decode_input, decode_ping, decode_welcome, encode_control,
+                           encode_hello, encode_input, encode_inputs, encode_pong, encode_resume, encode_spectate,
+                           encode_welcome, INPUT_INTERVAL, KEEPALIVE_INTERVAL, legacy_state, message_type,
+                           MSG_KEYFRAME, MSG_PING, MSG_WELCOME, RULES_TICK_RATE, safe_loads, SnapshotDecoder,
+                           SnapshotEncoder, snapshot_layout, STATUS_CODES, STATUS_MASK)
+from pong_bot import BotPlayer, landing_y
+from pong_metrics import configure_logging, stop_logging
+from pong_net import ClockSync, FrameBuffer, pack_frame, recv_frame, set_nodelay, TrafficCounter
+from pong_proxy import LossyProxy
+from pong_rules import CLASSIC, PRESETS
+from pong_server import AsyncPongServer, GameRoom, InputSlot, PongServer, SessionTable
+from pong_sim import MatchSimulation
+
+
+class NullConnection:
+    """Stand-in binary player that swallows what is sent and acks every snapshot at once"""
+
+    def __init__(self, rules=CLASSIC):
+        self.binary = True
+        self.encoder = SnapshotEncoder(snapshot_layout(rules))
+        self.traffic = TrafficCounter()
+        self.udp_addr = None
+        self.inputs = 0
+        self.slot = InputSlot()
+        self.clock = ClockSync()
+        self.pong = None
+        self.session = None
+        self.gone = False
+        self.bot = False
+
+    def send_snapshot(self, msg):
+        self.traffic.count_out(len(msg))
+        self.slot.ack = max(self.encoder.history)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+    return ordered[index]
+
+
+def fill_rooms(server, count):
+    """Create `count` rooms with two fake players each, all mid-match"""
+    for _ in range(count):
+        room, _ = server.join_room(NullConnection())
+        server.join_room(NullConnection())
+        room.update()  # waiting_connection -> waiting_ready
+        room.start_game()
+
+
+def track_ball(room):
+    """Keep every paddle on the (first) ball so rallies go on"""
+    state = room.game_state
+    if state['status'] == 'game_over':
+        room.restart_game()
+        room.start_game()
+    target = state['balls'][0]['y'] - room.rules.paddle_height / 2
+    for paddle in state['paddles']:
+        paddle['y'] = target
+
+
+def bench_rooms(room_counts, seconds, tick_rate, send_rate):
+    print(f"{'rooms':>6} {'ticks':>6} {'cpu/room/tick':>14} {'cpu%/room':>10} "
+          f"{'load%':>6} {'jitter avg':>11} {'jitter p99':>11} {'overruns':>9} {'dropped':>8}")
+
+    for count in room_counts:
+        with contextlib.redirect_stdout(io.StringIO()):
+            server = PongServer(host='127.0.0.1', port=0, max_rooms=count,
+                                tick_rate=tick_rate, send_rate=send_rate)
+            server.server.close()
+            fill_rooms(server, count)
+
+        clock = server.clock
+        jitter = []
+
+        # Same loop as PongServer.run_scheduler, instrumented
+        with contextlib.redirect_stdout(io.StringIO()):
+            cpu_start = time.process_time()
+            wall_start = time.monotonic()
+            while time.monotonic() - wall_start < seconds:
+                for room in server.rooms.values():
+                    track_ball(room)
+                ticks_before = clock.tick
+                delay = server.tick_rooms(time.monotonic())
+                if clock.tick > ticks_before:
+                    jitter.append(clock.lateness * 1000)
+                time.sleep(delay)
+            cpu = time.process_time() - cpu_start
+            wall = time.monotonic() - wall_start
+
+        ticks = clock.tick
+        per_room_tick_us = cpu / (ticks * count) * 1e6
+        per_room_pct = cpu / wall / count * 100
+        print(f"{count:>6} {ticks:>6} {per_room_tick_us:>12.1f}us {per_room_pct:>9.3f}% "
+              f"{cpu / wall * 100:>5.0f}% {statistics.mean(jitter):>9.2f}ms "
+              f"{percentile(jitter, 99):>9.2f}ms {clock.overruns:>9} {clock.dropped_ticks:>8}")
+
+
+def bench_protocol(number):
+    """Snapshot and input size and codec cost: legacy pickle vs the binary protocol"""
+    room = GameRoom(0)
+    room.game_state['status'] = 'playing'
+    state = room.game_state
+    room.sim.reset_ball(state, state['balls'][0])
+    layout = room.layout
+    inputs = {'paddle_y': 250, 'ready': True, 'play_again': False}
+
+    pickled_state = pickle.dumps(legacy_state(state, room.rules))
+    binary_state = layout.encode_keyframe(1, layout.values(state))
+    pickled_input = pickle.dumps(inputs)
+    binary_input = encode_input(1, 1, 10, True, False)
+    decoder = SnapshotDecoder(layout)  # One per connection, as in the client
+
+    cases = [
+        ('snapshot', 'pickle', len(pickled_state),
+         lambda: pickle.dumps(legacy_state(state, room.rules)), lambda: pickle.loads(pickled_state)),
+        ('snapshot', 'binary', len(binary_state),
+         lambda: layout.encode_keyframe(1, layout.values(state)),
+         lambda: layout.state(decoder.decode(binary_state)[1])),
+        ('input', 'pickle', len(pickled_input),
+         lambda: pickle.dumps(inputs), lambda: safe_loads(pickled_input)),
+        ('input', 'binary', len(binary_input),
+         lambda: encode_input(1, 1, 10, True, False), lambda: decode_input(binary_input)),
+    ]
+
+    print(f"{'message':>9} {'format':>7} {'bytes':>6} {'encode':>10} {'decode':>10}")
+    for message, fmt, size, encode, decode in cases:
+        encode_us = timeit.timeit(encode, number=number) / number * 1e6
+        decode_us = timeit.timeit(decode, number=number) / number * 1e6
+        print(f"{message:>9} {fmt:>7} {size:>6} {encode_us:>8.2f}us {decode_us:>8.2f}us")
+
+
+def bench_delta(clients, seconds, max_ack_lag):
+    """Bytes/sec per client for full keyframes vs delta replication during rallies.
+
+    Each simulated client acknowledges snapshots a random 1..max_ack_lag ticks
+    late, standing in for its round trip.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        room = GameRoom(0)
+        room.players = (NullConnection(), NullConnection())
+        room.update()
+        room.start_game()
+
+    layout = room.layout
+    encoders = [SnapshotEncoder(layout) for _ in range(clients)]
+    decoders = [SnapshotDecoder(layout) for _ in range(clients)]
+    lags = [random.randint(1, max_ack_lag) for _ in range(clients)]
+    keyframe_bytes = delta_bytes = 0
+    tick_interval = 1.0 / RULES_TICK_RATE
+    ticks = int(seconds / tick_interval)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for seq in range(1, ticks + 1):
+            track_ball(room)
+            room.update()
+            values = layout.values(room.game_state)
+            keyframe_bytes += clients * (4 + len(layout.encode_keyframe(seq, values)))
+            for encoder, decoder, lag in zip(encoders, decoders, lags):
+                payload = encoder.encode(seq, values)
+                delta_bytes += 4 + len(payload)
+                decoder.decode(payload)
+                if seq > lag:
+                    encoder.acknowledge(seq - lag)
+
+    per_client = lambda total: total / clients / (ticks * tick_interval)
+    deltas = sum(e.deltas for e in encoders)
+    keyframes = sum(e.keyframes for e in encoders)
+    print(f"{clients} clients, {ticks} ticks, ack lag 1-{max_ack_lag} ticks")
+    print(f"  keyframes only: {per_client(keyframe_bytes):8.0f} B/s per client")
+    print(f"  delta:          {per_client(delta_bytes):8.0f} B/s per client "
+          f"({deltas} deltas, {keyframes} keyframes, {delta_bytes / keyframe_bytes:.0%} of keyframe bytes)")
+
+
+class HeadlessPlayer(threading.Thread):
+    """Minimal protocol client that plays along and records when new snapshots arrive.
+
+    It sends like pong_client: moves coalesced per INPUT_INTERVAL plus a
+    keepalive, or with `every_frame` like clients used to, an INPUT every frame.
+    """
+
+    def __init__(self, port, udp, seconds, every_frame=False):
+        super().__init__(daemon=True)
+        self.port = port
+        self.udp = udp
+        self.seconds = seconds
+        self.every_frame = every_frame
+        self.arrivals = []  # Local time of every snapshot newer than the last one
+        self.sends = 0  # Writes and datagrams to the server
+        self.bytes_sent = 0
+        self.frames = 0
+
+    def run(self):
+        while True:
+            tcp = socket.create_connection(('127.0.0.1', self.port))
+            set_nodelay(tcp)
+            tcp.sendall(pack_frame(encode_hello(self.udp)))
+            welcome = recv_frame(tcp)
+            if welcome[:1] == bytes([MSG_WELCOME]):
+                break
+            # HELLO was "lost" past the server's negotiation timeout, so we got a legacy welcome
+            tcp.close()
+        player_id, config = decode_welcome(welcome)
+        tcp.setblocking(False)
+        udp = None
+        if config['udp_token'] is not None:
+            udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            udp.connect(('127.0.0.1', self.port))
+            udp.setblocking(False)
+        if udp is not None or not self.every_frame:
+            tcp.sendall(pack_frame(encode_control(True, True)))
+
+        frames = FrameBuffer()
+        datagram = bytearray(2048)
+        layout = snapshot_layout(config['rules'])
+        snapshots = SnapshotDecoder(layout)
+        paddle_height = config['rules'].paddle_height
+        state = None
+        input_seq = 0
+        moves = []  # Not sent yet
+        last_send = 0.0
+        out = bytearray()
+        end = time.monotonic() + self.seconds
+        while time.monotonic() < end:
+            try:
+                while True:
+                    if not frames.recv_into(tcp):
+                        return
+            except BlockingIOError:
+                pass
+            payloads = frames.pop_frames()
+            if udp is not None:
+                try:
+                    while True:
+                        payloads.append(bytes(datagram[:udp.recv_into(datagram)]))
+                except OSError:
+                    pass
+
+            for payload in payloads:
+                if message_type(payload) == MSG_PING:
+                    now = time.monotonic()
+                    out += pack_frame(encode_pong(decode_ping(payload), now, now))
+                    continue
+                if snapshots.is_stale(payload):
+                    continue
+                seq, values = snapshots.decode(payload)
+                self.arrivals.append(time.monotonic())
+                previous, state = state, layout.state(values)
+                if previous is not None and previous['status'] == 'game_over' and not self.every_frame:
+                    out += pack_frame(encode_control(True, True))  # The restart cleared our flags
+
+            # Follow the ball so rallies keep going, resting while it is roughly lined up;
+            # always ready / play again
+            move = 0
+            if state is not None:
+                gap = state['balls'][0]['y'] - paddle_height / 2 - state['paddles'][player_id]['y']
+                if abs(gap) > paddle_height / 4:
+                    move = int(max(-10, min(gap, 10)))
+            if move or self.every_frame:
+                input_seq += 1
+                moves.append((input_seq, move))
+            view_tick = state['tick'] if state is not None else 0
+            now = time.monotonic()
+            self.frames += 1
+            if self.every_frame or now - last_send >= KEEPALIVE_INTERVAL or (
+                    moves and now - last_send >= INPUT_INTERVAL):
+                last_send = now
+                if udp is not None:
+                    prefix = DATAGRAM_TOKEN.pack(config['udp_token'])
+                    self.bytes_sent += udp.send(prefix + encode_inputs(snapshots.latest_seq, moves, view_tick))
+                    self.sends += 1
+                elif self.every_frame:
+                    out += pack_frame(encode_input(snapshots.latest_seq, input_seq, move, True, True, view_tick))
+                else:
+                    out += pack_frame(encode_inputs(snapshots.latest_seq, moves, view_tick))
+                moves = []
+            if out:
+                tcp.sendall(out)
+                self.sends += 1
+                self.bytes_sent += len(out)
+                out.clear()
+            time.sleep(1 / 60)
+        tcp.close()
+
+
+def bench_freeze(losses, latency, seconds, freeze_threshold):
+    """Snapshot gaps seen by a player through a lossy proxy, TCP vs UDP transport"""
+    out = sys.stdout
+    # The server and proxy log from their own threads, so keep stdout quiet for the whole run
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = PongServer(host='127.0.0.1', port=0, udp=True)
+        threading.Thread(target=server.start, daemon=True).start()
+
+        print(f"one-way latency {latency * 1000:.0f} ms, {seconds:.0f} s per run, "
+              f"freeze = snapshot gap over {freeze_threshold * 1000:.0f} ms", file=out)
+        print(f"{'transport':>9} {'loss':>5} {'snapshots':>10} {'gap p99':>9} {'gap max':>9} "
+              f"{'freezes':>8} {'frozen':>8}", file=out)
+        for loss in losses:
+            for udp in (False, True):
+                proxy = LossyProxy(0, ('127.0.0.1', server.port), loss, latency)
+                proxy.ready = threading.Event()
+                threading.Thread(target=asyncio.run, args=(proxy.serve(),), daemon=True).start()
+                proxy.ready.wait()
+
+                players = [HeadlessPlayer(proxy.listen_port, udp, seconds) for _ in range(2)]
+                for player in players:
+                    player.start()
+                for player in players:
+                    player.join()
+                while server.rooms:
+                    time.sleep(0.01)  # Let the server see them leave, or the next pair joins their rooms
+
+                arrivals = players[0].arrivals
+                gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+                freezes = [gap for gap in gaps if gap > freeze_threshold]
+                print(f"{'udp' if udp else 'tcp':>9} {loss:>5.0%} {len(arrivals):>10} "
+                      f"{percentile(gaps, 99) * 1000:>7.0f}ms {max(gaps) * 1000:>7.0f}ms "
+                      f"{len(freezes):>8} {sum(freezes):>7.2f}s", file=out)
+
+
+def playing_room(room_id):
+    """A GameRoom with two fake players, mid-match"""
+    room = GameRoom(room_id, seed=room_id)
+    room.players = (NullConnection(), NullConnection())
+    room.update()
+    room.start_game()
+    return room
+
+
+def wobble_paddles(rooms, rng):
+    """Paddles chase the ball with some error, so there are long rallies and misses"""
+    for room in rooms:
+        state = room.game_state
+        target = state['balls'][0]['y'] - room.rules.paddle_height / 2
+        for paddle in state['paddles']:
+            paddle['y'] = target + rng.uniform(-100, 100)
+
+
+def check_batch(matches, ticks, seed):
+    """Step the same matches with GameRoom.update and BatchPhysics; every float must match exactly"""
+    from pong_batch import BatchPhysics  # NumPy is only needed by the batch and particle benchmarks
+
+    rng = random.Random(seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        rooms = [playing_room(i) for i in range(matches)]
+    physics = BatchPhysics(matches, seed=seed)
+    for i, room in enumerate(rooms):
+        physics.load_room(i, room.game_state)
+
+    hits = scores = wins = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for tick in range(ticks):
+            wobble_paddles(rooms, rng)
+            for i, room in enumerate(rooms):
+                physics.paddle1_y[i], physics.paddle2_y[i] = (paddle['y'] for paddle in room.game_state['paddles'])
+            multipliers = [room.game_state['balls'][0]['multiplier'] for room in rooms]
+            for room in rooms:
+                room.update()
+            scored1, scored2 = physics.step()
+
+            for i, room in enumerate(rooms):
+                state = room.game_state
+                ball = state['balls'][0]
+                if ball['multiplier'] > multipliers[i]:
+                    hits += 1
+                if scored1[i] or scored2[i]:
+                    # The serve is random on both sides; carry the scalar one over
+                    scores += 1
+                    physics.ball_dx[i] = ball['dx']
+                    physics.ball_dy[i] = ball['dy']
+
+                expected = (ball['x'], ball['y'], ball['dx'], ball['dy'], ball['multiplier'],
+                            *state['scores'], state['status'] == 'playing')
+                actual = (physics.ball_x[i], physics.ball_y[i], physics.ball_dx[i], physics.ball_dy[i],
+                          physics.multiplier[i], physics.score1[i], physics.score2[i], physics.playing[i])
+                if expected != actual:
+                    raise AssertionError(f"match {i} diverged at tick {tick}: {expected} != {actual}")
+
+                if state['status'] == 'game_over':
+                    wins += 1
+                    room.restart_game()
+                    room.start_game()
+                    physics.load_room(i, state)
+
+    print(f"✅ {matches} matches x {ticks} ticks identical "
+          f"({hits} paddle hits, {scores} points, {wins} matches won)")
+
+
+def bench_batch(match_counts, seconds):
+    """Match-steps per second: GameRoom.update one room at a time vs BatchPhysics.step"""
+    from pong_batch import BatchPhysics
+
+    print(f"{'matches':>8} {'scalar steps/s':>15} {'batch steps/s':>14} {'speedup':>8}")
+    for count in match_counts:
+        with contextlib.redirect_stdout(io.StringIO()):
+            rooms = [playing_room(i) for i in range(count)]
+            steps = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                for room in rooms:
+                    track_ball(room)
+                    room.update()
+                steps += count
+            scalar_rate = steps / (time.perf_counter() - start)
+
+        physics = BatchPhysics(count)
+        physics.playing[:] = True
+        physics.reset_balls(physics.playing.copy())
+        steps = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            physics.step()
+            physics.paddle1_y[:] = physics.ball_y - physics.paddle_height / 2  # Keep rallies going
+            physics.paddle2_y[:] = physics.paddle1_y
+            steps += count
+        batch_rate = steps / (time.perf_counter() - start)
+
+        print(f"{count:>8} {scalar_rate:>15,.0f} {batch_rate:>14,.0f} {batch_rate / scalar_rate:>7.1f}x")
+
+
+def aim_shot(rng, state, multiplier):
+    """A ball flying at the left paddle at full base speed, with the paddle placed to meet it.
+
+    Works out where the ball will cross the paddle face, folding the path at the
+    walls, and centres paddle 1 on that point (give or take 40 px).
+    """
+    ball = state['balls'][0]
+    radius = CLASSIC.ball_radius
+    left_face = CLASSIC.faces[0]
+    top, bottom = radius, CLASSIC.height - radius
+
+    ball['x'] = rng.uniform(left_face + 1, CLASSIC.width / 2)
+    ball['y'] = rng.uniform(top, bottom)
+    ball['dx'] = -CLASSIC.max_speed
+    ball['dy'] = rng.uniform(-CLASSIC.max_speed, CLASSIC.max_speed)
+    ball['multiplier'] = multiplier
+
+    ticks_to_face = (ball['x'] - left_face) / -ball['dx']
+    span = bottom - top
+    unfolded = (ball['y'] - top + ball['dy'] * ticks_to_face) % (2 * span)
+    crossing_y = top + (unfolded if unfolded <= span else 2 * span - unfolded)
+    state['paddles'][0]['y'] = crossing_y - CLASSIC.paddle_height / 2 + rng.uniform(-40, 40)
+    state['paddles'][1]['y'] = -1000  # Out of the way: the return shot should score
+
+
+def check_tunnel(multipliers, shots, seed):
+    """Fire balls at a paddle that is in the way, at extreme speeds; none may get through"""
+    from pong_batch import BatchPhysics
+
+    rng = random.Random(seed)
+    print(f"{'multiplier':>10} {'px/tick':>8} {'shots':>6} {'scalar hits':>12} {'batch hits':>11} {'tunnelled':>10}")
+    for multiplier in multipliers:
+        with contextlib.redirect_stdout(io.StringIO()):
+            rooms = [playing_room(i) for i in range(shots)]
+        physics = BatchPhysics(shots, seed=seed)
+        for i, room in enumerate(rooms):
+            aim_shot(rng, room.game_state, multiplier)
+            physics.load_room(i, room.game_state)
+
+        # A shot is over once the paddle returned it (faster ball) or somebody scored.
+        # At high speed the return can cross the court and score in the same tick.
+        scalar_hits = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for room in rooms:
+                state = room.game_state
+                for _ in range(1000):
+                    room.update()
+                    if state['balls'][0]['multiplier'] != multiplier or state['scores'][1]:
+                        break
+                returned = state['scores'][0] or state['balls'][0]['multiplier'] > multiplier
+                if returned and not state['scores'][1]:
+                    scalar_hits += 1
+
+        for _ in range(1000):
+            physics.step()
+            if ((physics.multiplier != multiplier) | (physics.score2 > 0)).all():
+                break
+        returned = (physics.score1 > 0) | (physics.multiplier > multiplier)
+        batch_hits = int((returned & (physics.score2 == 0)).sum())
+
+        tunnelled = shots - min(scalar_hits, batch_hits)
+        step = CLASSIC.max_speed * multiplier
+        print(f"{multiplier:>10g} {step:>8.0f} {shots:>6} {scalar_hits:>12} {batch_hits:>11} {tunnelled:>10}")
+        if tunnelled:
+            raise AssertionError(f"{tunnelled} balls tunnelled through the paddle at x{multiplier:g}")
+    print("✅ no ball got past a paddle that was in its way")
+
+
+class LegacyParticle:
+    """The client's original one-object-per-particle implementation, kept as a baseline"""
+
+    def __init__(self, x, y, color):
+        self.x = x
+        self.y = y
+        self.vx = random.uniform(-3, 3)
+        self.vy = random.uniform(-3, 3)
+        self.life = 30
+        self.color = color
+        self.size = random.randint(2, 5)
+
+    def update(self):
+        self.x += self.vx
+        self.y += self.vy
+        self.life -= 1
+        self.size = max(1, self.size * 0.95)
+
+    def draw(self, screen):
+        import pygame
+        alpha = int((self.life / 30) * 255)
+        if alpha > 0:
+            s = pygame.Surface((self.size * 2, self.size * 2), pygame.SRCALPHA)
+            pygame.draw.circle(s, (*self.color, alpha), (self.size, self.size), self.size)
+            screen.blit(s, (int(self.x - self.size), int(self.y - self.size)))
+
+
+def bench_particles(counts, frames):
+    """Frame time for updating and drawing N live particles: Particle objects vs ParticlePool"""
+    import pygame
+    from pong_render import ParticlePool
+
+    screen = pygame.Surface((800, 600))
+    color = (255, 255, 100)
+    burst = 15  # What create_particles spawns per bounce
+
+    def run(particles, spawn, step):
+        # Warm up to a steady population, then time whole frames
+        for _ in range(ParticlePool.LIFE):
+            spawn(particles)
+            step(particles)
+        start = time.perf_counter()
+        for _ in range(frames):
+            spawn(particles)
+            step(particles)
+        return (time.perf_counter() - start) / frames * 1000
+
+    def spawn_objects(particles, count):
+        while len(particles) < count:
+            x, y = random.uniform(0, 800), random.uniform(0, 600)
+            particles.extend(LegacyParticle(x, y, color) for _ in range(burst))
+
+    def step_objects(particles):
+        for particle in particles[:]:
+            particle.update()
+            particle.draw(screen)
+            if particle.life <= 0:
+                particles.remove(particle)
+
+    def spawn_pool(pool, count):
+        while len(pool) < count and len(pool) < pool.capacity:
+            pool.emit(random.uniform(0, 800), random.uniform(0, 600), burst, color)
+
+    def step_pool(pool):
+        pool.update()
+        pool.draw(screen)
+
+    print(f"{'particles':>9} {'objects ms/frame':>17} {'pool ms/frame':>14} {'speedup':>8}")
+    for count in counts:
+        objects = run([], lambda p: spawn_objects(p, count), step_objects)
+        pool = run(ParticlePool(capacity=count + burst), lambda p: spawn_pool(p, count), step_pool)
+        print(f"{count:>9} {objects:>17.2f} {pool:>14.2f} {objects / pool:>7.1f}x")
+
+
+def scripted_inputs(rng, state, seq):
+    """One tick of messages from two fair players: chase the ball, ready up, play again.
+
+    Player 1 sends absolute positions like a legacy client, player 2 sequenced moves.
+    """
+    target = state['balls'][0]['y'] - CLASSIC.paddle_height / 2
+    move = target + rng.uniform(-60, 60) - state['paddles'][1]['y']
+    return [(0, {'paddle_y': target + rng.uniform(-60, 60), 'ready': True, 'play_again': True}),
+            (1, {'moves': [(seq, move)], 'ready': True, 'play_again': True})]
+
+
+def run_matches(matches, ticks, seed, digest=None):
+    """Play seeded matches with scripted inputs; feeds every tick's state into `digest`"""
+    sim = MatchSimulation()
+    for match in range(matches):
+        rng = random.Random(f"{seed}:{match}")
+        state = sim.new_state(seed=seed * 1000003 + match)
+        sim.players_joined(state)
+        for tick in range(1, ticks + 1):
+            sim.step(state, scripted_inputs(rng, state, tick))
+            if digest is not None:
+                digest.update(pickle.dumps(state))
+        sim.events.clear()
+
+
+def check_sim(matches, ticks, seed):
+    """The same seed and inputs must give byte-identical matches, here and in a fresh process"""
+    digests = []
+    for _ in range(2):
+        digest = hashlib.sha256()
+        run_matches(matches, ticks, seed, digest)
+        digests.append(digest.hexdigest())
+
+    # Another interpreter, with different hash randomization
+    env = dict(os.environ, PYTHONHASHSEED=str(seed + 1))
+    result = subprocess.run([sys.executable, __file__, 'sim', '--digest', '--matches', str(matches),
+                             '--ticks', str(ticks), '--seed', str(seed)],
+                            env=env, capture_output=True, text=True, check=True)
+    digests.append(result.stdout.strip())
+
+    if len(set(digests)) != 1:
+        raise AssertionError(f"runs diverged: {digests}")
+    print(f"✅ {matches} matches x {ticks} ticks byte-identical across 3 runs ({digests[0][:16]})")
+
+
+def bench_sim(matches, ticks, seed):
+    """Offline simulation speed: no sockets, no threads, no clock"""
+    start = time.perf_counter()
+    run_matches(matches, ticks, seed)
+    elapsed = time.perf_counter() - start
+    steps = matches * ticks
+    game_seconds = steps / RULES_TICK_RATE
+    print(f"{steps:,} steps in {elapsed:.2f}s: {steps / elapsed:,.0f} steps/s, "
+          f"{game_seconds / elapsed:,.0f}x real time")
+
+
+def bench_spectators(viewer_counts, slow_fraction, seconds, use_async):
+    """Fan one match out to many spectators, some of which never read.
+
+    Reports what the fast viewers received, how the slow ones were throttled
+    and dropped, the cost of a broadcast, and whether the players noticed.
+    """
+    out = sys.stdout
+    server_class = AsyncPongServer if use_async else PongServer
+    # Players and viewers hang up mid-stream at the end of each run; keep the server's logs quiet
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        print(f"{server_class.__name__}, {seconds:.0f} s per run, {slow_fraction:.0%} of viewers never read",
+              file=out)
+        print(f"{'viewers':>8} {'snap/s':>7} {'min':>5} {'throttled':>10} {'dropped':>8} "
+              f"{'bcast avg':>10} {'bcast p99':>10} {'player gap p99':>15} {'max':>7}", file=out)
+        for count in viewer_counts:
+            server = server_class(host='127.0.0.1', port=0)
+            broadcast = server.broadcast
+            timings = []
+
+            def timed_broadcast(room):
+                start = time.perf_counter()
+                broadcast(room)
+                timings.append(time.perf_counter() - start)
+            server.broadcast = timed_broadcast
+            threading.Thread(target=server.start, daemon=True).start()
+
+            players = [HeadlessPlayer(server.port, False, seconds + 1) for _ in range(2)]
+            for player in players:
+                player.start()
+            while not any(room.is_full() for room in list(server.rooms.values())):
+                time.sleep(0.01)
+            room = next(room for room in list(server.rooms.values()) if room.is_full())
+
+            slow = int(count * slow_fraction)
+            selector = selectors.DefaultSelector()
+            decoders = {}
+            received = {}
+            sockets = []
+            for i in range(count):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                if i < slow:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 2048)
+                sock.connect(('127.0.0.1', server.port))
+                sock.sendall(pack_frame(encode_spectate(room.room_id)))
+                sockets.append(sock)
+                if i >= slow:
+                    sock.setblocking(False)
+                    selector.register(sock, selectors.EVENT_READ, FrameBuffer())
+                    received[sock] = 0
+                    if i < slow + 10:
+                        decoders[sock] = SnapshotDecoder(room.layout)  # These check every delta applies
+
+            start = time.monotonic()
+            end = start + seconds
+            while time.monotonic() < end:
+                for key, _ in selector.select(timeout=0.05):
+                    sock, frames = key.fileobj, key.data
+                    try:
+                        chunk = sock.recv(65536)
+                    except BlockingIOError:
+                        continue
+                    frames.feed(chunk)
+                    for payload in frames.pop_frames():
+                        if payload[:1] == bytes([MSG_WELCOME]):
+                            continue
+                        received[sock] += 1
+                        decoder = decoders.get(sock)
+                        if decoder is not None:
+                            decoder.decode(payload)
+            elapsed = time.monotonic() - start
+
+            for player in players:
+                player.join()
+            server.running = False
+            for sock in sockets:
+                sock.close()
+
+            rates = [n / elapsed for n in received.values()]
+            arrivals = players[0].arrivals
+            gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+            feed = room.spectators
+            print(f"{count:>8} {statistics.mean(rates):>7.1f} {min(rates):>5.1f} {feed.throttled:>10} "
+                  f"{feed.dropped:>4}/{slow:<3} {statistics.mean(timings) * 1000:>8.2f}ms "
+                  f"{percentile(timings, 99) * 1000:>8.2f}ms {percentile(gaps, 99) * 1000:>13.0f}ms "
+                  f"{max(gaps) * 1000:>5.0f}ms", file=out)
+
+
+def bench_metrics(room_counts, seconds, log_rate):
+    """Scheduler cost with the hit log off, on, and rate-limited, and the cost of a scrape"""
+    modes = [('INFO', 0), ('DEBUG', 0), ('DEBUG', log_rate)]
+    print(f"{'rooms':>6} {'log':>14} {'cpu/room/tick':>14} {'tick p50':>9} {'lines/s':>8} "
+          f"{'suppressed':>11} {'scrape':>8} {'bytes':>7}")
+    for count in room_counts:
+        for level, rate in modes:
+            sink = io.StringIO()
+            limiter = configure_logging(level, rate, sink)
+            server = PongServer(host='127.0.0.1', port=0, max_rooms=count)
+            server.server.close()
+            fill_rooms(server, count)
+            server.metrics.collector(limiter.collect)
+
+            cpu_start = time.process_time()
+            wall_start = time.monotonic()
+            while time.monotonic() - wall_start < seconds:
+                for room in server.rooms.values():
+                    track_ball(room)
+                time.sleep(server.tick_rooms(time.monotonic()))
+            cpu = time.process_time() - cpu_start
+            wall = time.monotonic() - wall_start
+
+            start = time.perf_counter()
+            text = server.metrics.render()
+            scrape = time.perf_counter() - start
+            stop_logging()
+
+            # Median tick from the histogram's buckets
+            ticks = server.tick_seconds
+            cumulative = 0
+            for bound, n in zip(ticks.buckets, ticks.counts):
+                cumulative += n
+                if cumulative >= ticks.count / 2:
+                    break
+            label = f"{level}" + (f" @ {rate:.0f}/s" if rate else "")
+            print(f"{count:>6} {label:>14} {cpu / (server.clock.tick * count) * 1e6:>12.1f}us "
+                  f"{'<' + format(bound * 1000, '.2f'):>7}ms {sink.getvalue().count(chr(10)) / wall:>8.0f} "
+                  f"{limiter.suppressed:>11} {scrape * 1000:>6.2f}ms {len(text):>7}")
+
+
+def play_lagged(rtt_ticks, interp_ticks, rewind_window, ticks, seed):
+    """Two players behind a symmetric link of `rtt_ticks`, each chasing the ball they see.
+
+    A player sees the server's state from half the round trip plus the
+    interpolation delay ago, moves their own paddle at once, and their inputs
+    reach the server half a round trip later. Returns (points, robbed, rewinds):
+    robbed counts points given away on balls the loser saw their paddle block.
+    """
+    rng = random.Random(seed)
+    sim = MatchSimulation(rewind_window=rewind_window)
+    state = sim.new_state(seed)
+    sim.players_joined(state)
+    sim.start_game(state)
+    up = rtt_ticks // 2
+    view_lag = rtt_ticks - up + interp_ticks
+    ph = sim.rules.paddle_height
+    faces = sim.rules.faces
+
+    history = [(0, 400, 300)]  # Per tick: (serve, ball x, ball y)
+    in_flight = deque()  # (arrival tick, player, message)
+    paddles = [250.0, 250.0]  # Each client's predicted paddle
+    on_screen = [{}, {}]  # Per player: view tick -> where they had their paddle
+    aim = [0.0, 0.0]
+    seqs = [0, 0]
+    lost = []  # (player, serve) of every point conceded
+    rewinds = 0
+    for tick in range(1, ticks + 1):
+        view = max(0, tick - 1 - view_lag)
+        y = history[view][2]
+        for player in (0, 1):
+            if rng.random() < 0.02:
+                aim[player] = rng.uniform(-45, 45)  # Where on the paddle they try to take the ball
+            target = y - ph / 2 + aim[player]
+            move = int(max(-10, min(target - paddles[player], 10)))
+            paddles[player] = max(0, min(paddles[player] + move, sim.rules.height - ph))
+            on_screen[player][view] = paddles[player]
+            seqs[player] += 1
+            in_flight.append((tick + up, player, {'moves': [(seqs[player], move)], 'view_tick': view}))
+
+        inputs = []
+        while in_flight and in_flight[0][0] <= tick:
+            inputs.append(in_flight.popleft()[1:])
+        serve = state['serves']
+        sim.step(state, inputs)
+        for kind, *details in sim.events:
+            if kind == 'rewind':
+                rewinds += 1
+            elif kind == 'score':
+                lost.append((1 - details[0], serve))
+            elif kind == 'win':
+                sim.restart_game(state)
+                sim.start_game(state)
+        sim.events.clear()
+        ball = state['balls'][0]
+        history.append((state['serves'], ball['x'], ball['y']))
+
+    # Where the ball of each lost point got past the paddle, and what the loser saw there
+    crossings = {}  # (player, serve) -> (tick, y)
+    for tick in range(1, len(history)):
+        (serve, x0, y0), (next_serve, x1, y1) = history[tick - 1], history[tick]
+        for player, face in enumerate(faces):
+            passed = x0 > face >= x1 if player == 0 else x0 < face <= x1
+            if passed and serve == next_serve:
+                crossings[(player, serve)] = (tick, y0 + (y1 - y0) * (face - x0) / (x1 - x0))
+    robbed = 0
+    for player, serve in lost:
+        tick, y = crossings.get((player, serve), (None, None))
+        paddle = on_screen[player].get(tick)
+        robbed += paddle is not None and paddle <= y <= paddle + ph
+    return len(lost), robbed, rewinds
+
+
+def check_lag(rtts_ms, interp_delay, rewind_window, seconds, seed):
+    """Points conceded on balls the player saw themselves block, without and with lag compensation"""
+    ticks = int(seconds * RULES_TICK_RATE)
+    interp_ticks = round(interp_delay * RULES_TICK_RATE)
+    print(f"{seconds:.0f} s of play per run, interpolation delay {interp_delay * 1000:.0f} ms, "
+          f"rewind window {rewind_window * 1000:.0f} ms")
+    print(f"{'rtt':>6} {'points':>7} {'robbed':>7} {'| rewind:':>9} {'points':>7} {'robbed':>7} {'rewinds':>8}")
+    for rtt_ms in rtts_ms:
+        rtt_ticks = round(rtt_ms / 1000 * RULES_TICK_RATE)
+        plain = play_lagged(rtt_ticks, interp_ticks, 0.0, ticks, seed)
+        rewound = play_lagged(rtt_ticks, interp_ticks, rewind_window, ticks, seed)
+        print(f"{rtt_ms:>4}ms {plain[0]:>7} {plain[1]:>7} {'|':>9} {rewound[0]:>7} {rewound[1]:>7} {rewound[2]:>8}")
+
+
+def process_cpu(pid):
+    """CPU seconds (user + system) a process has used so far; Linux only"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def bench_inputs(pair_counts, seconds, use_async):
+    """Client -> server messages and server CPU, inputs every frame vs on change with a keepalive.
+
+    The server runs as its own process so its CPU can be read apart from the
+    bot players', which all live in this one.
+    """
+    print(f"{'AsyncPongServer' if use_async else 'PongServer'}, {seconds:.0f} s per run")
+    print(f"{'players':>8} {'inputs':>12} {'msgs/s':>7} {'frames/s':>9} {'bytes in/s':>11} "
+          f"{'server cpu':>11} {'per player':>11}")
+    for pairs in pair_counts:
+        for every_frame in (True, False):
+            with socket.socket() as probe:
+                probe.bind(('127.0.0.1', 0))
+                port = probe.getsockname()[1]
+            command = [sys.executable, 'pong_server.py', '--host', '127.0.0.1', '--port', str(port)]
+            if use_async:
+                command.append('--async')
+            server = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+                                      cwd=os.path.dirname(os.path.abspath(__file__)))
+            server.stdout.readline()  # Listening once it says so
+            threading.Thread(target=server.stdout.read, daemon=True).start()  # Never let its log block it
+
+            players = [HeadlessPlayer(port, False, seconds + 2, every_frame) for _ in range(2 * pairs)]
+            for player in players:
+                player.start()
+            time.sleep(1)  # Let every match get going
+            sends = sum(player.sends for player in players)
+            frames = sum(player.frames for player in players)
+            sent = sum(player.bytes_sent for player in players)
+            cpu_start = process_cpu(server.pid)
+            time.sleep(seconds)
+            cpu = process_cpu(server.pid) - cpu_start
+            sends = sum(player.sends for player in players) - sends
+            frames = sum(player.frames for player in players) - frames
+            sent = sum(player.bytes_sent for player in players) - sent
+            for player in players:
+                player.join()
+            server.send_signal(signal.SIGINT)
+            server.wait()
+
+            count = len(players)
+            label = 'every frame' if every_frame else 'on change'
+            print(f"{count:>8} {label:>12} {sends / seconds / count:>7.1f} {frames / seconds / count:>9.1f} "
+                  f"{sent / seconds / count:>11.0f} {cpu / seconds:>10.1%} {cpu / seconds / count * 1000:>8.2f}ms/s")
+
+
+class CheckedConnection(NullConnection):
+    """Player whose every snapshot is decoded and compared with what its room published.
+
+    Acks come from the thread playing it, through the input path, like a real client's.
+    """
+
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = errors
+        self.room = None
+        self.player_id = None
+        self.layout = snapshot_layout(CLASSIC)
+        self.decoder = SnapshotDecoder(self.layout)
+        self.frames = FrameBuffer()
+        self.seen_seq = 0  # Newest snapshot decoded, for the player thread to ack
+        self.sent_seq = 0  # Newest input the player thread has handed over
+        self.input_seq = 0  # Own paddle's input_seq in the newest snapshot
+        self.snapshots = 0
+
+    def send_snapshot(self, msg):
+        self.traffic.count_out(len(msg))
+        self.frames.feed(msg)
+        for frame in self.frames.pop_frames():
+            if message_type(frame) == MSG_PING:
+                continue
+            published = self.room.snapshot
+            seq, values = self.decoder.decode(bytes(frame))
+            self.snapshots += 1
+            if (seq, values) != SnapshotDecoder(self.layout).decode(self.layout.encode_keyframe(*published[:2])):
+                self.errors.append(f"room {self.room.room_id}: decoded snapshot {seq} "
+                                   f"differs from published {published.seq}")
+            y, input_seq = values[6 + self.player_id], values[11 + self.player_id]
+            if y != 250:
+                self.errors.append(f"room {self.room.room_id}: paddle {self.player_id + 1} at {y} mid-message")
+            if not self.input_seq <= input_seq <= self.sent_seq:
+                self.errors.append(f"room {self.room.room_id}: paddle {self.player_id + 1} input {input_seq} "
+                                   f"outside {self.input_seq}..{self.sent_seq}")
+            self.seen_seq, self.input_seq = seq, input_seq
+
+
+def stress_player(server, errors, stop, rng, counts):
+    """Join, send inputs as fast as possible for a while, leave, and again until stopped.
+
+    Every INPUTS message moves the paddle 7 up and 7 back down in pairs, so a
+    snapshot that caught a message half applied shows a paddle off 250.
+    """
+    try:
+        while not stop.is_set():
+            conn = CheckedConnection(errors)
+            room, player_id = server.join_room(conn)
+            if room is None:
+                time.sleep(0.001)
+                continue
+            conn.room, conn.player_id = room, player_id
+            counts['joins'] += 1
+            for _ in range(rng.randint(100, 2000)):
+                if stop.is_set():
+                    break
+                if rng.random() < 0.05:
+                    payload = encode_control(True, True)
+                else:
+                    moves = []
+                    for _ in range(rng.randint(1, 4)):
+                        moves.append((conn.sent_seq + 1, 7))
+                        moves.append((conn.sent_seq + 2, -7))
+                        conn.sent_seq += 2
+                    payload = encode_inputs(conn.seen_seq, moves)
+                server.handle_message(conn, room, player_id, payload)
+                counts['messages'] += 1
+                if rng.random() < 0.5:
+                    time.sleep(0.002)  # Bursts, like a read's worth of frames at once
+            server.leave_room(room, player_id)
+            counts['snapshots'] += conn.snapshots
+    except Exception as e:
+        errors.append(f"player thread: {e!r}")
+
+
+def watch_snapshots(server, errors, stop, counts):
+    """Read every room's published snapshot without locking, as the metrics endpoint does"""
+    last_seq = {}
+    while not stop.is_set():
+        for room in list(server.rooms.values()):
+            snapshot = room.snapshot
+            if snapshot is None:
+                continue
+            if snapshot.seq < last_seq.get(room.room_id, 0):
+                errors.append(f"room {room.room_id}: snapshot {snapshot.seq} after {last_seq[room.room_id]}")
+            last_seq[room.room_id] = snapshot.seq
+            if STATUS_CODES[snapshot.status] != snapshot.values[10] & STATUS_MASK:
+                errors.append(f"room {room.room_id}: snapshot {snapshot.seq} status disagrees with its flags")
+            counts['reads'] += 1
+        server.metrics.render()
+        counts['scrapes'] += 1
+
+
+def check_stress(thread_counts, rooms, seconds, seed):
+    """Many threads hammer inputs, joins and leaves while the scheduler ticks; every snapshot must add up"""
+    print(f"{'threads':>8} {'ticks':>6} {'joins':>7} {'messages':>9} {'snapshots':>10} {'reads':>8} "
+          f"{'scrapes':>8} {'errors':>7}")
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)  # Let threads interleave far more often than usual
+    try:
+        for count in thread_counts:
+            with contextlib.redirect_stdout(io.StringIO()):
+                server = PongServer(host='127.0.0.1', port=0, max_rooms=rooms, seed=seed)
+                server.server.close()
+            logging.getLogger('pong').disabled = True  # Thousands of joins and leaves
+            errors = []
+            tallies = [Counter() for _ in range(count + 1)]  # One per thread, summed afterwards
+            stop = threading.Event()
+            threads = [threading.Thread(target=stress_player,
+                                        args=(server, errors, stop, random.Random(f"{seed}:{i}"), tallies[i]))
+                       for i in range(count)]
+            threads.append(threading.Thread(target=watch_snapshots, args=(server, errors, stop, tallies[-1])))
+            for thread in threads:
+                thread.start()
+            end = time.monotonic() + seconds
+            try:
+                while time.monotonic() < end:
+                    time.sleep(server.tick_rooms(time.monotonic()))
+            finally:
+                stop.set()
+                for thread in threads:
+                    thread.join()
+                logging.getLogger('pong').disabled = False
+            counts = sum(tallies, Counter())
+            print(f"{count:>8} {server.clock.tick:>6} {counts['joins']:>7} {counts['messages']:>9} "
+                  f"{counts['snapshots']:>10} {counts['reads']:>8} {counts['scrapes']:>8} {len(errors):>7}")
+            if errors:
+                raise AssertionError(f"{len(errors)} inconsistencies, first: {errors[0]}")
+    finally:
+        sys.setswitchinterval(switch_interval)
+    print("✅ Every snapshot decoded to what was published, with inputs applied whole and in order")
+
+
+class ResumePlayer:
+    """Blocking protocol client that can drop its connection abruptly and RESUME"""
+
+    def __init__(self, port):
+        self.port = port
+        self.sock = None
+        self.player_id = self.config = None
+        self.decoder = None
+        self.frames = FrameBuffer()
+        self.state = None
+        self.first_snapshot = None  # Message type of the first snapshot on the current connection
+
+    def connect(self, hello):
+        self.sock = socket.create_connection(('127.0.0.1', self.port))
+        set_nodelay(self.sock)
+        self.sock.sendall(pack_frame(hello))
+        self.player_id, self.config = decode_welcome(recv_frame(self.sock))
+        self.sock.settimeout(0.1)
+        self.layout = snapshot_layout(self.config['rules'])
+        self.decoder = SnapshotDecoder(self.layout)
+        self.frames = FrameBuffer()
+        self.first_snapshot = None
+
+    def drop(self):
+        """Vanish with a reset, as a connection lost mid-match looks to the server"""
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, b'\x01\x00\x00\x00\x00\x00\x00\x00')
+        self.sock.close()
+
+    def read_until(self, done, timeout=15.0):
+        """Read (and ack) snapshots until done(state) holds; every state seen meanwhile is returned"""
+        seen = []
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            try:
+                if not self.frames.recv_into(self.sock):
+                    raise ConnectionError("server closed the connection")
+            except socket.timeout:
+                pass
+            for payload in self.frames.pop_frames():
+                if message_type(payload) == MSG_PING:
+                    continue
+                if self.first_snapshot is None:
+                    self.first_snapshot = message_type(payload)
+                _, values = self.decoder.decode(bytes(payload))
+                self.state = self.layout.state(values)
+                seen.append(self.state)
+            self.sock.sendall(pack_frame(encode_inputs(self.decoder.latest_seq, [])))
+            if self.state is not None and done(self.state):
+                return seen
+        raise AssertionError(f"player {self.player_id + 1} timed out, last status "
+                             f"{self.state and self.state['status']}")
+
+
+def check_resume(grace, use_async):
+    """Drop a player mid-match: the match must freeze, resume with the same score, then expire"""
+    server_class = AsyncPongServer if use_async else PongServer
+    server = server_class(host='127.0.0.1', port=0, resume_grace=grace, seed=1)
+    threading.Thread(target=server.start, daemon=True).start()
+
+    first, second = ResumePlayer(server.port), ResumePlayer(server.port)
+    for player in (first, second):
+        player.connect(encode_hello())
+        player.sock.sendall(pack_frame(encode_control(True, False)))
+    # Nobody moves a paddle, so points come quickly
+    second.read_until(lambda state: state['status'] == 'playing' and sum(state['scores']) > 0)
+    first.read_until(lambda state: True)
+    token = first.config['session_token']
+    score = tuple(first.state['scores'])
+
+    first.drop()
+    dropped = time.monotonic()
+    second.read_until(lambda state: state['status'] == 'suspended')
+    frozen = second.state['balls']
+    held = second.read_until(lambda state: time.monotonic() - dropped > grace / 2)
+    if any(state['balls'] != frozen or state['status'] != 'suspended' for state in held):
+        raise AssertionError("the match kept going while a player was away")
+
+    start = time.monotonic()
+    first.connect(encode_resume(token))
+    first.read_until(lambda state: True)
+    resume_ms = (time.monotonic() - start) * 1000
+    resumed_score = tuple(first.state['scores'])
+    if (first.config['session_token'], resumed_score) != (token, score):
+        raise AssertionError(f"resumed with session {first.config['session_token']} and score {resumed_score}, "
+                             f"expected {token} and {score}")
+    if first.first_snapshot != MSG_KEYFRAME:
+        raise AssertionError("a resumed player's first snapshot must be a keyframe")
+    first.read_until(lambda state: state['status'] == 'playing' and state['balls'] != frozen)
+
+    first.drop()
+    dropped = time.monotonic()
+    room = next(iter(server.rooms.values()))
+    while room.snapshot.status != 'waiting_connection':  # A lone player isn't sent snapshots
+        if time.monotonic() - dropped > grace + 5:
+            raise AssertionError("a dropped player's seat was never given up")
+        time.sleep(0.01)
+    expired = time.monotonic() - dropped
+    first.connect(encode_resume(token))
+    if first.config['session_token'] in (None, token):
+        raise AssertionError("an expired session was resumed")
+
+    server.running = False
+    for player in (first, second):
+        player.sock.close()
+    name = 'AsyncPongServer' if use_async else 'PongServer'
+    print(f"{name:>16} {score[0]:>3} - {score[1]:<3} {len(held):>8} {resume_ms:>10.1f} {'keyframe':>9} "
+          f"{expired:>10.2f}")
+
+
+def bench_sessions(count, grace):
+    """Memory and expiry cost of `count` suspended sessions"""
+    room = GameRoom(1)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    table = SessionTable(grace)
+    start = time.perf_counter()
+    for player_id in range(count):
+        table.suspend(table.open(room, player_id % 2, None), start)
+    opened = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    polls = 10000
+    start = time.perf_counter()
+    for _ in range(polls):
+        table.expire(0.0)  # Nothing due: the scheduler's check on every tick
+    poll = (time.perf_counter() - start) / polls
+    start = time.perf_counter()
+    expired = table.expire(time.perf_counter() + grace)
+    sweep = time.perf_counter() - start
+    print(f"{count:,} suspended sessions: {size / count:.0f} B each, opened in {opened * 1e6 / count:.2f} us each; "
+          f"nothing-due check {poll * 1e6:.2f} us, expiring all {sweep * 1000:.1f} ms ({len(expired):,})")
+
+
+def check_bot_aim(shots, seed):
+    """The bots' folded-line intercept against the simulation's own sweep, for random shots under every preset"""
+    rng = random.Random(seed)
+    sims = [MatchSimulation(rules=rules) for rules in PRESETS.values()]
+    worst = 0.0
+    for _ in range(shots):
+        sim = rng.choice(sims)
+        rules = sim.rules
+        state = sim.new_state()
+        state['status'] = 'playing'
+        player_id = rng.randrange(rules.players - 2, rules.players)  # A front paddle: the first face crossed
+        ball = state['balls'][0]
+        ball['x'] = rng.uniform(rules.faces[-2] + 1, rules.faces[-1] - 1)
+        ball['y'] = rng.uniform(rules.ball_radius, rules.height - rules.ball_radius)
+        ball['dx'] = rng.uniform(1, 15) * (-1 if player_id % 2 == 0 else 1)
+        ball['dy'] = rng.uniform(-15, 15)
+        ball['multiplier'] = rng.uniform(1, 5)
+        for paddle in state['paddles']:
+            paddle['y'] = -1000  # Out of the way: the ball crosses the face
+        predicted = landing_y(ball, rules.faces[player_id], rules)
+        while ball['crossing'] is None:
+            sim.move_ball(state, ball)
+        worst = max(worst, abs(ball['crossing']['ball']['y'] - predicted))
+    if worst > 0.01:
+        raise AssertionError(f"bot intercept off by {worst:.4f} px")
+    print(f"✅ {shots} random shots: the bots' intercept is within {worst:.1e} px of where the ball crossed")
+
+
+def check_bot_play(difficulties, ticks, reaction, seed):
+    """Rallies and points of bots at each difficulty against the best bot, simulated offline"""
+    print(f"{'difficulty':>10} {'points won':>11} {'hits/point':>11} {'solves/s':>9} {'msgs/s':>7}   (vs 1.0)")
+    for difficulty in difficulties:
+        room = GameRoom(1, seed=seed)
+        bots = (BotPlayer(room.sim, difficulty, reaction, seed=f"{seed}:0"),
+                BotPlayer(room.sim, 1.0, reaction, seed=f"{seed}:1"))
+        room.players = bots
+        hits = messages = won = 0
+        for _ in range(ticks):
+            players = room.players
+            if players is not room.seated:
+                room.seats_changed(players)
+            inputs = [(player_id, message) for player_id, bot in enumerate(bots)
+                      for message in bot.play(room.game_state, player_id)]
+            messages += len(inputs)
+            room.sim.step(room.game_state, inputs)
+            for kind, *details in room.sim.events:
+                hits += kind == 'hit'
+                won += kind == 'score' and details[0] == 0
+            room.sim.events.clear()
+        points = room.game_state['serves'] - 1
+        seconds = ticks / room.tick_rate
+        print(f"{difficulty:>10.1f} {f'{won} / {points}':>11} {hits / max(points, 1):>11.1f} "
+              f"{bots[0].solves / seconds:>9.2f} {messages / seconds / 2:>7.1f}")
+
+
+def bench_bots(match_counts, seconds, difficulty, reaction):
+    """Scheduler CPU per bot match, and how many fit in one 60 Hz tick"""
+    print(f"{'matches':>8} {'ticks':>6} {'cpu/match/tick':>15} {'load%':>6} {'solves/bot/s':>13} {'fit per tick':>13}")
+    for count in match_counts:
+        with contextlib.redirect_stdout(io.StringIO()):
+            server = PongServer(port=None, max_rooms=count, bot_matches=count,
+                                bot_difficulty=difficulty, bot_reaction=reaction, seed=1)
+        logging.getLogger('pong').disabled = True  # A line per serve and point in every match
+        try:
+            cpu_start = time.process_time()
+            wall_start = time.monotonic()
+            while time.monotonic() - wall_start < seconds:
+                time.sleep(server.tick_rooms(time.monotonic()))
+            cpu = time.process_time() - cpu_start
+            wall = time.monotonic() - wall_start
+        finally:
+            logging.getLogger('pong').disabled = False
+        ticks = server.clock.tick
+        bots = [conn for room in server.rooms.values() for conn in room.players]
+        solves = sum(bot.solves for bot in bots) / len(bots) / wall
+        per_match = cpu / (ticks * count)
+        print(f"{count:>8} {ticks:>6} {per_match * 1e6:>13.1f}us {cpu / wall:>6.0%} {solves:>13.2f} "
+              f"{int(1 / server.clock.tick_rate / per_match):>13,}")
+
+
+RULES_MIN_TICKS = 2000  # Enough for the weakest bots to both hit and concede under every variant
+
+
+def check_rules(ticks, seed):
+    """Bot matches under each variant: every snapshot must decode to what was published, at what size and cost"""
+    variants = dict(PRESETS, **{'8 balls': CLASSIC.replace(balls=8, win_score=50),
+                                'doubles x3': PRESETS['doubles'].replace(balls=3)})
+    print(f"{'rules':>11} {'balls':>5} {'paddles':>7} {'welcome':>8} {'keyframe':>9} {'delta avg':>10} "
+          f"{'points':>7} {'hits':>6} {'us/tick':>8} {'us/object':>10}")
+    logging.getLogger('pong').disabled = True  # A line per serve and point
+    try:
+        for name, rules in variants.items():
+            room = GameRoom(1, seed=seed, rules=rules)
+            # The weakest bots: they still return most balls, but miss often enough to score within RULES_MIN_TICKS
+            bots = tuple(BotPlayer(room.sim, 0.0, 0.15, seed=f"{seed}:{player_id}")
+                         for player_id in range(rules.players))
+            room.players = bots
+            room.seats_changed(bots)
+            layout = room.layout
+            encoder, decoder = SnapshotEncoder(layout), SnapshotDecoder(layout)
+            delta_bytes = points = hits = 0
+            step_time = 0.0
+            for tick in range(ticks):
+                # GameRoom.update without the logging, so the events can be counted here
+                start = time.perf_counter()
+                inputs = [(player_id, message) for player_id, bot in enumerate(bots)
+                          for message in bot.play(room.game_state, player_id)]
+                room.sim.step(room.game_state, inputs)
+                step_time += time.perf_counter() - start
+                for kind, *_ in room.sim.events:
+                    points += kind == 'score'
+                    hits += kind == 'hit'
+                room.sim.events.clear()
+                room.publish()
+                seq, values, _ = room.snapshot
+                payload = encoder.encode(seq, values)
+                delta_bytes += len(payload)
+                if decoder.decode(payload) != decoder.decode(layout.encode_keyframe(seq, values)):
+                    raise AssertionError(f"{name}: snapshot {seq} decoded differently from its keyframe")
+                if layout.values(layout.state(values)) != values:
+                    raise AssertionError(f"{name}: snapshot {seq} changed on the way through a state dict")
+                encoder.acknowledge(seq)
+                if room.game_state['status'] == 'game_over':
+                    room.sim.restart_game(room.game_state)
+            if not points or not hits:
+                raise AssertionError(f"{name}: the bots never rallied ({hits} hits, {points} points)")
+            per_tick = step_time / ticks
+            welcome = len(encode_welcome(0, rules, RULES_TICK_RATE))
+            keyframe = len(layout.encode_keyframe(seq, values))
+            print(f"{name:>11} {rules.balls:>5} {rules.players:>7} {welcome:>7}B {keyframe:>8}B "
+                  f"{delta_bytes / ticks:>9.1f}B {points:>7} {hits:>6} {per_tick * 1e6:>8.1f} "
+                  f"{per_tick * 1e6 / (rules.balls + rules.players):>10.2f}")
+    finally:
+        logging.getLogger('pong').disabled = False
+    print("✅ Every variant's snapshots decoded to what was published")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pong server benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rooms = commands.add_parser('rooms', help="CPU per room and tick jitter as the room count grows")
+    rooms.add_argument('--rooms', type=int, nargs='+', default=[1, 10, 100, 250, 500])
+    rooms.add_argument('--seconds', type=float, default=5)
+    rooms.add_argument('--tick-rate', type=int, default=60)
+    rooms.add_argument('--send-rate', type=int, default=60)
+
+    protocol = commands.add_parser('protocol', help="message size and codec cost, pickle vs binary")
+    protocol.add_argument('--number', type=int, default=100000)
+
+    delta = commands.add_parser('delta', help="bandwidth per client, keyframes vs delta replication")
+    delta.add_argument('--clients', type=int, default=200)
+    delta.add_argument('--seconds', type=float, default=30)
+    delta.add_argument('--max-ack-lag', type=int, default=6)
+
+    freeze = commands.add_parser('freeze', help="freeze time through a lossy proxy, TCP vs UDP")
+    freeze.add_argument('--loss', type=float, nargs='+', default=[0.01, 0.03, 0.05])
+    freeze.add_argument('--latency', type=float, default=0.03, help="one-way seconds")
+    freeze.add_argument('--seconds', type=float, default=20)
+    freeze.add_argument('--freeze-threshold', type=float, default=0.1)
+
+    batch = commands.add_parser('batch', help="check BatchPhysics against GameRoom, then compare speed")
+    batch.add_argument('--matches', type=int, nargs='+', default=[1, 100, 10000])
+    batch.add_argument('--seconds', type=float, default=2)
+    batch.add_argument('--check-matches', type=int, default=200)
+    batch.add_argument('--check-ticks', type=int, default=5000)
+    batch.add_argument('--seed', type=int, default=1)
+
+    tunnel = commands.add_parser('tunnel', help="fire balls at extreme speeds; none may pass a paddle")
+    tunnel.add_argument('--multipliers', type=float, nargs='+', default=[1, 2, 5, 10, 50, 100, 1000])
+    tunnel.add_argument('--shots', type=int, default=500)
+    tunnel.add_argument('--seed', type=int, default=1)
+
+    particles = commands.add_parser('particles', help="client particle frame time, objects vs pool")
+    particles.add_argument('--counts', type=int, nargs='+', default=[1000, 2500, 5000, 10000])
+    particles.add_argument('--frames', type=int, default=60)
+
+    sim = commands.add_parser('sim', help="check MatchSimulation is deterministic, then time it offline")
+    sim.add_argument('--matches', type=int, default=100)
+    sim.add_argument('--ticks', type=int, default=10000)
+    sim.add_argument('--seed', type=int, default=1)
+    sim.add_argument('--digest', action='store_true', help="only print the digest of one run")
+
+    spectators = commands.add_parser('spectators', help="spectator fan-out cost, throttling and drops")
+    spectators.add_argument('--viewers', type=int, nargs='+', default=[10, 100, 1000])
+    spectators.add_argument('--slow', type=float, default=0.1, help="fraction of viewers that never read")
+    spectators.add_argument('--seconds', type=float, default=20)
+    spectators.add_argument('--async', dest='use_async', action='store_true',
+                            help="use AsyncPongServer instead of a thread per connection")
+
+    metrics = commands.add_parser('metrics', help="cost of the hit log, the rate limit and a metrics scrape")
+    metrics.add_argument('--rooms', type=int, nargs='+', default=[100, 500])
+    metrics.add_argument('--seconds', type=float, default=5)
+    metrics.add_argument('--log-rate', type=float, default=20)
+
+    lag = commands.add_parser('lag', help="points lost to latency on blocked balls, without and with rewind")
+    lag.add_argument('--rtt', type=int, nargs='+', default=[0, 50, 100, 150], help="milliseconds")
+    lag.add_argument('--interp-delay', type=float, default=0.1)
+    lag.add_argument('--rewind-window', type=float, default=0.25)
+    lag.add_argument('--seconds', type=float, default=600)
+    lag.add_argument('--seed', type=int, default=1)
+
+    inputs = commands.add_parser('inputs', help="client messages and server CPU, inputs every frame vs on change")
+    inputs.add_argument('--pairs', type=int, nargs='+', default=[10, 50], help="matches of two bot players")
+    inputs.add_argument('--seconds', type=float, default=10)
+    inputs.add_argument('--async', dest='use_async', action='store_true')
+
+    stress = commands.add_parser('stress', help="inputs, joins and leaves from many threads; snapshots must add up")
+    stress.add_argument('--threads', type=int, nargs='+', default=[4, 32])
+    stress.add_argument('--rooms', type=int, default=8)
+    stress.add_argument('--seconds', type=float, default=5)
+    stress.add_argument('--seed', type=int, default=1)
+
+    resume = commands.add_parser('resume', help="drop a player mid-match and resume it; cost of suspended sessions")
+    resume.add_argument('--grace', type=float, default=2.0, help="seconds the server holds a dropped seat")
+    resume.add_argument('--sessions', type=int, default=100000)
+
+    bots = commands.add_parser('bots', help="check the server bots' aim and play, then their CPU per match")
+    bots.add_argument('--matches', type=int, nargs='+', default=[100, 500])
+    bots.add_argument('--seconds', type=float, default=5)
+    bots.add_argument('--difficulty', type=float, nargs='+', default=[0.0, 0.3, 0.7, 1.0])
+    bots.add_argument('--reaction', type=float, default=0.15)
+    bots.add_argument('--shots', type=int, default=10000)
+    bots.add_argument('--ticks', type=int, default=36000, help="ticks of play per difficulty")
+    bots.add_argument('--seed', type=int, default=1)
+
+    rules = commands.add_parser('rules', help="bot matches under each rules variant: snapshots, sizes, cost")
+    rules.add_argument('--ticks', type=int, default=20000, help="ticks of play per variant")
+    rules.add_argument('--seed', type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == 'rooms':
+        bench_rooms(args.rooms, args.seconds, args.tick_rate, args.send_rate)
+    elif args.command == 'protocol':
+        bench_protocol(args.number)
+    elif args.command == 'delta':
+        bench_delta(args.clients, args.seconds, args.max_ack_lag)
+    elif args.command == 'freeze':
+        bench_freeze(args.loss, args.latency, args.seconds, args.freeze_threshold)
+    elif args.command == 'batch':
+        check_batch(args.check_matches, args.check_ticks, args.seed)
+        bench_batch(args.matches, args.seconds)
+    elif args.command == 'tunnel':
+        check_tunnel(args.multipliers, args.shots, args.seed)
+    elif args.command == 'particles':
+        bench_particles(args.counts, args.frames)
+    elif args.command == 'spectators':
+        bench_spectators(args.viewers, args.slow, args.seconds, args.use_async)
+    elif args.command == 'metrics':
+        bench_metrics(args.rooms, args.seconds, args.log_rate)
+    elif args.command == 'inputs':
+        bench_inputs(args.pairs, args.seconds, args.use_async)
+    elif args.command == 'stress':
+        check_stress(args.threads, args.rooms, args.seconds, args.seed)
+    elif args.command == 'resume':
+        print(f"{'server':>16} {'score':>9} {'frozen':>8} {'resume ms':>10} {'first':>9} {'expired s':>10}")
+        for use_async in (False, True):
+            check_resume(args.grace, use_async)
+        print("✅ The match froze while a player was away and carried on with the same score after a RESUME")
+        bench_sessions(args.sessions, args.grace)
+    elif args.command == 'bots':
+        check_bot_aim(args.shots, args.seed)
+        check_bot_play(args.difficulty, args.ticks, args.reaction, args.seed)
+        bench_bots(args.matches, args.seconds, args.difficulty[-2], args.reaction)
+    elif args.command == 'rules':
+        if args.ticks < RULES_MIN_TICKS:
+            parser.error(f"rules needs --ticks {RULES_MIN_TICKS} or more for every variant to see a hit and a point")
+        check_rules(args.ticks, args.seed)
+    elif args.command == 'lag':
+        check_lag(args.rtt, args.interp_delay, args.rewind_window, args.seconds, args.seed)
+    elif args.command == 'sim':
+        if args.digest:
+            digest = hashlib.sha256()
+            run_matches(args.matches, args.ticks, args.seed, digest)
+            print(digest.hexdigest())
+        else:
+            check_sim(args.matches, args.ticks, args.seed)
+            bench_sim(args.matches, args.ticks, args.seed)
+
+
+if __name__ == "__main__":
+    main()
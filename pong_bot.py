@@ -0,0 +1,109 @@
+"""Server-side bot opponents.
+
+A BotPlayer takes a room seat like a connection, but the scheduler plays it:
+GameRoom.update() asks it for this tick's messages with the match state in
+hand, and its moves go through the simulation like any player's. Nothing is
+sent to it and it sends nothing, so a bot costs no sockets or encoding.
+
+The policy is cheap enough for hundreds of bot matches in one process. A
+ball only changes course at a paddle or a serve, and the multiplier scales dx
+and dy alike, so its path is fixed in between: where it will reach the bot's
+paddle face, after any number of wall bounces, comes from folding that
+straight line back into the court. The bot goes for the ball that will get
+there first. It is solved once per paddle hit or serve and cached; every other
+tick is one comparison and a clamped step towards the cached target.
+
+`difficulty` (0..1) sets how far the aim may be off and how fast the paddle
+moves; `reaction` is how many seconds the bot takes to notice the ball changed
+course. Aim errors come from the bot's own seeded RNG, so with the server's
+--seed a bot match plays out the same every run.
+"""
+import random
+
+
+class BotPlayer:
+    """A seat the server fills itself, played straight from the match state"""
+
+    # Always up for a match; the flags are only checked as a message arrives, so each is sent once per match
+    READY = {'moves': [], 'ready': True, 'play_again': False}
+    PLAY_AGAIN = {'moves': [], 'ready': True, 'play_again': True}
+    MAX_ERROR = 0.75  # Aim error at difficulty 0, in paddle heights either way
+
+    def __init__(self, sim, difficulty=0.7, reaction=0.15, seed=None):
+        self.rules = sim.rules
+        self.difficulty = difficulty
+        self.reaction_ticks = round(reaction * sim.tick_rate)
+        self.speed = (4 + 8 * difficulty) * sim.step_scale  # Pixels per tick; a client moves 10 per frame
+        self.max_error = (1 - difficulty) * self.MAX_ERROR
+        self.rng = random.Random(seed)
+
+        self.course = None  # Serves, then (multiplier, heading right) per ball: changes whenever a path does
+        self.target = None  # Paddle y the bot is moving to
+        self.next_target = None  # Where it will head once its reaction time is up
+        self.turn_tick = 0
+        self.input_seq = 0
+        self.solves = 0  # Intercepts worked out so far
+
+        # What the server reads from any seated connection
+        self.bot = True
+        self.binary = True
+        self.encoder = None
+        self.udp_addr = None
+        self.session = None
+        self.gone = False
+
+    def play(self, state, player_id):
+        """This tick's messages from the bot, for the simulation to apply"""
+        status = state['status']
+        if status != 'playing':
+            if status == 'waiting_ready' and not state['ready'][player_id]:
+                return [self.READY]
+            if status == 'game_over' and not state['play_again'][player_id]:
+                return [self.PLAY_AGAIN]
+            return []
+
+        course = (state['serves'],) + tuple((ball['multiplier'], ball['dx'] > 0) for ball in state['balls'])
+        if course != self.course:
+            self.course = course
+            self.next_target = self.intercept(state, player_id)
+            self.turn_tick = state['tick'] + self.reaction_ticks
+        if self.next_target is not None and state['tick'] >= self.turn_tick:
+            self.target, self.next_target = self.next_target, None
+        if self.target is None:
+            return []
+
+        gap = self.target - state['paddles'][player_id]['y']
+        move = round(max(-self.speed, min(gap, self.speed)))
+        if not move:
+            return []
+        self.input_seq += 1
+        return [{'moves': [(self.input_seq, move)]}]
+
+    def intercept(self, state, player_id):
+        """Paddle y that meets the first ball to reach the bot's face, give or take its aim; mid-court if none will"""
+        self.solves += 1
+        rules = self.rules
+        height, paddle_height = rules.height, rules.paddle_height
+        face = rules.faces[player_id]
+        # Ticks until each incoming ball gets to the face; one already past it is another paddle's
+        arrivals = [((face - ball['x']) / ball['dx'], ball) for ball in state['balls']
+                    if ball['dx'] and (face - ball['x']) / ball['dx'] >= 0]
+        if not arrivals:
+            return (height - paddle_height) / 2
+        ball = min(arrivals, key=lambda arrival: arrival[0])[1]
+        error = self.rng.uniform(-self.max_error, self.max_error) * paddle_height
+        y = landing_y(ball, face, rules) - paddle_height / 2 + error
+        return max(0, min(y, height - paddle_height))
+
+
+def landing_y(ball, face, rules):
+    """Where `ball`'s centre will cross the paddle face at x = `face`, if nothing touches it before"""
+    height, radius = rules.height, rules.ball_radius
+    travel = ball['dy'] * (face - ball['x']) / ball['dx']  # Vertical distance covered on the way
+
+    # Unfold the wall bounces: the court's height is a mirror, the path a straight line
+    span = height - 2 * radius
+    y = (ball['y'] - radius + travel) % (2 * span)
+    if y > span:
+        y = 2 * span - y
+    return y + radius
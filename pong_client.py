@@ -1,63 +1,159 @@
+import argparse
 import socket
-import pickle
-import threading
+from collections import deque
 import pygame
-import random
 import math
-import struct
-
-class Particle:
-    def __init__(self, x, y, color):
-        self.x = x
-        self.y = y
-        self.vx = random.uniform(-3, 3)
-        self.vy = random.uniform(-3, 3)
-        self.life = 30
-        self.color = color
-        self.size = random.randint(2, 5)
-    
-    def update(self):
-        self.x += self.vx
-        self.y += self.vy
-        self.life -= 1
-        self.size = max(1, self.size * 0.95)
-    
-    def draw(self, screen):
-        alpha = int((self.life / 30) * 255)
-        if alpha > 0:
-            s = pygame.Surface((self.size * 2, self.size * 2), pygame.SRCALPHA)
-            pygame.draw.circle(s, (*self.color, alpha), (self.size, self.size), self.size)
-            screen.blit(s, (int(self.x - self.size), int(self.y - self.size)))
+import time
+
+from pong_net import ClockSync, FrameBuffer, pack_frame, recv_frame, set_nodelay
+from pong_render import DirtyRenderer, gradient_surface, ParticlePool, RenderCache
+from pong_protocol import (DATAGRAM_TOKEN, decode_ping, decode_pong, decode_welcome, encode_control,
+                           encode_hello, encode_inputs, encode_ping, encode_pong, encode_resume, encode_spectate,
+                           INPUT_INTERVAL, KEEPALIVE_INTERVAL, message_type, MSG_PING, MSG_PONG,
+                           RULES_TICK_RATE, SnapshotDecoder, snapshot_layout, SPECTATOR_ID)
+from pong_rules import CLASSIC
+
+class SnapshotBuffer:
+    """Timestamped server snapshots, sampled slightly in the past for smooth rendering.
+
+    Remote entities (balls, other players' paddles) are drawn `interp_delay` seconds behind
+    the newest snapshot so there is almost always a pair to interpolate between,
+    whatever the network rate. If packets are late the ball is extrapolated from
+    its velocity for up to `max_extrapolation` seconds.
+    """
+
+    OFFSET_DRIFT = 0.0001  # How fast the clock offset may creep up per snapshot (s)
+
+    def __init__(self, interp_delay=0.1, max_extrapolation=0.25, size=32):
+        self.interp_delay = interp_delay
+        self.max_extrapolation = max_extrapolation
+        self.snapshots = deque(maxlen=size)  # (server_time, state), oldest first
+        self.clock_offset = None  # local time - server time for the least delayed snapshot
+        self.render_time = 0.0  # Server time of the latest sample: what the player is looking at
+
+    def push(self, state, tick_rate, now):
+        server_time = state['tick'] / tick_rate
+        if self.snapshots and server_time <= self.snapshots[-1][0]:
+            return  # Stale or duplicate
+
+        # Track the minimum transit delay; let it creep up slowly for clock drift
+        offset = now - server_time
+        if self.clock_offset is None:
+            self.clock_offset = offset
+        else:
+            self.clock_offset = min(self.clock_offset + self.OFFSET_DRIFT, offset)
+        self.snapshots.append((server_time, state))
+
+    def sample(self, now, rules):
+        """Ball and paddle positions to draw at local time `now`, or None if empty"""
+        if not self.snapshots:
+            return None
+        render_time = self.render_time = now - self.clock_offset - self.interp_delay
+
+        newer_time, newer = self.snapshots[-1]
+        if render_time >= newer_time:
+            return self.extrapolate(newer, min(render_time - newer_time, self.max_extrapolation), rules)
+
+        older_time, older = self.snapshots[0]
+        if render_time <= older_time:
+            return self.view(older)
+
+        for (older_time, older), (newer_time, newer) in zip(self.snapshots, list(self.snapshots)[1:]):
+            if older_time <= render_time <= newer_time:
+                break
+
+        # Don't slide a ball back across the court after a point
+        if older['status'] != newer['status'] or older['scores'] != newer['scores']:
+            return self.view(newer)
+
+        t = (render_time - older_time) / (newer_time - older_time)
+        lerp = lambda a, b: a + (b - a) * t
+        view = self.view(newer)
+        for ball, old, new in zip(view['balls'], older['balls'], newer['balls']):
+            ball['x'] = lerp(old['x'], new['x'])
+            ball['y'] = lerp(old['y'], new['y'])
+        view['paddles_y'] = [lerp(old['y'], new['y']) for old, new in zip(older['paddles'], newer['paddles'])]
+        return view
+
+    def view(self, state):
+        return {
+            'balls': [dict(ball) for ball in state['balls']],
+            'paddles_y': [paddle['y'] for paddle in state['paddles']],
+        }
+
+    def extrapolate(self, state, elapsed, rules):
+        """Carry the balls forward along their velocity, bouncing off the top and bottom walls"""
+        view = self.view(state)
+        if state['status'] != 'playing' or elapsed <= 0:
+            return view
+
+        # Reflect y into [radius, height - radius]
+        low = rules.ball_radius
+        span = rules.height - 2 * low
+        for ball in view['balls']:
+            steps = elapsed * RULES_TICK_RATE * ball['multiplier']
+            ball['x'] += ball['dx'] * steps
+            y = (ball['y'] - low + ball['dy'] * steps) % (2 * span)
+            ball['y'] = low + (y if y <= span else 2 * span - y)
+        return view
+
 
 class PongClient:
-    def __init__(self, host='localhost', port=5555):
+    RESUME_TIMEOUT = 10.0  # Seconds to keep trying to get our seat back after a drop (the server's default grace)
+    RESUME_RETRY = 0.5  # Seconds between attempts
+    CONNECT_TIMEOUT = 5.0  # Seconds for the connection and handshake
+
+    def __init__(self, host='localhost', port=5555, interp_delay=0.1, udp=False, dirty_rects=False,
+                 spectate=None, bot=False):
         # 1. Khởi tạo các biến cơ bản
+        self.host = host
+        self.port = port
+        self.want_udp = udp
         self.player_id = 0
+        self.match_config = None  # Rules, tick rate and tokens from the handshake
+        self.rules = CLASSIC  # The match's MatchConfig, which everything on screen is sized by
+        self.layout = snapshot_layout(CLASSIC)
         self.game_state = None
         self.running = True
-        self.paddle_y = 250
+        self.client = None  # TCP socket to the server, once connected
+        self.screen = None
+        self.paddle_y = (CLASSIC.height - CLASSIC.paddle_height) / 2  # Predicted locally, reconciled with each snapshot
         self.paddle_speed = 10
-        self.particles = []
+        self.input_seq = 0
+        self.pending_inputs = deque()  # (input_seq, move) the server hasn't applied yet
+        self.particles = ParticlePool()
         self.is_ready = False
         self.play_again = False  # For replay
+        self.frames = FrameBuffer()
+        self.snapshots = SnapshotDecoder(self.layout)
+        self.interpolation = SnapshotBuffer(interp_delay)
+        self.send_buffer = bytearray()  # Outgoing bytes the socket hasn't taken yet
+        self.udp = None  # Datagram socket when the server accepted the UDP transport
+        self.sent_control = None  # (ready, play_again) last sent over TCP
+        self.sent_seq = 0  # Newest input_seq sent
+        self.last_input_time = 0.0  # When the last INPUTS went out
+        self.datagram = bytearray(2048)  # Receive buffer for snapshot datagrams
+        self.spectating = False  # Read-only: watching a match instead of playing in it
+        self.clock = ClockSync()  # Round trip and clock offset to the server
         
         # 2. Khởi tạo Pygame
         pygame.init()
 
-        # 3. Thiết lập kết nối Socket
-        try:
-            self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client.connect((host, port))
-            self.player_id = pickle.loads(self.client.recv(1024))
-        except Exception as e:
-            print(f"Lỗi kết nối: {e}")
-            self.running = False
+        # 3. Thiết lập kết nối Socket (no host: offline, e.g. the replay viewer)
+        if host is not None:
+            try:
+                self.connect(encode_hello(udp, bot) if spectate is None else encode_spectate(spectate))
+                if udp and self.udp is None:
+                    print("⚠️ Server doesn't offer UDP, staying on TCP")
+            except Exception as e:
+                print(f"Lỗi kết nối: {e}")
+                self.running = False
 
         # 4. Thiết lập hiển thị
-        self.width = 800
-        self.height = 600
+        self.width = self.rules.width
+        self.height = self.rules.height
         self.screen = pygame.display.set_mode((self.width, self.height))
-        pygame.display.set_caption(f"Pong - Player {self.player_id + 1}")
+        pygame.display.set_caption("Pong - Spectating" if self.spectating else f"Pong - Player {self.player_id + 1}")
 
         # Colors
         self.BG_COLOR = (10, 15, 30)
@@ -72,142 +168,304 @@ class PongClient:
         self.ORANGE = (255, 150, 0)
         self.RED = (255, 50, 50)
 
-        # Fonts
-        self.font_large = pygame.font.Font(None, 120)
-        self.font_medium = pygame.font.Font(None, 74)
-        self.font_small = pygame.font.Font(None, 36)
-        self.font_tiny = pygame.font.Font(None, 24)
+        # Font sizes
+        self.FONT_LARGE = 120
+        self.FONT_MEDIUM = 74
+        self.FONT_SMALL = 36
+        self.FONT_TINY = 24
+
+        # Pre-rendered layers: the background never changes, the rest is cached on first use
+        self.render_cache = RenderCache()
+        self.background = gradient_surface(self.width, self.height, self.BG_COLOR, (20, 25, 40)).convert()
+        self.center_dash = pygame.Surface((6, 20)).convert()
+        self.center_dash.fill(self.LINE_COLOR)
+
+        # Everything is drawn onto the canvas: the screen itself, or a recorder that
+        # pushes only the regions that changed since the previous frame
+        self.dirty_rects = DirtyRenderer(self.screen) if dirty_rects else None
+        self.canvas = self.dirty_rects or self.screen
+
+    def resize(self):
+        """Size the window to the court, for a match whose rules came after it opened (the replay viewer)"""
+        self.width = self.rules.width
+        self.height = self.rules.height
+        self.screen = pygame.display.set_mode((self.width, self.height))
+        self.background = gradient_surface(self.width, self.height, self.BG_COLOR, (20, 25, 40)).convert()
+        self.dirty_rects = DirtyRenderer(self.screen) if self.dirty_rects else None
+        self.canvas = self.dirty_rects or self.screen
 
-    def receive_game_state(self):
-        """Receive game state with proper message framing"""
-        while self.running:
+    def connect(self, hello):
+        """Open the connection, send `hello` (HELLO, SPECTATE or RESUME) and take in the WELCOME"""
+        self.client = socket.create_connection((self.host, self.port), timeout=self.CONNECT_TIMEOUT)
+        try:
+            set_nodelay(self.client)
+            self.client.sendall(pack_frame(hello))
+            welcome = recv_frame(self.client)
+            if welcome is None:
+                raise ConnectionError("server closed the connection during the handshake")
+            self.set_match(*decode_welcome(welcome))
+            self.client.setblocking(False)
+        except:
+            self.client.close()
+            self.client = None
+            raise
+
+        if self.match_config['udp_token'] is not None:
+            self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp.connect((self.host, self.port))
+            self.udp.setblocking(False)
+            self.udp_prefix = DATAGRAM_TOKEN.pack(self.match_config['udp_token'])
+
+    def set_match(self, player_id, config):
+        """Take on a WELCOME's player id and config; snapshots are decoded and drawn by its rules from here on"""
+        self.player_id = player_id
+        self.match_config = config
+        self.spectating = player_id == SPECTATOR_ID
+        self.rules = config['rules']
+        self.layout = snapshot_layout(self.rules)
+        self.snapshots = SnapshotDecoder(self.layout)
+        if self.game_state is None:
+            self.paddle_y = (self.rules.height - self.rules.paddle_height) / 2
+        if self.screen is not None and (self.width, self.height) != (self.rules.width, self.rules.height):
+            self.resize()
+
+    def resume(self):
+        """Reconnect after a drop and take our seat back. False if there's no session or no server.
+
+        The server holds the match meanwhile and starts us off with a keyframe.
+        If it gave the seat up already, the RESUME gets us a seat in a new match instead.
+        """
+        token = self.match_config and self.match_config['session_token']
+        if token is None or self.spectating:
+            return False
+        print("📴 Connection lost, trying to resume...")
+        player_id = self.player_id
+        deadline = time.monotonic() + self.RESUME_TIMEOUT
+        while time.monotonic() < deadline:
+            pygame.event.pump()  # Keep the window responsive while we wait
+            if self.client is not None:
+                self.client.close()
+            if self.udp is not None:
+                self.udp.close()
+                self.udp = None
             try:
-                # First, receive 4-byte length header
-                length_data = b''
-                while len(length_data) < 4:
-                    chunk = self.client.recv(4 - len(length_data))
-                    if not chunk:
-                        return  # Connection closed
-                    length_data += chunk
-                
-                msg_length = struct.unpack('!I', length_data)[0]
-                
-                # Now receive the actual message
-                data = b''
-                while len(data) < msg_length:
-                    chunk = self.client.recv(min(8192, msg_length - len(data)))
-                    if not chunk:
-                        return  # Connection closed
-                    data += chunk
-                
-                # Unpickle the complete message
-                new_state = pickle.loads(data)
-                
-                # Detect collision for particle effects
-                if (self.game_state and new_state and 
-                    'ball' in self.game_state and 'ball' in new_state):
-                    old_ball = self.game_state['ball']
-                    new_ball = new_state['ball']
-                    if (abs(old_ball.get('dx', 0)) != abs(new_ball.get('dx', 0)) or 
-                        abs(old_ball.get('dy', 0)) != abs(new_ball.get('dy', 0))):
-                        self.create_particles(new_ball.get('x', 400), new_ball.get('y', 300))
-                
-                self.game_state = new_state
-                    
-            except Exception as e:
-                print(f"❌ Error receiving game state: {e}")
+                self.connect(encode_resume(token, self.want_udp))
                 break
+            except Exception as e:
+                print(f"🔁 Resume failed ({e}), retrying...")
+                time.sleep(self.RESUME_RETRY)
+        else:
+            return False
+
+        # Nothing from the old connection carries over but our own inputs, resent in full,
+        # and the snapshots we were drawing from, until the resume keyframe lands
+        self.frames = FrameBuffer()
+        self.send_buffer.clear()
+        self.sent_control = None
+        self.sent_seq = 0
+        if self.match_config['session_token'] == token:
+            print(f"🔁 Resumed as Player {self.player_id + 1}")
+        else:
+            print(f"🆕 Our seat was given up; joined a new match as Player {self.player_id + 1}")
+            self.game_state = None
+            self.interpolation = SnapshotBuffer(self.interpolation.interp_delay)
+            self.pending_inputs.clear()
+            self.is_ready = self.play_again = False
+        if self.player_id != player_id:
+            pygame.display.set_caption(f"Pong - Player {self.player_id + 1}")
+        return True
+
+    def receive_game_state(self):
+        """Drain whatever the socket has ready without blocking; called once per frame"""
+        try:
+            while True:
+                if not self.frames.recv_into(self.client):
+                    print("❌ Server closed the connection")
+                    self.running = self.resume()
+                    return
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            print(f"❌ Error receiving game state: {e}")
+            self.running = self.resume()
+            return
+
+        for payload in self.frames.pop_frames():
+            self.handle_payload(payload)
+        if self.udp is not None:
+            view = memoryview(self.datagram)
+            try:
+                while True:
+                    self.handle_payload(view[:self.udp.recv_into(self.datagram)])
+            except OSError:
+                pass  # Drained (or ICMP noise); datagrams are best-effort anyway
+
+    def handle_payload(self, payload):
+        try:
+            self.handle_message(payload)
+        except Exception as e:
+            print(f"❌ Error receiving game state: {e}")
+
+    def handle_message(self, payload):
+        msg_type = message_type(payload)
+        if msg_type == MSG_PING:
+            now = time.monotonic()
+            self.send_buffer += pack_frame(encode_pong(decode_ping(payload), now, now))
+            return
+        if msg_type == MSG_PONG:
+            self.clock.pong(*decode_pong(payload), time.monotonic())
+            return
+        if self.snapshots.is_stale(payload):
+            return  # Late datagram, or the TCP copy of a snapshot we already have
+        seq, values = self.snapshots.decode(payload)
+        self.apply_game_state(self.layout.state(values))
+
+    def apply_game_state(self, new_state):
+        # Detect collision for particle effects
+        if self.game_state and new_state:
+            for old_ball, new_ball in zip(self.game_state['balls'], new_state['balls']):
+                if abs(old_ball['dx']) != abs(new_ball['dx']) or abs(old_ball['dy']) != abs(new_ball['dy']):
+                    self.create_particles(new_ball['x'], new_ball['y'])
+        
+        if self.game_state and self.game_state['status'] == 'game_over' and new_state['status'] == 'waiting_ready':
+            # A restart clears both flags on the server; flags are only sent when they change
+            self.is_ready = self.play_again = False
+            self.sent_control = (False, False)
+
+        self.game_state = new_state
+        self.interpolation.push(new_state, self.match_config['tick_rate'], time.monotonic())
+        self.reconcile_paddle()
+
+    def clamp_paddle(self, y):
+        return max(0, min(y, self.rules.height - self.rules.paddle_height))
+
+    def predict_paddle(self, move):
+        """Move our paddle right away and remember the input until the server confirms it"""
+        if not move:
+            return 0  # Nothing to predict or send
+        # The server applies the same clamp, so send the move as requested
+        self.paddle_y = self.clamp_paddle(self.paddle_y + move)
+        self.input_seq += 1
+        self.pending_inputs.append((self.input_seq, move))
+        return move
+
+    def reconcile_paddle(self):
+        """Rebase our prediction on the server's paddle and replay inputs it hasn't seen"""
+        if self.spectating:
+            return
+        paddle = self.game_state['paddles'][self.player_id]
+        while self.pending_inputs and self.pending_inputs[0][0] <= paddle['input_seq']:
+            self.pending_inputs.popleft()
+
+        y = paddle['y']
+        for _, move in self.pending_inputs:
+            y = self.clamp_paddle(y + move)
+        self.paddle_y = y
 
     def send_game_data(self):
-        """Send paddle position, ready state, and play_again with message framing"""
+        """Send new paddle moves and ready / play_again changes with message framing.
+
+        A frame where nothing changed sends nothing. Moves are coalesced into one
+        INPUTS per INPUT_INTERVAL, and an INPUTS goes out at least every
+        KEEPALIVE_INTERVAL, moves or not, to carry the snapshot ack.
+        """
+        now = time.monotonic()
+        if self.clock.ping_due(now):
+            self.send_buffer += pack_frame(encode_ping(now))
+
+        since = now - self.last_input_time
+        if since >= KEEPALIVE_INTERVAL or (self.input_seq > self.sent_seq and since >= INPUT_INTERVAL):
+            self.last_input_time = now
+            ack_seq = self.snapshots.latest_seq
+            # The tick on screen when the move was made, for the server's lag compensation
+            view_tick = max(0, int(self.interpolation.render_time * self.match_config['tick_rate']))
+            if self.udp is None:
+                # TCP loses nothing, so only the moves not sent yet
+                moves = [(seq, move) for seq, move in self.pending_inputs if seq > self.sent_seq]
+                self.send_buffer += pack_frame(encode_inputs(ack_seq, moves, view_tick))
+            else:
+                # Every move the server hasn't applied, so a lost datagram costs nothing
+                try:
+                    self.udp.send(self.udp_prefix + encode_inputs(ack_seq, self.pending_inputs, view_tick))
+                except OSError:
+                    pass
+            self.sent_seq = self.input_seq
+
+        control = (self.is_ready, self.play_again)
+        if control != self.sent_control:
+            self.sent_control = control
+            self.send_buffer += pack_frame(encode_control(*control))
+
+        if not self.send_buffer:
+            return
         try:
-            data = {
-                'paddle_y': self.paddle_y,
-                'ready': self.is_ready,
-                'play_again': self.play_again
-            }
-            msg = pickle.dumps(data)
-            # Send length prefix + message
-            self.client.send(struct.pack('!I', len(msg)) + msg)
-        except:
+            # Non-blocking: whatever doesn't fit now goes out next frame
+            sent = self.client.send(self.send_buffer)
+            del self.send_buffer[:sent]
+        except OSError:
             pass
 
     def create_particles(self, x, y):
-        color = self.BALL_COLOR
-        for _ in range(15):
-            self.particles.append(Particle(x, y, color))
-
-    def draw_gradient_rect(self, x, y, w, h, color1, color2):
-        for i in range(h):
-            ratio = i / h
-            r = int(color1[0] * (1 - ratio) + color2[0] * ratio)
-            g = int(color1[1] * (1 - ratio) + color2[1] * ratio)
-            b = int(color1[2] * (1 - ratio) + color2[2] * ratio)
-            pygame.draw.line(self.screen, (r, g, b), (x, y + i), (x + w, y + i))
+        self.particles.emit(x, y, 15, self.BALL_COLOR)
+
+    def blit_text(self, size, text, color, **position):
+        """Blit cached text placed by a get_rect keyword (center=..., topleft=...); returns its rect"""
+        surface = self.render_cache.text(size, text, color)
+        rect = surface.get_rect(**position)
+        self.canvas.blit(surface, rect)
+        return rect
 
     def draw_glow_circle(self, x, y, radius, color):
-        for i in range(3):
-            scale = 1 + i * 0.3
-            alpha = max(0, 100 - i * 30)
-            s = pygame.Surface((int(radius * scale * 2) + 10, int(radius * scale * 2) + 10), pygame.SRCALPHA)
-            pygame.draw.circle(s, (*color, alpha), (int(radius * scale) + 5, int(radius * scale) + 5), int(radius * scale))
-            self.screen.blit(s, (int(x - radius * scale - 5), int(y - radius * scale - 5)))
-        pygame.draw.circle(self.screen, color, (int(x), int(y)), radius)
+        glow = self.render_cache.glow_circle(radius, color)
+        self.canvas.blit(glow, glow.get_rect(center=(int(x), int(y))))
 
     def draw_paddle_with_effects(self, x, y, width, height, color):
-        shadow_surface = pygame.Surface((width + 10, height + 10), pygame.SRCALPHA)
-        pygame.draw.rect(shadow_surface, (*color, 50), (5, 5, width, height), border_radius=8)
-        self.screen.blit(shadow_surface, (x - 5, y - 5))
-        
-        darker_color = tuple(max(0, c - 50) for c in color)
-        self.draw_gradient_rect(x, y, width, height, color, darker_color)
-        
-        pygame.draw.rect(self.screen, (255, 255, 255), (x, y, width, height), 2, border_radius=8)
+        self.canvas.blit(self.render_cache.paddle(width, height, color), (x - 5, y - 5))
 
     def draw_center_line(self):
         for i in range(0, self.height, 30):
             alpha = int(150 + 100 * math.sin(pygame.time.get_ticks() / 500 + i / 50))
-            s = pygame.Surface((6, 20), pygame.SRCALPHA)
-            pygame.draw.rect(s, (*self.LINE_COLOR, alpha), (0, 0, 6, 20))
-            self.screen.blit(s, (self.width // 2 - 3, i))
+            self.center_dash.set_alpha(alpha)
+            self.canvas.blit(self.center_dash, (self.width // 2 - 3, i))
 
     def draw_score(self, score, x, y, color):
-        for offset in [(2, 2), (-2, -2), (2, -2), (-2, 2)]:
-            glow_text = self.font_large.render(str(score), True, (*color, 100))
-            glow_rect = glow_text.get_rect(center=(x + offset[0], y + offset[1]))
-            self.screen.blit(glow_text, glow_rect)
-        
-        text = self.font_large.render(str(score), True, self.WHITE)
-        text_rect = text.get_rect(center=(x, y))
-        self.screen.blit(text, text_rect)
+        score_surf = self.render_cache.glow_text(self.FONT_LARGE, str(score), self.WHITE, (*color, 100), 2)
+        self.canvas.blit(score_surf, score_surf.get_rect(center=(x, y)))
+
+    def draw_panel(self, x, y, w, h, color, alpha, border_radius):
+        self.canvas.blit(self.render_cache.panel(w, h, color, alpha, border_radius), (x, y))
 
     def draw_button(self, x, y, w, h, text, color, hover=False):
         """Draw a button with hover effect"""
         alpha = 150 if hover else 100
-        bg_surface = pygame.Surface((w, h), pygame.SRCALPHA)
-        pygame.draw.rect(bg_surface, (*color, alpha), (0, 0, w, h), border_radius=10)
-        pygame.draw.rect(bg_surface, color, (0, 0, w, h), 3, border_radius=10)
-        self.screen.blit(bg_surface, (x, y))
+        self.draw_panel(x, y, w, h, color, alpha, 10)
         
         # Choose font size based on text length
-        if len(text) > 15:
-            button_text = self.font_tiny.render(text, True, self.WHITE)
-        else:
-            button_text = self.font_small.render(text, True, self.WHITE)
-        
-        text_rect = button_text.get_rect(center=(x + w // 2, y + h // 2))
-        self.screen.blit(button_text, text_rect)
+        size = self.FONT_TINY if len(text) > 15 else self.FONT_SMALL
+        self.blit_text(size, text, self.WHITE, center=(x + w // 2, y + h // 2))
         
         return pygame.Rect(x, y, w, h)
 
+    def side_color(self, side):
+        return self.PADDLE1_COLOR if side == 0 else self.PADDLE2_COLOR
+
+    def everyone(self):
+        return "Both players" if self.rules.players == 2 else f"All {self.rules.players} players"
+
+    def status_boxes(self, flags, y, width, height, spacing, border_radius):
+        """A panel per player, side by side around the centre, green for a set flag; yields (rect, flag)"""
+        spacing = min(spacing, (self.width - 20) // len(flags))
+        width = min(width, spacing - 10)
+        for player_id, flag in enumerate(flags):
+            center = self.width // 2 + round((player_id - (len(flags) - 1) / 2) * spacing)
+            box = pygame.Rect(center - width // 2, y, width, height)
+            color = self.GREEN if flag else self.ORANGE
+            self.draw_panel(box.x, box.y, width, height, color, 100 if flag else 50, border_radius)
+            yield box, flag
+
     def draw(self):
         # Background gradient
-        for i in range(self.height):
-            ratio = i / self.height
-            r = int(self.BG_COLOR[0] * (1 - ratio) + 20 * ratio)
-            g = int(self.BG_COLOR[1] * (1 - ratio) + 25 * ratio)
-            b = int(self.BG_COLOR[2] * (1 - ratio) + 40 * ratio)
-            pygame.draw.line(self.screen, (r, g, b), (0, i), (self.width, i))
+        self.canvas.blit(self.background, (0, 0))
 
         if self.game_state:
             game_status = self.game_state.get('status', 'waiting')
@@ -215,237 +473,172 @@ class PongClient:
             # Draw center line
             self.draw_center_line()
 
-            pw = self.game_state['paddle_width']
-            ph = self.game_state['paddle_height']
+            rules = self.rules
+            pw = rules.paddle_width
+            ph = rules.paddle_height
 
-            # Draw paddles
-            self.draw_paddle_with_effects(10, self.game_state['paddle1']['y'], pw, ph, self.PADDLE1_COLOR)
-            self.draw_paddle_with_effects(self.width - pw - 10, self.game_state['paddle2']['y'], pw, ph, self.PADDLE2_COLOR)
+            # Remote entities come from the interpolation buffer, not the newest packet
+            view = self.interpolation.sample(time.monotonic(), rules) or self.interpolation.view(self.game_state)
 
-            # Draw ball (if playing)
+            # Draw paddles (ours at the predicted position)
+            for player_id, (x, paddle_y) in enumerate(zip(rules.paddle_x, view['paddles_y'])):
+                if player_id == self.player_id:
+                    paddle_y = self.paddle_y
+                self.draw_paddle_with_effects(x, paddle_y, pw, ph, self.side_color(player_id % 2))
+
+            # Draw balls (if playing)
             if game_status == 'playing':
-                ball = self.game_state.get('ball', {})
-                if ball:
-                    ball_x = ball.get('x', 400)
-                    ball_y = ball.get('y', 300)
-                    ball_radius = ball.get('radius', 10)
-                    self.draw_glow_circle(ball_x, ball_y, ball_radius, self.BALL_COLOR)
+                for ball in view['balls']:
+                    self.draw_glow_circle(ball['x'], ball['y'], rules.ball_radius, self.BALL_COLOR)
 
             # Draw particles
-            for particle in self.particles[:]:
-                particle.update()
-                particle.draw(self.screen)
-                if particle.life <= 0:
-                    self.particles.remove(particle)
+            self.particles.update()
+            self.particles.draw(self.canvas)
 
             # Draw scores
-            self.draw_score(self.game_state['paddle1']['score'], self.width // 4, 80, self.PADDLE1_COLOR)
-            self.draw_score(self.game_state['paddle2']['score'], 3 * self.width // 4, 80, self.PADDLE2_COLOR)
+            score1, score2 = self.game_state['scores']
+            self.draw_score(score1, self.width // 4, 80, self.PADDLE1_COLOR)
+            self.draw_score(score2, 3 * self.width // 4, 80, self.PADDLE2_COLOR)
 
             # Player indicator
-            player_text = "YOU"
-            indicator_color = self.PADDLE1_COLOR if self.player_id == 0 else self.PADDLE2_COLOR
-            x_pos = 20 if self.player_id == 0 else self.width - 100
+            player_text = "LIVE" if self.spectating else "YOU"
+            side = self.player_id % 2
+            if self.spectating:
+                indicator_color = self.RED
+            else:
+                indicator_color = self.side_color(side)
+            x_pos = 20 if self.spectating or side == 0 else self.width - 100
             
             pulse = int(20 + 10 * math.sin(pygame.time.get_ticks() / 300))
-            bg_surface = pygame.Surface((80, 35), pygame.SRCALPHA)
-            pygame.draw.rect(bg_surface, (*indicator_color, pulse), (0, 0, 80, 35), border_radius=5)
-            self.screen.blit(bg_surface, (x_pos, 15))
+            indicator = self.render_cache.panel(80, 35, indicator_color, pulse, 5, border=0)
+            self.canvas.blit(indicator, (x_pos, 15))
             
-            label = self.font_small.render(player_text, True, self.WHITE)
-            self.screen.blit(label, (x_pos + 12, 20))
+            self.blit_text(self.FONT_SMALL, player_text, self.WHITE, topleft=(x_pos + 12, 20))
 
             # === WAITING READY ===
             if game_status == 'waiting_ready':
-                p1_ready = self.game_state.get('player1_ready', False)
-                p2_ready = self.game_state.get('player2_ready', False)
-                
-                win_score = self.game_state.get('win_score', 5)
-                info = self.font_large.render(f"First to {win_score}!", True, self.PRIMARY)
-                info_rect = info.get_rect(center=(self.width // 2, 200))
-                self.screen.blit(info, info_rect)
+                self.blit_text(self.FONT_LARGE, f"First to {rules.win_score}!", self.PRIMARY,
+                               center=(self.width // 2, 200))
                 
                 # Ready status boxes
                 box_y = 280
-                box_width = 200
                 box_height = 60
-                
-                # Player 1 status
-                p1_box = pygame.Rect(150, box_y, box_width, box_height)
-                p1_color = self.GREEN if p1_ready else self.ORANGE
-                p1_alpha = 100 if p1_ready else 50
-                
-                bg1 = pygame.Surface((box_width, box_height), pygame.SRCALPHA)
-                pygame.draw.rect(bg1, (*p1_color, p1_alpha), (0, 0, box_width, box_height), border_radius=10)
-                pygame.draw.rect(bg1, p1_color, (0, 0, box_width, box_height), 3, border_radius=10)
-                self.screen.blit(bg1, (p1_box.x, p1_box.y))
-                
-                p1_label = self.font_tiny.render("PLAYER 1", True, self.WHITE)
-                p1_label_rect = p1_label.get_rect(center=(p1_box.centerx, p1_box.centery - 12))
-                self.screen.blit(p1_label, p1_label_rect)
-                
-                p1_status = "READY ✓" if p1_ready else "NOT READY"
-                p1_status_surf = self.font_small.render(p1_status, True, p1_color)
-                p1_status_rect = p1_status_surf.get_rect(center=(p1_box.centerx, p1_box.centery + 12))
-                self.screen.blit(p1_status_surf, p1_status_rect)
-                
-                # Player 2 status
-                p2_box = pygame.Rect(450, box_y, box_width, box_height)
-                p2_color = self.GREEN if p2_ready else self.ORANGE
-                p2_alpha = 100 if p2_ready else 50
-                
-                bg2 = pygame.Surface((box_width, box_height), pygame.SRCALPHA)
-                pygame.draw.rect(bg2, (*p2_color, p2_alpha), (0, 0, box_width, box_height), border_radius=10)
-                pygame.draw.rect(bg2, p2_color, (0, 0, box_width, box_height), 3, border_radius=10)
-                self.screen.blit(bg2, (p2_box.x, p2_box.y))
-                
-                p2_label = self.font_tiny.render("PLAYER 2", True, self.WHITE)
-                p2_label_rect = p2_label.get_rect(center=(p2_box.centerx, p2_box.centery - 12))
-                self.screen.blit(p2_label, p2_label_rect)
-                
-                p2_status = "READY ✓" if p2_ready else "NOT READY"
-                p2_status_surf = self.font_small.render(p2_status, True, p2_color)
-                p2_status_rect = p2_status_surf.get_rect(center=(p2_box.centerx, p2_box.centery + 12))
-                self.screen.blit(p2_status_surf, p2_status_rect)
+                for player_id, (box, ready) in enumerate(self.status_boxes(self.game_state['ready'], box_y,
+                                                                           200, box_height, 300, 10)):
+                    color = self.GREEN if ready else self.ORANGE
+                    self.blit_text(self.FONT_TINY, f"PLAYER {player_id + 1}", self.WHITE,
+                                   center=(box.centerx, box.centery - 12))
+                    status = "READY ✓" if ready else "NOT READY"
+                    self.blit_text(self.FONT_SMALL, status, color, center=(box.centerx, box.centery + 12))
                 
                 # Ready button for current player
-                mouse_pos = pygame.mouse.get_pos()
-                ready_btn = pygame.Rect(self.width // 2 - 120, 380, 240, 70)
-                hover = ready_btn.collidepoint(mouse_pos)
-                
-                btn_color = self.GREEN if self.is_ready else self.PRIMARY
-                btn_text = "READY ✓" if self.is_ready else "CLICK TO READY"
-                
-                self.draw_button(ready_btn.x, ready_btn.y, ready_btn.w, ready_btn.h, btn_text, btn_color, hover)
+                if not self.spectating:
+                    mouse_pos = pygame.mouse.get_pos()
+                    ready_btn = pygame.Rect(self.width // 2 - 120, 380, 240, 70)
+                    hover = ready_btn.collidepoint(mouse_pos)
+
+                    btn_color = self.GREEN if self.is_ready else self.PRIMARY
+                    btn_text = "READY ✓" if self.is_ready else "CLICK TO READY"
+
+                    self.draw_button(ready_btn.x, ready_btn.y, ready_btn.w, ready_btn.h, btn_text, btn_color, hover)
                 
                 # Instruction
-                instruction = "Both players must be ready to start"
-                instruction_surf = self.font_tiny.render(instruction, True, self.LINE_COLOR)
-                instruction_rect = instruction_surf.get_rect(center=(self.width // 2, 480))
-                self.screen.blit(instruction_surf, instruction_rect)
+                instruction = f"{self.everyone()} must be ready to start"
+                self.blit_text(self.FONT_TINY, instruction, self.LINE_COLOR, center=(self.width // 2, 480))
 
             # === PLAYING ===
             elif game_status == 'playing':
-                speed = self.game_state.get('ball_speed_multiplier', 1.0)
+                speed = max(ball['multiplier'] for ball in self.game_state['balls'])
                 speed_text = f"Speed: x{speed:.2f}"
-                speed_surface = self.font_tiny.render(speed_text, True, self.BALL_COLOR)
-                self.screen.blit(speed_surface, (self.width // 2 - 40, 15))
+                speed_rect = self.blit_text(self.FONT_TINY, speed_text, self.BALL_COLOR,
+                                            topleft=(self.width // 2 - 40, 15))
+
+                if self.clock.rtt is not None:
+                    rtt_ms = round(self.clock.rtt * 1000)
+                    rtt_color = self.GREEN if rtt_ms < 80 else self.ORANGE if rtt_ms < 150 else self.RED
+                    self.blit_text(self.FONT_TINY, f"{rtt_ms} ms", rtt_color,
+                                   topleft=(speed_rect.right + 15, 15))
                 
-                win_score = self.game_state.get('win_score', 5)
-                target = self.font_tiny.render(f"Target: {win_score}", True, self.WHITE)
-                self.screen.blit(target, (self.width // 2 - 40, 40))
+                self.blit_text(self.FONT_TINY, f"Target: {rules.win_score}", self.WHITE,
+                               topleft=(self.width // 2 - 40, 40))
 
             # === GAME OVER ===
             elif game_status == 'game_over':
-                winner = self.game_state.get('winner', 0)
-                winner_text = f"PLAYER {winner + 1} WINS!"
-                winner_color = self.PADDLE1_COLOR if winner == 0 else self.PADDLE2_COLOR
+                winner = self.game_state['winner'] or 0
+                winner_text = f"{'PLAYER' if rules.team_size == 1 else 'TEAM'} {winner + 1} WINS!"
+                winner_color = self.side_color(winner)
                 
                 # Winner announcement with glow
-                for offset in [(3, 3), (-3, -3), (3, -3), (-3, 3)]:
-                    glow = self.font_large.render(winner_text, True, (*winner_color, 80))
-                    glow_rect = glow.get_rect(center=(self.width // 2 + offset[0], 150 + offset[1]))
-                    self.screen.blit(glow, glow_rect)
-                
-                title = self.font_large.render(winner_text, True, winner_color)
-                title_rect = title.get_rect(center=(self.width // 2, 150))
-                self.screen.blit(title, title_rect)
+                title = self.render_cache.glow_text(self.FONT_LARGE, winner_text, winner_color,
+                                                    (*winner_color, 80), 3)
+                self.canvas.blit(title, title.get_rect(center=(self.width // 2, 150)))
                 
                 # Final score
-                final_score = f"{self.game_state['paddle1']['score']} - {self.game_state['paddle2']['score']}"
-                score_surf = self.font_medium.render(final_score, True, self.WHITE)
-                score_rect = score_surf.get_rect(center=(self.width // 2, 240))
-                self.screen.blit(score_surf, score_rect)
-                
-                # Play again status
-                p1_again = self.game_state.get('player1_play_again', False)
-                p2_again = self.game_state.get('player2_play_again', False)
+                final_score = f"{score1} - {score2}"
+                self.blit_text(self.FONT_MEDIUM, final_score, self.WHITE, center=(self.width // 2, 240))
                 
                 question = "Play again?"
-                question_surf = self.font_medium.render(question, True, self.WHITE)
-                question_rect = question_surf.get_rect(center=(self.width // 2, 320))
-                self.screen.blit(question_surf, question_rect)
+                self.blit_text(self.FONT_MEDIUM, question, self.WHITE, center=(self.width // 2, 320))
                 
-                # Status boxes
+                # Play again status boxes
                 box_y = 380
-                box_width = 180
                 box_height = 50
-                
-                # Player 1 status
-                p1_box = pygame.Rect(170, box_y, box_width, box_height)
-                p1_color = self.GREEN if p1_again else self.ORANGE
-                p1_alpha = 100 if p1_again else 50
-                
-                bg1 = pygame.Surface((box_width, box_height), pygame.SRCALPHA)
-                pygame.draw.rect(bg1, (*p1_color, p1_alpha), (0, 0, box_width, box_height), border_radius=8)
-                pygame.draw.rect(bg1, p1_color, (0, 0, box_width, box_height), 3, border_radius=8)
-                self.screen.blit(bg1, (p1_box.x, p1_box.y))
-                
-                p1_text = "P1: YES ✓" if p1_again else "P1: NO"
-                p1_surf = self.font_small.render(p1_text, True, p1_color)
-                p1_rect = p1_surf.get_rect(center=(p1_box.centerx, p1_box.centery))
-                self.screen.blit(p1_surf, p1_rect)
-                
-                # Player 2 status
-                p2_box = pygame.Rect(450, box_y, box_width, box_height)
-                p2_color = self.GREEN if p2_again else self.ORANGE
-                p2_alpha = 100 if p2_again else 50
-                
-                bg2 = pygame.Surface((box_width, box_height), pygame.SRCALPHA)
-                pygame.draw.rect(bg2, (*p2_color, p2_alpha), (0, 0, box_width, box_height), border_radius=8)
-                pygame.draw.rect(bg2, p2_color, (0, 0, box_width, box_height), 3, border_radius=8)
-                self.screen.blit(bg2, (p2_box.x, p2_box.y))
-                
-                p2_text = "P2: YES ✓" if p2_again else "P2: NO"
-                p2_surf = self.font_small.render(p2_text, True, p2_color)
-                p2_rect = p2_surf.get_rect(center=(p2_box.centerx, p2_box.centery))
-                self.screen.blit(p2_surf, p2_rect)
+                for player_id, (box, again) in enumerate(self.status_boxes(self.game_state['play_again'], box_y,
+                                                                           180, box_height, 280, 8)):
+                    color = self.GREEN if again else self.ORANGE
+                    text = f"P{player_id + 1}: YES ✓" if again else f"P{player_id + 1}: NO"
+                    self.blit_text(self.FONT_SMALL, text, color, center=box.center)
                 
                 # Play again button
-                mouse_pos = pygame.mouse.get_pos()
-                yes_btn = pygame.Rect(self.width // 2 - 120, 460, 240, 60)
-                hover = yes_btn.collidepoint(mouse_pos)
-                
-                btn_color = self.GREEN if self.play_again else self.PRIMARY
-                btn_text = "YES, PLAY AGAIN ✓" if self.play_again else "CLICK FOR YES"
-                
-                self.draw_button(yes_btn.x, yes_btn.y, yes_btn.w, yes_btn.h, btn_text, btn_color, hover)
+                if not self.spectating:
+                    mouse_pos = pygame.mouse.get_pos()
+                    yes_btn = pygame.Rect(self.width // 2 - 120, 460, 240, 60)
+                    hover = yes_btn.collidepoint(mouse_pos)
+
+                    btn_color = self.GREEN if self.play_again else self.PRIMARY
+                    btn_text = "YES, PLAY AGAIN ✓" if self.play_again else "CLICK FOR YES"
+
+                    self.draw_button(yes_btn.x, yes_btn.y, yes_btn.w, yes_btn.h, btn_text, btn_color, hover)
                 
                 # Instruction
-                instruction = "Both players must click YES to restart"
-                instruction_surf = self.font_tiny.render(instruction, True, self.LINE_COLOR)
-                instruction_rect = instruction_surf.get_rect(center=(self.width // 2, 545))
-                self.screen.blit(instruction_surf, instruction_rect)
+                instruction = f"{self.everyone()} must click YES to restart"
+                self.blit_text(self.FONT_TINY, instruction, self.LINE_COLOR, center=(self.width // 2, 545))
+
+            # === SUSPENDED ===
+            elif game_status == 'suspended':
+                self.blit_text(self.FONT_LARGE, "PAUSED", self.ORANGE, center=(self.width // 2, 200))
+                self.blit_text(self.FONT_SMALL, "A player lost their connection, waiting for them to rejoin...",
+                               self.WHITE, center=(self.width // 2, 300))
 
         else:
             # Waiting for connection
             pulse = math.sin(pygame.time.get_ticks() / 500)
             
-            title = self.font_large.render("PONG", True, self.PRIMARY)
-            title_rect = title.get_rect(center=(self.width // 2, self.height // 2 - 80))
-            self.screen.blit(title, title_rect)
+            self.blit_text(self.FONT_LARGE, "PONG", self.PRIMARY, center=(self.width // 2, self.height // 2 - 80))
             
             wait_text = "Waiting for opponent..."
-            text = self.font_medium.render(wait_text, True, self.WHITE)
-            text_rect = text.get_rect(center=(self.width // 2, self.height // 2 + 20))
-            self.screen.blit(text, text_rect)
+            text_rect = self.blit_text(self.FONT_MEDIUM, wait_text, self.WHITE,
+                                       center=(self.width // 2, self.height // 2 + 20))
             
             dots = "." * (int(pygame.time.get_ticks() / 500) % 4)
-            dots_text = self.font_medium.render(dots, True, self.SECONDARY)
-            dots_rect = dots_text.get_rect(topleft=(text_rect.right + 5, text_rect.top))
-            self.screen.blit(dots_text, dots_rect)
+            self.blit_text(self.FONT_MEDIUM, dots, self.SECONDARY, topleft=(text_rect.right + 5, text_rect.top))
             
-            info = self.font_small.render(f"You are Player {self.player_id + 1}", True, self.LINE_COLOR)
-            info_rect = info.get_rect(center=(self.width // 2, self.height // 2 + 100))
-            self.screen.blit(info, info_rect)
+            role = "Spectating" if self.spectating else f"You are Player {self.player_id + 1}"
+            self.blit_text(self.FONT_SMALL, role, self.LINE_COLOR,
+                           center=(self.width // 2, self.height // 2 + 100))
 
-        pygame.display.flip()
+        if self.dirty_rects:
+            self.dirty_rects.present(self.game_state and self.game_state.get('status'))
+        else:
+            pygame.display.flip()
 
     def run(self):
-        threading.Thread(target=self.receive_game_state, daemon=True).start()
         clock = pygame.time.Clock()
         
-        print(f"🎮 Client started! You are Player {self.player_id + 1}")
+        if self.spectating:
+            print("👀 Client started! Spectating")
+        else:
+            print(f"🎮 Client started! You are Player {self.player_id + 1}")
         print(f"📺 Window opened. Waiting for game state...")
 
         while self.running:
@@ -456,7 +649,7 @@ class PongClient:
                     
                     # Mouse click handling
                     elif event.type == pygame.MOUSEBUTTONDOWN:
-                        if self.game_state:
+                        if self.game_state and not self.spectating:
                             status = self.game_state.get('status', '')
                             mouse_pos = pygame.mouse.get_pos()
                             print(f"🖱️ Mouse clicked at {mouse_pos}, status: {status}")
@@ -485,12 +678,16 @@ class PongClient:
                                 self.play_again = not self.play_again
 
                 keys = pygame.key.get_pressed()
-                if keys[pygame.K_UP] and self.paddle_y > 0:
-                    self.paddle_y -= self.paddle_speed
-                if keys[pygame.K_DOWN] and self.paddle_y < self.height - 100:
-                    self.paddle_y += self.paddle_speed
-
-                self.send_game_data()
+                move = 0
+                if keys[pygame.K_UP]:
+                    move -= self.paddle_speed
+                if keys[pygame.K_DOWN]:
+                    move += self.paddle_speed
+
+                self.receive_game_state()
+                if not self.spectating:
+                    self.predict_paddle(move)
+                    self.send_game_data()
                 self.draw()
                 clock.tick(60)
                 
@@ -504,10 +701,23 @@ class PongClient:
                 import traceback
                 traceback.print_exc()
 
-        self.client.close()
+        if self.client is not None:
+            self.client.close()
         pygame.quit()
         print("👋 Client closed")
 
 if __name__ == "__main__":
-    client = PongClient()
+    parser = argparse.ArgumentParser(description="Pong client")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--udp', action='store_true', help="ask the server for the UDP transport")
+    parser.add_argument('--dirty-rects', action='store_true',
+                        help="redraw only changed regions (for software-rendered or remote displays)")
+    parser.add_argument('--spectate', type=int, nargs='?', const=0, metavar='ROOM',
+                        help="watch a match read-only (default: any match in play)")
+    parser.add_argument('--bot', action='store_true', help="play against a server bot instead of waiting for a player")
+    args = parser.parse_args()
+
+    client = PongClient(args.host, args.port, udp=args.udp, dirty_rects=args.dirty_rects,
+                        spectate=args.spectate, bot=args.bot)
     client.run()
\ No newline at end of file
@@ -0,0 +1,521 @@
+"""Load generator and soak test: many headless bot players against one Pong server.
+
+A Bot speaks the same binary protocol as pong_client, without pygame: HELLO,
+snapshots, PING / PONG, inputs sent on change with a keepalive, and READY /
+play again answered as soon as they are asked. Its paddle chases the ball
+from the snapshots it receives, aiming slightly off centre so that some balls
+get past it and matches end and restart. Each worker process runs its share
+of the bots on one selector loop at the client's 60 frames a second.
+
+    python pong_load.py --bots 2000 --processes 8 --duration 600
+    python pong_load.py --server localhost:5555 --metrics localhost:9100 --bots 500
+    python pong_load.py --shards 4 --bots 4000
+
+Without --server it starts a PongServer of its own, or with --shards a
+sharded one (pong_shard.py). --bot-matches adds matches the server plays
+against itself (pong_bot), load that costs no bot sockets on this side. Every --report seconds it prints the server's
+tick rate, step time and dropped ticks, the bots' snapshot latency and gaps,
+and the server's CPU and memory (read from its metrics endpoint), and a
+summary for the whole run at the end. Snapshot latency comes
+from the PING the server writes right behind a snapshot: its timestamp,
+converted with the bot's clock offset, says when that snapshot was sent.
+"""
+import argparse
+import multiprocessing
+import queue
+import random
+import resource
+import selectors
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import deque
+
+from pong_metrics import Histogram, parse_metrics
+from pong_net import ClockSync, FrameBuffer, pack_frame, recv_frame, set_nodelay
+from pong_protocol import (DATAGRAM_TOKEN, decode_ping, decode_pong, decode_welcome, encode_control, encode_hello,
+                           encode_inputs, encode_ping, encode_pong, INPUT_INTERVAL, KEEPALIVE_INTERVAL, message_type,
+                           MSG_PING, MSG_PONG, SnapshotDecoder, snapshot_layout)
+
+FRAME_INTERVAL = 1 / 60  # Bots run at the client's frame rate
+LATENCY_BUCKETS = tuple(0.0001 * 1.1 ** i for i in range(100))  # 0.1 ms to 1.25 s in 10% steps
+WORKER_REPORT_INTERVAL = 1.0  # Seconds between a worker's reports to the driver
+
+
+class Bot:
+    """One headless player; run_swarm reads its sockets and calls frame() at 60 Hz"""
+
+    PADDLE_SPEED = 10  # Same as pong_client
+    DEADZONE = 0.25  # Of the paddle height: rests while the ball is this well lined up
+    AIM_ERROR = 0.75  # Of the paddle height: how far off centre it may try to meet a ball
+
+    def __init__(self, host, port, udp, rng, stats):
+        self.sock = socket.create_connection((host, port))
+        set_nodelay(self.sock)
+        self.sock.sendall(pack_frame(encode_hello(udp)))
+        welcome = recv_frame(self.sock)
+        if welcome is None:
+            raise ConnectionError("server closed the connection during the handshake")
+        self.player_id, self.config = decode_welcome(welcome)
+        self.sock.setblocking(False)
+        self.udp = None
+        if self.config['udp_token'] is not None:
+            self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp.connect((host, port))
+            self.udp.setblocking(False)
+            self.udp_prefix = DATAGRAM_TOKEN.pack(self.config['udp_token'])
+
+        self.rng = rng
+        self.stats = stats
+        self.rules = self.config['rules']
+        self.layout = snapshot_layout(self.rules)
+        self.face = self.rules.faces[self.player_id]
+        self.frames = FrameBuffer()
+        self.datagram = bytearray(2048)
+        self.snapshots = SnapshotDecoder(self.layout)
+        self.clock = ClockSync()
+        self.out = bytearray()  # Not taken by the socket yet
+        self.state = None
+        self.paddle_y = 0  # Predicted, like pong_client's
+        self.input_seq = 0
+        self.pending_inputs = deque()  # (input_seq, move) the server hasn't applied yet
+        self.sent_seq = 0
+        self.last_input_time = 0.0
+        self.heading = None  # Index of the nearest ball coming this way, to notice each new shot
+        self.aim = 0.0
+        self.last_arrival = None
+        self.alive = True
+
+    def sockets(self):
+        return [self.sock] if self.udp is None else [self.sock, self.udp]
+
+    def close(self):
+        for sock in self.sockets():
+            sock.close()
+
+    def receive(self, now):
+        """Drain both sockets and handle everything that arrived"""
+        try:
+            while True:
+                if not self.frames.recv_into(self.sock):
+                    self.alive = False
+                    break
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.alive = False
+        try:
+            for payload in self.frames.pop_frames():
+                self.handle_message(payload, now)
+            if self.udp is not None:
+                view = memoryview(self.datagram)
+                try:
+                    while True:
+                        self.handle_message(view[:self.udp.recv_into(self.datagram)], now)
+                except OSError:
+                    pass
+        except ValueError:
+            self.alive = False  # Bad frame or undecodable snapshot: count it as a disconnect
+
+    def handle_message(self, payload, now):
+        msg_type = message_type(payload)
+        if msg_type == MSG_PING:
+            ping_time = decode_ping(payload)
+            self.out += pack_frame(encode_pong(ping_time, now, now))
+            if self.clock.offset is not None:
+                # Written right behind a snapshot, so this is when that snapshot left the server
+                self.stats.latency.observe(max(0.0, now - (ping_time - self.clock.offset)))
+            return
+        if msg_type == MSG_PONG:
+            self.clock.pong(*decode_pong(payload), now)
+            return
+        if self.snapshots.is_stale(payload):
+            return
+        seq, values = self.snapshots.decode(payload)
+        self.stats.snapshots += 1
+        if self.last_arrival is not None:
+            self.stats.gaps.observe(now - self.last_arrival)
+        self.last_arrival = now
+
+        previous = self.state['status'] if self.state is not None else None
+        self.state = self.layout.state(values)
+        if self.state['status'] != previous and self.state['status'] in ('waiting_ready', 'game_over'):
+            self.out += pack_frame(encode_control(True, True))  # Always ready, always up for another
+
+        paddle = self.state['paddles'][self.player_id]
+        while self.pending_inputs and self.pending_inputs[0][0] <= paddle['input_seq']:
+            self.pending_inputs.popleft()
+        self.paddle_y = self.clamp(paddle['y'] + sum(move for _, move in self.pending_inputs))
+
+    def clamp(self, y):
+        return max(0, min(y, self.rules.height - self.rules.paddle_height))
+
+    def choose_move(self):
+        """Chase the nearest ball coming this way, drift back to the middle otherwise"""
+        paddle_height = self.rules.paddle_height
+        incoming = [(abs(self.face - ball['x']), index) for index, ball in enumerate(self.state['balls'])
+                    if ball['dx'] and (self.face - ball['x']) / ball['dx'] > 0]
+        heading = min(incoming, default=(None, None))[1]  # Which ball is coming, if any
+        ball = self.state['balls'][heading] if heading is not None else None
+        if heading != self.heading:
+            self.heading = heading
+            self.aim = self.rng.uniform(-self.AIM_ERROR, self.AIM_ERROR) * paddle_height
+        if ball is not None:
+            target = ball['y'] + self.aim - paddle_height / 2
+        else:
+            target = (self.rules.height - paddle_height) / 2
+        gap = target - self.paddle_y
+        if abs(gap) <= self.DEADZONE * paddle_height:
+            return 0
+        return int(max(-self.PADDLE_SPEED, min(gap, self.PADDLE_SPEED)))
+
+    def frame(self, now):
+        """Move, then send what pong_client would on this frame"""
+        if self.state is not None and self.state['status'] == 'playing':
+            move = self.choose_move()
+            if move:
+                self.paddle_y = self.clamp(self.paddle_y + move)
+                self.input_seq += 1
+                self.pending_inputs.append((self.input_seq, move))
+
+        since = now - self.last_input_time
+        if since >= KEEPALIVE_INTERVAL or (self.input_seq > self.sent_seq and since >= INPUT_INTERVAL):
+            self.last_input_time = now
+            ack_seq = self.snapshots.latest_seq
+            view_tick = self.state['tick'] if self.state is not None else 0
+            if self.udp is None:
+                moves = [(seq, move) for seq, move in self.pending_inputs if seq > self.sent_seq]
+                self.out += pack_frame(encode_inputs(ack_seq, moves, view_tick))
+            else:
+                try:
+                    self.udp.send(self.udp_prefix + encode_inputs(ack_seq, self.pending_inputs, view_tick))
+                except OSError:
+                    pass
+            self.sent_seq = self.input_seq
+        if self.clock.ping_due(now):
+            self.out += pack_frame(encode_ping(now))
+
+        if self.out:
+            try:
+                sent = self.sock.send(self.out)
+                del self.out[:sent]
+            except BlockingIOError:
+                pass
+            except OSError:
+                self.alive = False
+
+
+class SwarmStats:
+    """What a worker's bots measured since its last report"""
+
+    def __init__(self):
+        self.since = time.monotonic()
+        self.latency = Histogram('latency', '', LATENCY_BUCKETS)
+        self.gaps = Histogram('gaps', '', LATENCY_BUCKETS)
+        self.lag = Histogram('lag', '', LATENCY_BUCKETS)  # How late the worker ran each frame
+        self.snapshots = 0
+        self.failed = 0
+        self.disconnects = 0
+
+    def report(self, worker, bots):
+        return {
+            'worker': worker,
+            'since': self.since,
+            'until': time.monotonic(),
+            'bots': bots,
+            'latency': self.latency.counts,
+            'gaps': self.gaps.counts,
+            'lag': self.lag.counts,
+            'snapshots': self.snapshots,
+            'failed': self.failed,
+            'disconnects': self.disconnects,
+        }
+
+
+def run_swarm(worker, host, port, count, udp, ramp, duration, seed, results):
+    """Worker process: connect `count` bots over `ramp` seconds and play until `duration` is up"""
+    rng = random.Random(seed)
+    selector = selectors.DefaultSelector()
+    bots = []
+    attempted = 0
+    stats = SwarmStats()
+    start = now = time.monotonic()
+    next_frame = start
+    next_report = start + WORKER_REPORT_INTERVAL
+    while now < start + duration:
+        due = count if ramp <= 0 else min(count, int(count * (now - start) / ramp) + 1)
+        while attempted < due:
+            attempted += 1
+            try:
+                bot = Bot(host, port, udp, random.Random(rng.getrandbits(32)), stats)
+            except (OSError, ValueError):
+                stats.failed += 1
+                continue
+            bots.append(bot)
+            for sock in bot.sockets():
+                selector.register(sock, selectors.EVENT_READ, bot)
+
+        for key, _ in selector.select(max(0.0, next_frame - time.monotonic())):
+            key.data.receive(time.monotonic())
+
+        now = time.monotonic()
+        if now >= next_frame:
+            stats.lag.observe(now - next_frame)
+            for bot in bots:
+                bot.frame(now)
+            next_frame = max(next_frame + FRAME_INTERVAL, now)  # Skip frames rather than burst
+            for bot in [bot for bot in bots if not bot.alive]:
+                for sock in bot.sockets():
+                    selector.unregister(sock)
+                bot.close()
+                bots.remove(bot)
+                stats.disconnects += 1
+
+        if now >= next_report:
+            next_report += WORKER_REPORT_INTERVAL
+            results.put(stats.report(worker, len(bots)))
+            stats = SwarmStats()
+            for bot in bots:
+                bot.stats = stats
+
+    results.put(stats.report(worker, len(bots)))
+    for bot in bots:
+        bot.close()
+
+
+class BotTotals:
+    """Worker reports added up"""
+
+    def __init__(self):
+        self.latency = self.gaps = self.lag = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.snapshots = self.failed = self.disconnects = 0
+        self.bot_seconds = 0.0  # Time the reports cover, times the bots they cover
+
+    def add(self, report):
+        self.bot_seconds += report['bots'] * (report['until'] - report['since'])
+        self.latency = [a + b for a, b in zip(self.latency, report['latency'])]
+        self.gaps = [a + b for a, b in zip(self.gaps, report['gaps'])]
+        self.lag = [a + b for a, b in zip(self.lag, report['lag'])]
+        self.snapshots += report['snapshots']
+        self.failed += report['failed']
+        self.disconnects += report['disconnects']
+
+
+def percentile(bounds, counts, pct):
+    """Upper bound of the bucket holding the pct-th percentile; None without samples"""
+    total = sum(counts)
+    if not total:
+        return None
+    cumulative = 0
+    for bound, count in zip(bounds, counts):
+        cumulative += count
+        if cumulative >= total * pct / 100:
+            return bound
+    return float('inf')
+
+
+def scrape(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return parse_metrics(response.read().decode())
+
+
+def server_histogram(samples, name):
+    """(bounds, per-bucket counts) of a histogram in scraped samples"""
+    cumulative = sorted((float(dict(labels)['le']), value) for (sample, labels), value in samples.items()
+                        if sample == name + '_bucket')
+    bounds = [bound for bound, _ in cumulative]
+    counts = [value - previous for (_, value), previous in zip(cumulative, [0] + [v for _, v in cumulative])]
+    return bounds, counts
+
+
+class ServerWatch:
+    """Differences between successive scrapes of the server's metrics"""
+
+    def __init__(self, url):
+        self.url = url
+        self.first = self.last = scrape(url)
+        self.first_time = self.last_time = time.monotonic()
+
+    def rates(self, since, since_time):
+        now = scrape(self.url)
+        elapsed = time.monotonic() - since_time
+
+        def delta(name):
+            return now.get((name, ()), 0) - since.get((name, ()), 0)
+
+        bounds, counts = server_histogram(now, 'pong_tick_seconds')
+        _, before = server_histogram(since, 'pong_tick_seconds')
+        counts = [a - b for a, b in zip(counts, before)] if before else counts
+        return {
+            'ticks': delta('pong_ticks_total') / elapsed,
+            'step_p99': percentile(bounds, counts, 99),
+            'late': now.get(('pong_tick_lateness_seconds', ()), 0),
+            'dropped': delta('pong_dropped_ticks_total'),
+            'playing': now.get(('pong_matches_playing', ()), 0),
+            # A sharded server's front door adds its workers up separately from itself
+            'cpu': (delta('process_cpu_seconds_total') + delta('pong_shard_processes_cpu_seconds_total')) / elapsed,
+            'rss': now.get(('process_resident_memory_bytes', ()), 0)
+                   + now.get(('pong_shard_processes_resident_memory_bytes', ()), 0),
+        }, now
+
+    def interval(self):
+        rates, self.last = self.rates(self.last, self.last_time)
+        self.last_time = time.monotonic()
+        return rates
+
+    def whole_run(self):
+        return self.rates(self.first, self.first_time)[0]
+
+
+def format_seconds(value):
+    return '-' if value is None else f"{value * 1000:.1f}ms"
+
+
+def print_row(label, bots, server, totals):
+    print(f"{label:>7} {bots:>6} {server['playing']:>8.0f} {server['ticks']:>8.1f} "
+          f"{format_seconds(server['step_p99']):>9} {server['late'] * 1000:>6.1f}ms {server['dropped']:>8.0f} "
+          f"{totals.snapshots / max(totals.bot_seconds, 1e-9):>7.1f} "
+          f"{format_seconds(percentile(LATENCY_BUCKETS, totals.latency, 50)):>8} "
+          f"{format_seconds(percentile(LATENCY_BUCKETS, totals.latency, 99)):>8} "
+          f"{format_seconds(percentile(LATENCY_BUCKETS, totals.gaps, 99)):>8} "
+          f"{format_seconds(percentile(LATENCY_BUCKETS, totals.lag, 99)):>8} "
+          f"{server['cpu']:>6.1%} {server['rss'] / 2**20:>6.0f}MB", flush=True)
+
+
+def start_server(args, port, metrics_port):
+    command = [sys.executable, 'pong_shard.py' if args.shards else 'pong_server.py',
+               '--host', '127.0.0.1', '--port', str(port),
+               '--metrics-port', str(metrics_port), '--max-rooms', str(args.bots // 2 + args.bot_matches + 1),
+               '--log-level', 'WARNING', '--rules', args.rules]
+    if args.shards:
+        command += ['--workers', str(args.shards)]
+    elif args.use_async:
+        command.append('--async')
+    if args.udp:
+        command.append('--udp')
+    if args.bot_matches:
+        command += ['--bot-matches', str(args.bot_matches)]
+    log = open(args.server_log, 'a') if args.server_log else subprocess.DEVNULL
+    server = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{metrics_port}/metrics'
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            scrape(url)
+            return server, url
+        except OSError:
+            if time.monotonic() > deadline or server.poll() is not None:
+                server.kill()
+                raise RuntimeError("the server didn't start")
+            time.sleep(0.1)
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pong load generator and soak test")
+    parser.add_argument('--bots', type=int, default=200, help="players to connect (two per match)")
+    parser.add_argument('--processes', type=int, default=max(1, multiprocessing.cpu_count() - 1),
+                        help="worker processes the bots are spread over")
+    parser.add_argument('--duration', type=float, default=60, help="seconds of soak after the ramp")
+    parser.add_argument('--ramp', type=float, default=10, help="seconds over which the bots connect")
+    parser.add_argument('--report', type=float, default=10, help="seconds between report lines")
+    parser.add_argument('--udp', action='store_true', help="bots ask for the UDP transport")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--server', metavar='HOST:PORT', help="load an existing server instead of starting one")
+    parser.add_argument('--metrics', metavar='HOST:PORT', help="its metrics endpoint (needed with --server)")
+    parser.add_argument('--async', dest='use_async', action='store_true', help="start an AsyncPongServer")
+    parser.add_argument('--shards', type=int, metavar='N', help="start pong_shard.py with N worker processes instead")
+    parser.add_argument('--server-log', metavar='FILE', help="append the started server's log to FILE")
+    parser.add_argument('--bot-matches', type=int, default=0, metavar='N',
+                        help="the started server also plays N matches between its own bots (per shard with --shards)")
+    parser.add_argument('--rules', default='classic', metavar='PRESET|FILE',
+                        help="match rules for the started server (see pong_rules)")
+    args = parser.parse_args()
+
+    # Every bot is a socket or two, and so is its other end in the server
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    server = None
+    if args.server:
+        if not args.metrics:
+            parser.error("--server needs --metrics")
+        host, port = args.server.rsplit(':', 1)
+        port = int(port)
+        url = f'http://{args.metrics}/metrics'
+    else:
+        host, port = '127.0.0.1', free_port()
+        server, url = start_server(args, port, free_port())
+        if args.shards:
+            started = f"{args.shards} shards"
+        else:
+            started = 'AsyncPongServer' if args.use_async else 'PongServer'
+        print(f"🎮 Started {started} on {host}:{port}")
+
+    watch = ServerWatch(url)
+    results = multiprocessing.Queue()
+    shares = [args.bots // args.processes + (i < args.bots % args.processes) for i in range(args.processes)]
+    workers = [multiprocessing.Process(target=run_swarm, daemon=True,
+                                       args=(i, host, port, share, args.udp, args.ramp, args.ramp + args.duration,
+                                             args.seed * 1000 + i, results))
+               for i, share in enumerate(shares) if share]
+    for worker in workers:
+        worker.start()
+    print(f"🤖 {args.bots} bots in {len(workers)} processes, {args.ramp:.0f} s ramp, {args.duration:.0f} s soak")
+    print(f"{'time':>7} {'bots':>6} {'playing':>8} {'ticks/s':>8} {'step p99':>9} {'late':>8} {'dropped':>8} "
+          f"{'snap/s':>7} {'lat p50':>8} {'lat p99':>8} {'gap p99':>8} {'bot lag':>8} {'cpu':>6} {'rss':>8}")
+
+    start = time.monotonic()
+    connected = {}  # worker -> bots it has connected
+    interval = BotTotals()
+    soak = None  # Totals since the ramp ended
+    soak_watch = None
+    peak_playing = 0
+    next_report = start + args.report
+    try:
+        while any(worker.is_alive() for worker in workers):
+            try:
+                report = results.get(timeout=0.2)
+                connected[report['worker']] = report['bots']
+                interval.add(report)
+                if soak is not None and report['since'] >= soak_watch.first_time:
+                    soak.add(report)
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            if soak is None and now - start >= args.ramp:
+                soak, soak_watch = BotTotals(), ServerWatch(url)
+            if now >= next_report:
+                server_rates = watch.interval()
+                peak_playing = max(peak_playing, server_rates['playing'])
+                print_row(f"{now - start:.0f}s", sum(connected.values()), server_rates, interval)
+                next_report += args.report
+                interval = BotTotals()
+    except KeyboardInterrupt:
+        print("\n⏹️  Stopped early")
+    finally:
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+    if soak_watch is not None:
+        server_rates = soak_watch.whole_run()
+        server_rates['playing'] = peak_playing  # Most matches at once, rather than none after the bots left
+        print_row('soak', sum(connected.values()), server_rates, soak)
+        print(f"   {soak.failed} bots failed to connect, {soak.disconnects} disconnected by the server")
+    if server is not None:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""Server metrics in the Prometheus text format, and logging that stays off the tick loop.
+
+A MetricsRegistry holds histograms, which the server fills from the hot path,
+and collectors, which read counters the server already keeps (traffic, ticks,
+RTT) only when someone scrapes; process_metrics() adds the process's own CPU
+and memory, which is what a load test (pong_load.py) watches. serve_metrics()
+exposes the registry on a local HTTP endpoint from a background thread:
+
+    python pong_server.py --metrics-port 9100
+    curl localhost:9100/metrics
+
+configure_logging() routes the 'pong' loggers through a queue to a listener
+thread, so the scheduler never waits on a terminal. A token bucket in front of
+the queue caps how many lines per second get through; warnings and errors
+always do.
+"""
+import atexit
+import bisect
+import logging
+import logging.handlers
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds; 0.0167 is the whole budget of a 60 Hz tick
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.0167, 0.025, 0.05, 0.1, 0.25)
+
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() is a bisect and two additions"""
+
+    def __init__(self, name, help, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot: above every bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def collect(self):
+        samples = []
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), list(self.counts)):
+            total += count
+            samples.append((self.name + '_bucket', {'le': format_value(bound)}, total))
+        samples.append((self.name + '_sum', None, self.sum))
+        samples.append((self.name + '_count', None, self.count))
+        return [(self.name, 'histogram', self.help, samples)]
+
+
+class MetricsRegistry:
+    """Everything one server exposes.
+
+    A collector is a callable returning metric families, each a tuple
+    (name, type, help, [(sample name, labels dict or None, value), ...]).
+    """
+
+    def __init__(self):
+        self.collectors = []
+
+    def histogram(self, name, help, buckets=DURATION_BUCKETS):
+        histogram = Histogram(name, help, buckets)
+        self.collectors.append(histogram.collect)
+        return histogram
+
+    def collector(self, collect):
+        self.collectors.append(collect)
+
+    def render(self):
+        """The exposition text of every metric"""
+        lines = []
+        for collect in self.collectors:
+            for name, kind, help, samples in collect():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for sample, labels, value in samples:
+                    lines.append(f"{sample}{format_labels(labels)} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def format_value(value):
+    if type(value) is float:
+        return '+Inf' if value == math.inf else repr(value)
+    return str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def process_metrics():
+    """CPU, memory and descriptors of this process, under the names Prometheus clients use"""
+    families = [('process_cpu_seconds_total', 'counter', "User and system CPU time",
+                 [('process_cpu_seconds_total', None, time.process_time())])]
+    try:
+        with open('/proc/self/statm') as f:
+            resident = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        open_fds = len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return families  # No /proc on this platform
+    families.append(('process_resident_memory_bytes', 'gauge', "Resident memory",
+                     [('process_resident_memory_bytes', None, resident)]))
+    families.append(('process_open_fds', 'gauge', "Open file descriptors",
+                     [('process_open_fds', None, open_fds)]))
+    families.append(('process_threads', 'gauge', "Python threads",
+                     [('process_threads', None, threading.active_count())]))
+    return families
+
+
+def parse_metrics(text):
+    """Samples from exposition text, as {(name, ((label, value), ...)): value}"""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        series, value = line.rsplit(' ', 1)
+        name, _, labels = series.partition('{')
+        pairs = tuple(tuple(pair.split('=', 1)) for pair in labels.rstrip('}').split(',')) if labels else ()
+        samples[name, tuple((key, label.strip('"')) for key, label in pairs)] = float(value)
+    return samples
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # One line per scrape would drown the server's own log
+
+
+def serve_metrics(registry, host='127.0.0.1', port=9100):
+    """Serve `registry` at http://host:port/metrics from a daemon thread; returns the HTTP server"""
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    httpd.daemon_threads = True
+    httpd.registry = registry
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket: `rate` lines a second, in bursts of up to `burst`. Warnings and errors always pass."""
+
+    def __init__(self, rate, burst=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.suppressed = 0
+
+    def filter(self, record):
+        if not self.rate or record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            self.suppressed += 1
+            return False
+        self.tokens -= 1
+        return True
+
+    def collect(self):
+        return [('pong_log_suppressed_total', 'counter', "Log lines dropped by the rate limit",
+                 [('pong_log_suppressed_total', None, self.suppressed)])]
+
+
+def configure_logging(level='INFO', rate=0, stream=None):
+    """Send the 'pong' loggers to `stream` (stdout) from a listener thread.
+
+    `rate` caps lines per second below WARNING (0: no cap). Returns the
+    RateLimitFilter so its count can be exported. Calling again replaces the
+    previous setup.
+    """
+    stop_logging()
+    logger = logging.getLogger('pong')
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter('%(message)s'))
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, output)
+    handler = logging.handlers.QueueHandler(records)
+    handler.listener = listener
+    limiter = RateLimitFilter(rate)
+    handler.addFilter(limiter)
+
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    listener.start()
+    atexit.register(listener.stop)  # Flush whatever is still queued
+    return limiter
+
+
+def stop_logging():
+    """Flush and remove what configure_logging() set up"""
+    logger = logging.getLogger('pong')
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.listener.stop()
+        atexit.unregister(handler.listener.stop)
@@ -0,0 +1,182 @@
+"""Length-prefixed message framing shared by the Pong server and client.
+
+Every message on the wire is a 4-byte big-endian length followed by the payload.
+"""
+import socket
+import struct
+import time
+from collections import deque
+
+HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 1 << 20  # Anything bigger is a corrupt or hostile stream
+RECV_BUFFER_SIZE = 8192  # Preallocated per connection; only a bigger frame grows it
+RECV_CHUNK = 2048  # Free space guaranteed before each recv_into
+
+
+def pack_frame(payload):
+    """Length prefix + payload"""
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameBuffer:
+    """Incremental decoder for a stream of length-prefixed frames.
+
+    Bytes can arrive split or coalesced in any way; recv_into() from a socket
+    (or feed() bytes received elsewhere) and pop_frames() returns every message
+    that is complete so far. Reads land in one preallocated buffer and frames
+    come back as memoryviews into it, so nothing is copied per frame. A view is
+    only good until the next recv_into() or feed(): decode it straight away, or
+    keep bytes(view).
+    """
+
+    def __init__(self, size=RECV_BUFFER_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # First byte not yet returned in a frame
+        self.end = 0  # End of the bytes received so far
+
+    def reserve(self, size):
+        """Make room for `size` more bytes after the unread ones"""
+        if self.end + size <= len(self.buffer):
+            return
+        unread = self.end - self.start
+        if unread + size <= len(self.buffer):
+            # Slide the partial frame to the front; no resize, so views handed out stay valid
+            self.buffer[:unread] = self.view[self.start:self.end]
+        else:
+            # Bigger than the buffer: switch to a new one rather than resize under live views
+            grown = bytearray(max(2 * len(self.buffer), unread + size))
+            grown[:unread] = self.view[self.start:self.end]
+            self.buffer, self.view = grown, memoryview(grown)
+        self.start, self.end = 0, unread
+
+    def recv_into(self, sock):
+        """One recv straight into the buffer; returns the byte count (0: the peer closed)"""
+        self.reserve(RECV_CHUNK)
+        count = sock.recv_into(self.view[self.end:])
+        self.end += count
+        return count
+
+    def feed(self, data):
+        self.reserve(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def pop_frames(self):
+        frames = []
+        offset = self.start
+        while self.end - offset >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer, offset)
+            if length > MAX_FRAME_SIZE:
+                raise ValueError(f"frame of {length} bytes exceeds limit")
+            end = offset + HEADER.size + length
+            if end > self.end:
+                break
+            frames.append(self.view[offset + HEADER.size:end])
+            offset = end
+        if offset == self.end:
+            self.start = self.end = 0  # All consumed: the next read starts at the front
+        else:
+            self.start = offset
+        return frames
+
+
+def set_nodelay(sock):
+    """Write small messages at once instead of holding them for the peer's ACK (Nagle).
+
+    Both ends send a little at a time and not every tick, so a held message
+    could wait out the peer's delayed ACK, tens of milliseconds.
+    """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def recv_exactly(sock, size):
+    """Blocking read of exactly `size` bytes, or None if the peer closed first"""
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            return None
+        received += count
+    return data
+
+
+def recv_frame(sock):
+    """Blocking read of one whole frame's payload, or None if the peer closed"""
+    header = recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"frame of {length} bytes exceeds limit")
+    return recv_exactly(sock, length)
+
+
+class TrafficCounter:
+    """Bytes in/out for one connection, with per-second rates over the last window"""
+
+    WINDOW = 1.0  # Seconds
+
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.in_rate = 0.0  # Bytes/sec over the last completed window
+        self.out_rate = 0.0
+        self.window_start = time.monotonic()
+        self.window_in = 0
+        self.window_out = 0
+
+    def count_in(self, size):
+        self.bytes_in += size
+        self.window_in += size
+
+    def count_out(self, size):
+        self.bytes_out += size
+        self.window_out += size
+
+    def rates(self):
+        """(in, out) bytes/sec, rolling the window over if it has elapsed"""
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed >= self.WINDOW:
+            self.in_rate = self.window_in / elapsed
+            self.out_rate = self.window_out / elapsed
+            self.window_in = self.window_out = 0
+            self.window_start = now
+        return self.in_rate, self.out_rate
+
+
+class ClockSync:
+    """Round-trip time and clock offset to the peer, from PING / PONG timestamps.
+
+    Each PONG gives four readings, as in NTP: our PING time, the peer's clock
+    when it arrived and when it replied, and our clock now. The time the peer
+    held the PING is taken out of the round trip. The offset comes from the
+    quickest of the recent exchanges, whose two legs are the most likely to
+    have been equally long.
+    """
+
+    PING_INTERVAL = 1.0  # Seconds between PINGs
+    WINDOW = 8  # Recent exchanges the offset is picked from
+
+    def __init__(self):
+        self.rtt = None  # Smoothed round trip, seconds
+        self.offset = None  # Peer clock minus ours, seconds
+        self.samples = deque(maxlen=self.WINDOW)  # (rtt, offset)
+        self.next_ping = 0.0
+
+    def ping_due(self, now):
+        if now < self.next_ping:
+            return False
+        self.next_ping = now + self.PING_INTERVAL
+        return True
+
+    def pong(self, sent, received, replied, now):
+        """Account for a PONG answering our PING sent at `sent`"""
+        rtt = max(0.0, (now - sent) - (replied - received))
+        offset = ((received - sent) + (replied - now)) / 2
+        self.rtt = rtt if self.rtt is None else self.rtt + (rtt - self.rtt) / 8
+        self.samples.append((rtt, offset))
+        self.offset = min(self.samples)[1]
@@ -0,0 +1,534 @@
+"""Binary wire protocol for Pong.
+
+Every payload (inside the length-prefixed frame from pong_net) starts with a
+one-byte message type. A new client opens with HELLO; the server answers with
+WELCOME carrying the player id and the match's rules (a pong_rules.MatchConfig:
+court, paddles, speed curve, win score, balls, players), which are never sent
+again. After that the server streams snapshots and the client sends INPUTS,
+each carrying the paddle moves made since the previous one, and CONTROL when
+ready / play again change. Clients send only when something changed, plus an
+INPUTS without moves every KEEPALIVE_INTERVAL. (A single-move INPUT
+with the flags is still accepted.) Clients that don't say HELLO get the old
+pickle protocol.
+
+Snapshots carry only what moves, laid out by the rules (SnapshotLayout): the
+tick, every ball, every paddle, the scores and flags. A classic match (one ball,
+two players) has the same 13 fields as before match rules existed.
+
+Snapshots are replicated as deltas: each INPUT(S) acknowledges the newest snapshot
+the client has, and the server encodes the next one as only the fields that
+changed since that acknowledged baseline. A KEYFRAME with every field is sent
+when there is no usable baseline (first snapshot, reconnect, baseline too old).
+
+Optionally (HELLO_UDP) the per-tick traffic moves to UDP on the same port
+number as TCP: the server sends snapshots as datagrams and the client sends
+INPUTS datagrams, prefixed with the token from WELCOME, that repeat every move
+the server hasn't acknowledged yet so a lost datagram loses nothing. Both sides
+drop anything older than what they already have. Ready / play again go over TCP
+as CONTROL messages, and the server sends a KEYFRAME over TCP whenever the score
+or match status changes, so those never depend on a datagram arriving.
+
+A HELLO with HELLO_BOT asks for a server bot (pong_bot) as the opponent, in
+a room of the player's own, instead of waiting to be paired.
+
+Spectators open with SPECTATE instead of HELLO, naming the room to watch. They
+get a WELCOME with player id SPECTATOR_ID and then a read-only stream of
+KEYFRAMEs and DELTAs over TCP, each delta against the previous snapshot sent to
+them (see pong_spectate). They send nothing back.
+
+Players and the server keep track of each other's clocks. Either side sends
+PING with its own clock reading; the other answers PONG with that reading plus
+its own clock when the PING arrived and when it replied, from which
+pong_net.ClockSync works out the round trip and the clock offset. Every INPUT
+and INPUTS also carries the server tick the client was showing when the move
+was made, so the server can judge a late paddle against the ball the player
+actually saw (see MatchSimulation.rewind_window).
+
+WELCOME also carries a session token. A player whose connection drops can
+reconnect with RESUME and that token instead of HELLO, within the server's
+grace period, and is seated again as the same player in the same match, which
+the server holds in the 'suspended' status meanwhile. The first snapshot on the
+new connection is a KEYFRAME, as there is no baseline yet.
+"""
+import io
+import pickle
+import struct
+from collections import OrderedDict
+
+from pong_rules import MatchConfig
+
+PROTOCOL_VERSION = 8
+MAGIC = b'PONG'
+
+RULES_TICK_RATE = 60  # Ball dx/dy are in pixels per 1/60 s, whatever the server's tick rate
+
+MSG_HELLO = 1
+MSG_WELCOME = 2
+MSG_KEYFRAME = 3
+MSG_INPUT = 4
+MSG_DELTA = 5
+MSG_INPUTS = 6
+MSG_CONTROL = 7
+MSG_SPECTATE = 8
+MSG_PING = 9
+MSG_PONG = 10
+MSG_RESUME = 11
+
+STATUSES = ('waiting_connection', 'waiting_ready', 'playing', 'game_over', 'suspended')
+STATUS_CODES = {name: code for code, name in enumerate(STATUSES)}
+
+HELLO = struct.Struct('!B4sBB')  # type, magic, version, flags
+WELCOME = struct.Struct('!BBBHBIQ')  # type, version, player id, tick rate, udp enabled, udp token, session token,
+                                    # then MATCH_CONFIG
+MATCH_CONFIG = struct.Struct('!HHHHHHHBBBddd')  # MatchConfig.FIELDS; doubles, so both sides get the same speeds
+INPUT = struct.Struct('!BIIhBI')  # type, newest snapshot seq received, input seq, paddle move, flags, view tick
+INPUTS_HEADER = struct.Struct('!BIIB')  # type, newest snapshot seq received, view tick, move count
+INPUT_MOVE = struct.Struct('!Ih')  # input seq, paddle move
+CONTROL = struct.Struct('!BB')  # type, flags
+RESUME = struct.Struct('!B4sBBQ')  # type, magic, version, flags (as HELLO), session token
+SPECTATE = struct.Struct('!B4sBI')  # type, magic, version, room id (0: any match in play)
+PING = struct.Struct('!Bd')  # type, sender's clock
+PONG = struct.Struct('!Bddd')  # type, the PING's clock, responder's clock when it arrived / when replying
+DATAGRAM_TOKEN = struct.Struct('!I')  # Prefix on every client -> server datagram
+
+HELLO_UDP = 1 << 0  # Client wants snapshots and inputs over UDP
+HELLO_BOT = 1 << 1  # Client wants a server bot as its opponent rather than waiting for a player
+MAX_DATAGRAM_MOVES = 32  # Unacknowledged moves repeated per INPUTS datagram
+INPUT_INTERVAL = 0.03  # Clients put the moves of about two frames in one INPUTS
+KEEPALIVE_INTERVAL = 0.1  # and send an INPUTS at least this often, to keep their snapshot ack fresh
+SPECTATOR_ID = 255  # Player id in the WELCOME a spectator gets
+
+SNAPSHOT_HEADER = struct.Struct('!BI')  # type, seq: the prefix KEYFRAME and DELTA share
+
+# Snapshot flag bits: status in the low 3 bits, then a ready bit per player, a play again bit per player,
+# then the winning side + 1
+STATUS_MASK = 0x07
+READY_SHIFT = 3
+
+# Input flag bits
+INPUT_READY = 1 << 0
+INPUT_PLAY_AGAIN = 1 << 1
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def message_type(payload):
+    return payload[0] if payload else None
+
+
+def encode_hello(udp=False, bot=False):
+    return HELLO.pack(MSG_HELLO, MAGIC, PROTOCOL_VERSION, (HELLO_UDP if udp else 0) | (HELLO_BOT if bot else 0))
+
+
+def decode_hello(payload):
+    """(version, flags) from a HELLO, or None if the payload isn't one"""
+    if len(payload) != HELLO.size:
+        return None
+    msg_type, magic, version, flags = HELLO.unpack(payload)
+    if msg_type != MSG_HELLO or magic != MAGIC:
+        return None
+    return version, flags
+
+
+def encode_resume(session_token, udp=False):
+    return RESUME.pack(MSG_RESUME, MAGIC, PROTOCOL_VERSION, HELLO_UDP if udp else 0, session_token)
+
+
+def decode_resume(payload):
+    """(version, flags, session_token) from a RESUME, or None if the payload isn't one"""
+    if len(payload) != RESUME.size:
+        return None
+    msg_type, magic, version, flags, session_token = RESUME.unpack(payload)
+    if msg_type != MSG_RESUME or magic != MAGIC:
+        return None
+    return version, flags, session_token
+
+
+def encode_spectate(room_id=0):
+    return SPECTATE.pack(MSG_SPECTATE, MAGIC, PROTOCOL_VERSION, room_id)
+
+
+def decode_spectate(payload):
+    """(version, room_id) from a SPECTATE, or None if the payload isn't one"""
+    if len(payload) != SPECTATE.size:
+        return None
+    msg_type, magic, version, room_id = SPECTATE.unpack(payload)
+    if msg_type != MSG_SPECTATE or magic != MAGIC:
+        return None
+    return version, room_id
+
+
+def encode_rules(rules):
+    return MATCH_CONFIG.pack(*(getattr(rules, name) for name in MatchConfig.FIELDS))
+
+
+def decode_rules(payload, offset=0):
+    """The MatchConfig packed at `offset`"""
+    if len(payload) - offset != MATCH_CONFIG.size:
+        raise ProtocolError("truncated match config")
+    try:
+        return MatchConfig(**dict(zip(MatchConfig.FIELDS, MATCH_CONFIG.unpack_from(payload, offset))))
+    except ValueError as e:
+        raise ProtocolError(f"unplayable match config: {e}") from None
+
+
+def encode_welcome(player_id, rules, tick_rate, udp_token=None, session_token=None):
+    """`udp_token` is None unless the client asked for, and got, the UDP transport;
+    `session_token` is None for spectators and when the server doesn't hold seats for a RESUME"""
+    return WELCOME.pack(
+        MSG_WELCOME, PROTOCOL_VERSION, player_id, tick_rate,
+        udp_token is not None, udp_token or 0, session_token or 0) + encode_rules(rules)
+
+
+def decode_welcome(payload):
+    """Returns (player_id, config): the match's 'rules' and 'tick_rate', and this connection's tokens"""
+    if message_type(payload) != MSG_WELCOME or len(payload) < 2:
+        raise ProtocolError("expected WELCOME")
+    if payload[1] != PROTOCOL_VERSION:
+        raise ProtocolError(f"server speaks protocol v{payload[1]}, client v{PROTOCOL_VERSION}")
+    if len(payload) != WELCOME.size + MATCH_CONFIG.size:
+        raise ProtocolError("truncated WELCOME")
+    _, _, player_id, tick_rate, udp, udp_token, session_token = WELCOME.unpack_from(payload)
+    config = {
+        'rules': decode_rules(payload, WELCOME.size),
+        'tick_rate': tick_rate,
+        'udp_token': udp_token if udp else None,
+        'session_token': session_token or None,
+    }
+    return player_id, config
+
+
+class SnapshotLayout:
+    """Where each value of a snapshot goes, for matches with some number of balls and players.
+
+    Snapshot values are a flat tuple in wire order: the tick, then x, y, dx, dy
+    and speed multiplier of every ball, the y of every paddle, the two scores,
+    the flags and, last, the newest input each paddle reflects. A DELTA's mask
+    has a bit per field, so it is 2, 4 or 8 bytes as the layout needs.
+    """
+
+    BALL_FIELDS = (('x', 'f'), ('y', 'f'), ('dx', 'f'), ('dy', 'f'), ('multiplier', 'f'))
+    MAX_DELTA_MASKS = 256
+
+    def __init__(self, balls, players):
+        self.balls = balls
+        self.players = players
+        fields = [('tick', 'I')]  # Room's physics step count; tick / tick_rate is the snapshot's server time
+        for ball in range(balls):
+            fields += [(f'ball{ball + 1}_{name}', fmt) for name, fmt in self.BALL_FIELDS]
+        fields += [(f'paddle{player + 1}_y', 'f') for player in range(players)]
+        fields += [('score1', 'B'), ('score2', 'B'), ('flags', 'H')]
+        fields += [(f'input_seq{player + 1}', 'I') for player in range(players)]
+        self.fields = tuple(fields)
+        self.keyframe = struct.Struct('!BI' + ''.join(fmt for _, fmt in fields))  # type, seq, every field
+        mask = 'H' if len(fields) <= 16 else 'I' if len(fields) <= 32 else 'Q'
+        self.delta_header = struct.Struct('!BII' + mask)  # type, seq, baseline seq, changed-field mask
+        self.deltas = {}  # mask -> (indices of the changed fields, Struct of their values)
+
+        self.paddles_at = 1 + 5 * balls  # Index of the first paddle y
+        self.scores_at = self.paddles_at + players
+        self.play_again_shift = READY_SHIFT + players
+        self.winner_shift = self.play_again_shift + players
+        self.state = self.compile_state()
+
+    def values(self, game_state):
+        """Flatten the dynamic part of a game_state into a tuple in wire order"""
+        winner = game_state['winner']
+        flags = STATUS_CODES[game_state['status']]
+        for player, (ready, play_again) in enumerate(zip(game_state['ready'], game_state['play_again'])):
+            if ready:
+                flags |= 1 << (READY_SHIFT + player)
+            if play_again:
+                flags |= 1 << (self.play_again_shift + player)
+        flags |= (0 if winner is None else winner + 1) << self.winner_shift
+
+        values = [game_state['tick']]
+        for ball in game_state['balls']:
+            values += (ball['x'], ball['y'], ball['dx'], ball['dy'], ball['multiplier'])
+        paddles = game_state['paddles']
+        values += [paddle['y'] for paddle in paddles]
+        values += game_state['scores']
+        values.append(flags)
+        values += [paddle['input_seq'] for paddle in paddles]
+        return tuple(values)
+
+    def event_values(self, values):
+        """The score / status / ready part of snapshot values, which must reach clients reliably"""
+        return values[self.scores_at:self.scores_at + 3]
+
+    def compile_state(self):
+        """state(values): rebuild a game_state dict (what the rules don't already say) from snapshot values.
+
+        Generated once per layout as a single dict display with the indices filled
+        in, like namedtuple does, since clients rebuild every snapshot they draw.
+        """
+        scores_at = self.scores_at
+        flags = f'v[{scores_at + 2}]'
+        balls = ', '.join('{' + ', '.join(f"'{name}': v[{1 + 5 * ball + i}]"
+                                          for i, (name, _) in enumerate(self.BALL_FIELDS)) + '}'
+                          for ball in range(self.balls))
+        paddles = ', '.join(f"{{'y': v[{self.paddles_at + player}], 'input_seq': v[{scores_at + 3 + player}]}}"
+                            for player in range(self.players))
+        ready = ', '.join(f'{flags} & {1 << (READY_SHIFT + player)} != 0' for player in range(self.players))
+        play_again = ', '.join(f'{flags} & {1 << (self.play_again_shift + player)} != 0'
+                               for player in range(self.players))
+        winner = f'{flags} >> {self.winner_shift}'  # 0 for none, else the winner + 1
+        source = (f"lambda v: {{'tick': v[0], 'balls': [{balls}], 'paddles': [{paddles}], "
+                  f"'scores': [v[{scores_at}], v[{scores_at + 1}]], 'status': STATUSES[{flags} & {STATUS_MASK}], "
+                  f"'ready': [{ready}], 'play_again': [{play_again}], "
+                  f"'winner': ({winner}) - 1 if {winner} else None}}")
+        return eval(source, {'STATUSES': STATUSES})
+
+    def encode_keyframe(self, seq, values):
+        return self.keyframe.pack(MSG_KEYFRAME, seq, *values)
+
+    def encode_delta(self, seq, baseline_seq, baseline, values):
+        """Only the fields of `values` that differ from `baseline`"""
+        mask = 0
+        changed = []
+        for index, (old, new) in enumerate(zip(baseline, values)):
+            if old != new:
+                mask |= 1 << index
+                changed.append(new)
+        return self.delta_header.pack(MSG_DELTA, seq, baseline_seq, mask) + self.delta(mask)[1].pack(*changed)
+
+    def delta(self, mask):
+        """(indices, Struct) for the fields a DELTA's mask says changed; compiled once per mask"""
+        entry = self.deltas.get(mask)
+        if entry is None:
+            if len(self.deltas) >= self.MAX_DELTA_MASKS:
+                self.deltas.clear()  # Only a few masks recur in play; don't let odd ones pile up
+            indices = tuple(index for index in range(len(self.fields)) if mask >> index & 1)
+            if len(indices) != bin(mask).count('1'):
+                raise ProtocolError(f"delta mask {mask:#x} names fields this layout doesn't have")
+            entry = self.deltas[mask] = (indices, struct.Struct('!' + ''.join(self.fields[i][1] for i in indices)))
+        return entry
+
+
+LAYOUTS = {}  # (balls, players) -> SnapshotLayout
+
+
+def snapshot_layout(rules):
+    """The (shared) SnapshotLayout for a MatchConfig"""
+    key = (rules.balls, rules.players)
+    layout = LAYOUTS.get(key)
+    if layout is None:
+        layout = LAYOUTS[key] = SnapshotLayout(*key)
+    return layout
+
+
+def legacy_state(game_state, rules):
+    """The game_state as pickle clients from before match rules know it: one ball, two paddles, static keys included"""
+    ball = game_state['balls'][0]
+    paddle1, paddle2 = game_state['paddles'][:2]
+    score1, score2 = game_state['scores']
+    return {
+        'tick': game_state['tick'],
+        'ball': {'x': ball['x'], 'y': ball['y'], 'dx': ball['dx'], 'dy': ball['dy'], 'radius': rules.ball_radius},
+        'paddle1': {'y': paddle1['y'], 'score': score1, 'input_seq': paddle1['input_seq']},
+        'paddle2': {'y': paddle2['y'], 'score': score2, 'input_seq': paddle2['input_seq']},
+        'width': rules.width,
+        'height': rules.height,
+        'paddle_width': rules.paddle_width,
+        'paddle_height': rules.paddle_height,
+        'status': game_state['status'],
+        'player1_ready': game_state['ready'][0],
+        'player2_ready': game_state['ready'][1],
+        'win_score': rules.win_score,
+        'ball_speed_multiplier': ball['multiplier'],
+        'winner': game_state['winner'],
+        'player1_play_again': game_state['play_again'][0],
+        'player2_play_again': game_state['play_again'][1],
+    }
+
+
+def forget_before(history, oldest):
+    """Drop the entries of a seq-ordered OrderedDict up to and including seq `oldest`.
+
+    Seqs skip (lost datagrams, frames dropped on a full socket, ticks with
+    nothing broadcast), so popping exactly the seq that just fell out of the
+    window would let the ones it skipped pile up.
+    """
+    while history and next(iter(history)) <= oldest:
+        history.popitem(last=False)
+
+
+class SnapshotEncoder:
+    """Server-side replication state for one client.
+
+    Remembers the last HISTORY snapshots sent so the next one can be a delta
+    against whichever of them the client last acknowledged.
+    """
+
+    HISTORY = 32  # ~0.5 s at 60 Hz; older acks fall back to a keyframe
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.history = OrderedDict()  # seq -> values, oldest first
+        self.acked_seq = None
+        self.keyframes = 0
+        self.deltas = 0
+
+    def acknowledge(self, seq):
+        if self.acked_seq is None or seq > self.acked_seq:
+            self.acked_seq = seq
+
+    def encode(self, seq, values):
+        baseline = self.history.get(self.acked_seq)
+        if baseline is None:
+            self.keyframes += 1
+            payload = self.layout.encode_keyframe(seq, values)
+        else:
+            self.deltas += 1
+            payload = self.layout.encode_delta(seq, self.acked_seq, baseline, values)
+
+        self.history[seq] = values
+        forget_before(self.history, seq - self.HISTORY)
+        return payload
+
+
+class SnapshotDecoder:
+    """Client-side counterpart of SnapshotEncoder: rebuilds snapshots from keyframes and deltas"""
+
+    HISTORY = SnapshotEncoder.HISTORY
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.history = OrderedDict()  # seq -> values, oldest first
+        self.latest_seq = 0  # What the client acknowledges back
+
+    def is_stale(self, payload):
+        """True for a snapshot no newer than one already decoded (late datagram or TCP duplicate)"""
+        _, seq = SNAPSHOT_HEADER.unpack_from(payload)
+        return seq <= self.latest_seq
+
+    def decode(self, payload):
+        """Returns (seq, values) for a KEYFRAME or DELTA payload"""
+        layout = self.layout
+        msg_type = message_type(payload)
+        if msg_type == MSG_KEYFRAME:
+            unpacked = layout.keyframe.unpack(payload)
+            seq, values = unpacked[1], unpacked[2:]
+        elif msg_type == MSG_DELTA:
+            _, seq, baseline_seq, mask = layout.delta_header.unpack_from(payload)
+            baseline = self.history.get(baseline_seq)
+            if baseline is None:
+                raise ProtocolError(f"delta against unknown baseline {baseline_seq}")
+            indices, changed = layout.delta(mask)
+            if len(payload) != layout.delta_header.size + changed.size:
+                raise ProtocolError("DELTA size doesn't match its mask")
+            values = list(baseline)
+            for index, value in zip(indices, changed.unpack_from(payload, layout.delta_header.size)):
+                values[index] = value
+            values = tuple(values)
+        else:
+            raise ProtocolError("expected KEYFRAME or DELTA")
+
+        self.history[seq] = values
+        forget_before(self.history, seq - self.HISTORY)
+        self.latest_seq = max(self.latest_seq, seq)
+        return seq, values
+
+
+def encode_input(ack_seq, input_seq, move, ready, play_again, view_tick=0):
+    """`move` is how far the paddle moved for this input; the server applies and clamps it.
+
+    `view_tick` is the server tick on screen when the move was made (0: unknown).
+    """
+    return INPUT.pack(MSG_INPUT, ack_seq, input_seq, move, encode_flags(ready, play_again), view_tick)
+
+
+def encode_inputs(ack_seq, moves, view_tick=0):
+    """INPUTS carrying (input_seq, move) pairs, oldest first; none for a keepalive"""
+    moves = list(moves)[-MAX_DATAGRAM_MOVES:]
+    return INPUTS_HEADER.pack(MSG_INPUTS, ack_seq, view_tick, len(moves)) + b''.join(
+        INPUT_MOVE.pack(input_seq, move) for input_seq, move in moves)
+
+
+def encode_control(ready, play_again):
+    return CONTROL.pack(MSG_CONTROL, encode_flags(ready, play_again))
+
+
+def encode_flags(ready, play_again):
+    return (INPUT_READY if ready else 0) | (INPUT_PLAY_AGAIN if play_again else 0)
+
+
+def decode_input(payload):
+    """Decode an INPUT, INPUTS or CONTROL message.
+
+    The result is a dict like the ones legacy clients send, except paddle movement
+    comes as a list of sequenced relative 'moves' instead of an absolute paddle_y.
+    """
+    msg_type = message_type(payload)
+    if msg_type == MSG_INPUT and len(payload) == INPUT.size:
+        _, ack_seq, input_seq, move, flags, view_tick = INPUT.unpack(payload)
+        return {
+            'ack': ack_seq,
+            'view_tick': view_tick,
+            'moves': [(input_seq, move)],
+            'ready': bool(flags & INPUT_READY),
+            'play_again': bool(flags & INPUT_PLAY_AGAIN),
+        }
+    if msg_type == MSG_INPUTS and len(payload) >= INPUTS_HEADER.size:
+        _, ack_seq, view_tick, count = INPUTS_HEADER.unpack_from(payload)
+        if len(payload) != INPUTS_HEADER.size + count * INPUT_MOVE.size:
+            raise ProtocolError("truncated INPUTS")
+        return {
+            'ack': ack_seq,
+            'view_tick': view_tick,
+            'moves': [INPUT_MOVE.unpack_from(payload, INPUTS_HEADER.size + i * INPUT_MOVE.size)
+                      for i in range(count)],
+        }
+    if msg_type == MSG_CONTROL and len(payload) == CONTROL.size:
+        _, flags = CONTROL.unpack(payload)
+        return {
+            'moves': [],
+            'ready': bool(flags & INPUT_READY),
+            'play_again': bool(flags & INPUT_PLAY_AGAIN),
+        }
+    raise ProtocolError("expected INPUT, INPUTS or CONTROL")
+
+
+def encode_ping(now):
+    return PING.pack(MSG_PING, now)
+
+
+def decode_ping(payload):
+    """The sender's clock reading from a PING"""
+    if message_type(payload) != MSG_PING or len(payload) != PING.size:
+        raise ProtocolError("expected PING")
+    return PING.unpack(payload)[1]
+
+
+def encode_pong(ping_time, received, now):
+    return PONG.pack(MSG_PONG, ping_time, received, now)
+
+
+def decode_pong(payload):
+    """(ping time, responder's receive time, responder's reply time) from a PONG"""
+    if message_type(payload) != MSG_PONG or len(payload) != PONG.size:
+        raise ProtocolError("expected PONG")
+    return PONG.unpack(payload)[1:]
+
+
+class _PlainDataUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"refusing to load {module}.{name}")
+
+
+def safe_loads(data):
+    """Unpickle a legacy client message without ever importing or calling anything.
+
+    Legacy clients only send dicts of numbers and bools, which need no globals;
+    anything that does (and could run code) is rejected.
+    """
+    return _PlainDataUnpickler(io.BytesIO(data)).load()
+
+
+def decode_client_message(payload, binary):
+    """Decode one message from a player, whichever protocol it negotiated"""
+    if binary:
+        return decode_input(payload)
+    return safe_loads(payload)
@@ -0,0 +1,171 @@
+"""Local lossy / high-latency relay for testing Pong over bad networks.
+
+Relays TCP and UDP on the same port number to a server, adding latency, jitter
+and loss. UDP datagrams are simply dropped. TCP can't lose data, so a "lost"
+segment is held back for a retransmission timeout and everything behind it
+waits too, which is the head-of-line blocking a real lossy link causes.
+
+    python pong_proxy.py --listen 6000 --target localhost:5555 --loss 0.03 --latency 0.04
+"""
+import argparse
+import asyncio
+import random
+
+
+class LossyLink:
+    """Decides when (and whether) each packet in one direction gets delivered"""
+
+    def __init__(self, loss=0.0, latency=0.0, jitter=0.0, rto=0.2):
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.rto = rto  # Linux's minimum TCP retransmission timeout
+        self.last_delivery = 0.0
+
+    def dropped(self):
+        return random.random() < self.loss
+
+    def transit(self):
+        return self.latency + random.uniform(0, self.jitter)
+
+    def stream_delivery(self, now):
+        """Delivery time for the next TCP chunk: retransmitted while lost, and never before the previous one"""
+        at = now + self.transit()
+        backoff = self.rto
+        while self.dropped():
+            at += backoff
+            backoff *= 2
+        self.last_delivery = max(at, self.last_delivery)
+        return self.last_delivery
+
+
+class TcpRelay:
+    def __init__(self, proxy):
+        self.proxy = proxy
+
+    async def handle(self, client_reader, client_writer):
+        host, port = self.proxy.target
+        try:
+            server_reader, server_writer = await asyncio.open_connection(host, port)
+        except OSError:
+            client_writer.close()
+            return
+        await asyncio.gather(
+            self.pump(client_reader, server_writer, self.proxy.make_link()),
+            self.pump(server_reader, client_writer, self.proxy.make_link()),
+            return_exceptions=True)
+
+    async def pump(self, reader, writer, link):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()  # (delivery time, chunk), written strictly in order
+        delivery = asyncio.ensure_future(self.deliver(writer, queue))
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                queue.put_nowait((link.stream_delivery(loop.time()), chunk))
+        finally:
+            queue.put_nowait((None, None))
+            await delivery
+            writer.close()
+
+    async def deliver(self, writer, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            at, chunk = await queue.get()
+            if chunk is None or writer.is_closing():
+                return
+            await asyncio.sleep(max(0.0, at - loop.time()))
+            writer.write(chunk)
+
+
+class UdpUpstream(asyncio.DatagramProtocol):
+    """Proxy <-> server leg for one client address"""
+
+    def __init__(self, relay, client_addr):
+        self.relay = relay
+        self.client_addr = client_addr
+        self.link = relay.proxy.make_link()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.link.dropped():
+            return
+        loop = asyncio.get_running_loop()
+        loop.call_later(self.link.transit(), self.relay.transport.sendto, data, self.client_addr)
+
+
+class UdpRelay(asyncio.DatagramProtocol):
+    """Client <-> proxy leg; opens one upstream socket per client address"""
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.transport = None
+        self.upstreams = {}  # client addr -> UdpUpstream
+        self.link = proxy.make_link()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        asyncio.ensure_future(self.forward(data, addr))
+
+    async def forward(self, data, addr):
+        upstream = self.upstreams.get(addr)
+        if upstream is None:
+            loop = asyncio.get_running_loop()
+            _, upstream = await loop.create_datagram_endpoint(
+                lambda: UdpUpstream(self, addr), remote_addr=self.proxy.target)
+            self.upstreams[addr] = upstream
+        if self.link.dropped():
+            return
+        await asyncio.sleep(self.link.transit())
+        upstream.transport.sendto(data)
+
+
+class LossyProxy:
+    def __init__(self, listen_port, target, loss=0.0, latency=0.0, jitter=0.0,
+                 host='127.0.0.1'):
+        self.host = host
+        self.listen_port = listen_port
+        self.target = target  # (host, port)
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.ready = None
+
+    def make_link(self):
+        return LossyLink(self.loss, self.latency, self.jitter)
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        tcp = await asyncio.start_server(TcpRelay(self).handle, self.host, self.listen_port)
+        self.listen_port = tcp.sockets[0].getsockname()[1]
+        await loop.create_datagram_endpoint(lambda: UdpRelay(self), local_addr=(self.host, self.listen_port))
+        print(f"🌧️  Proxy {self.host}:{self.listen_port} -> {self.target[0]}:{self.target[1]} "
+              f"(loss {self.loss:.1%}, latency {self.latency * 1000:.0f} ms, jitter {self.jitter * 1000:.0f} ms)")
+        if self.ready is not None:
+            self.ready.set()
+        async with tcp:
+            await tcp.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lossy TCP + UDP relay for Pong")
+    parser.add_argument('--listen', type=int, default=6000)
+    parser.add_argument('--target', default='localhost:5555', help="server host:port")
+    parser.add_argument('--loss', type=float, default=0.03, help="packet loss probability per direction")
+    parser.add_argument('--latency', type=float, default=0.04, help="one-way delay in seconds")
+    parser.add_argument('--jitter', type=float, default=0.01, help="extra random one-way delay in seconds")
+    args = parser.parse_args()
+
+    target_host, target_port = args.target.rsplit(':', 1)
+    proxy = LossyProxy(args.listen, (target_host, int(target_port)), args.loss, args.latency, args.jitter)
+    try:
+        asyncio.run(proxy.serve())
+    except KeyboardInterrupt:
+        print("\n⏹️  Proxy stopped by user")
@@ -0,0 +1,130 @@
+"""Spectator relay: re-fans one match from a Pong server to many more spectators.
+
+The relay connects upstream as a single spectator and serves the same stream
+to its own spectators from a SpectatorFeed, so the match server pays for one
+viewer per relay however many people watch. Relays can feed other relays.
+
+    python pong_relay.py --upstream gameserver:5555 --room 3 --port 6000
+    python pong_client.py --port 6000 --spectate
+"""
+import argparse
+import asyncio
+import time
+
+from pong_net import FrameBuffer, HEADER, MAX_FRAME_SIZE, pack_frame
+from pong_protocol import (decode_spectate, decode_welcome, encode_spectate, PROTOCOL_VERSION, SnapshotDecoder,
+                           snapshot_layout)
+from pong_spectate import SpectatorFeed, TransportViewer
+
+
+class RelayViewerProtocol(asyncio.Protocol):
+    """One downstream spectator: waits for its SPECTATE, then the feed writes to it"""
+
+    def __init__(self, relay):
+        self.relay = relay
+        self.transport = None
+        self.frames = FrameBuffer()
+        self.viewer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=TransportViewer.WRITE_BUFFER_HIGH)
+
+    def data_received(self, data):
+        if self.viewer is not None:
+            return  # Spectators have nothing more to say
+        self.frames.feed(data)
+        try:
+            frames = self.frames.pop_frames()
+        except ValueError:
+            self.transport.close()
+            return
+        if not frames:
+            return
+        spectate = decode_spectate(frames[0])
+        if spectate is None or spectate[0] != PROTOCOL_VERSION:
+            self.transport.close()
+            return
+        self.transport.write(self.relay.welcome)
+        self.viewer = TransportViewer(self.transport)
+        self.relay.feed.add(self.viewer)
+
+    def connection_lost(self, exc):
+        if self.viewer is not None:
+            self.relay.feed.remove(self.viewer)
+
+
+class PongRelay:
+    """Upstream spectator connection plus a listener for downstream spectators"""
+
+    STATS_INTERVAL = 10  # Seconds between viewer reports
+
+    def __init__(self, upstream_host, upstream_port, room_id=0, host='0.0.0.0', port=6000):
+        self.upstream = (upstream_host, upstream_port)
+        self.room_id = room_id
+        self.host = host
+        self.port = port
+        self.feed = None  # Built once the upstream WELCOME says the match's rules
+        self.welcome = None  # Upstream WELCOME frame, handed to every downstream spectator
+
+    async def read_frame(self, reader):
+        header = await reader.readexactly(HEADER.size)
+        (length,) = HEADER.unpack(header)
+        if length > MAX_FRAME_SIZE:
+            raise ValueError(f"frame of {length} bytes exceeds limit")
+        return await reader.readexactly(length)
+
+    async def serve(self):
+        reader, writer = await asyncio.open_connection(*self.upstream)
+        writer.write(pack_frame(encode_spectate(self.room_id)))
+        payload = await self.read_frame(reader)
+        _, config = decode_welcome(payload)  # Raises if upstream refused or speaks another protocol version
+        self.welcome = pack_frame(payload)
+        layout = snapshot_layout(config['rules'])
+        self.feed = SpectatorFeed(layout)
+        print(f"📡 Relaying room {self.room_id or 'in play'} from {self.upstream[0]}:{self.upstream[1]}")
+
+        loop = asyncio.get_running_loop()
+        listener = await loop.create_server(lambda: RelayViewerProtocol(self), self.host, self.port)
+        print(f"👀 Spectators can connect on {self.host}:{self.port}")
+
+        snapshots = SnapshotDecoder(layout)
+        next_stats = time.monotonic() + self.STATS_INTERVAL
+        try:
+            async with listener:
+                while True:
+                    try:
+                        payload = await self.read_frame(reader)
+                    except asyncio.IncompleteReadError:
+                        break
+                    if snapshots.is_stale(payload):
+                        continue
+                    seq, values = snapshots.decode(payload)
+                    now = time.monotonic()
+                    self.feed.publish(seq, values, now)
+                    if now >= next_stats:
+                        next_stats += self.STATS_INTERVAL
+                        _, out_rate = self.feed.traffic.rates()
+                        print(f"📊 {len(self.feed)} spectators, out {out_rate:.0f} B/s, "
+                              f"{self.feed.throttled} throttled, {self.feed.dropped} dropped")
+        finally:
+            print("❌ Upstream closed the match")
+            self.feed.close()
+            writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pong spectator relay")
+    parser.add_argument('--upstream', default='localhost:5555', metavar='HOST:PORT',
+                        help="match server or another relay")
+    parser.add_argument('--room', type=int, default=0, help="room to relay (default: any match in play)")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=6000)
+    args = parser.parse_args()
+
+    upstream_host, upstream_port = args.upstream.rsplit(':', 1)
+    relay = PongRelay(upstream_host, int(upstream_port), args.room, args.host, args.port)
+    try:
+        asyncio.run(relay.serve())
+    except KeyboardInterrupt:
+        print("\n⏹️  Relay stopped by user")
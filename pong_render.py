@@ -0,0 +1,308 @@
+"""Surface caching for the Pong client.
+
+Static layers (the background gradient, shaded paddles) are baked once, and
+everything keyed by content (text, glowing glyphs, the ball glow, translucent
+panels) is built on first use and kept in a small LRU. A frame is then mostly
+blits of surfaces that already exist instead of hundreds of draw calls and
+fresh SRCALPHA allocations. Particles live in a pooled, array-backed system
+drawn from the same kind of pre-rendered sprites, and DirtyRenderer can push
+only the parts of the screen that changed.
+"""
+from collections import OrderedDict
+
+import numpy as np
+import pygame
+
+
+def gradient_surface(width, height, top_color, bottom_color):
+    """A vertical gradient, one line per row, drawn once"""
+    surface = pygame.Surface((width, height))
+    for i in range(height):
+        ratio = i / height
+        color = tuple(int(top * (1 - ratio) + bottom * ratio)
+                      for top, bottom in zip(top_color, bottom_color))
+        pygame.draw.line(surface, color, (0, i), (width, i))
+    return surface
+
+
+class RenderCache:
+    """LRU of pre-rendered surfaces, keyed by what they show"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.fonts = {}  # size -> pygame Font
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        """The surface cached under `key`, building it with `build()` on a miss"""
+        surface = self.entries.get(key)
+        if surface is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = build()
+        self.entries[key] = surface
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return surface
+
+    def font(self, size):
+        font = self.fonts.get(size)
+        if font is None:
+            font = self.fonts[size] = pygame.font.Font(None, size)
+        return font
+
+    def text(self, size, text, color):
+        return self.get(('text', size, text, color),
+                        lambda: self.font(size).render(text, True, color))
+
+    def glow_text(self, size, text, color, glow_color, spread):
+        """Text over four offset copies of itself in `glow_color`, as one surface.
+
+        Blit it centred where the plain text would go; it is `spread` px larger on every side.
+        """
+        def build():
+            font = self.font(size)
+            glow = font.render(text, True, glow_color)
+            width, height = glow.get_size()
+            surface = pygame.Surface((width + 2 * spread, height + 2 * spread), pygame.SRCALPHA)
+            for dx, dy in ((spread, spread), (-spread, -spread), (spread, -spread), (-spread, spread)):
+                surface.blit(glow, (spread + dx, spread + dy))
+            surface.blit(font.render(text, True, color), (spread, spread))
+            return surface
+        return self.get(('glow_text', size, text, color, glow_color, spread), build)
+
+    def glow_circle(self, radius, color):
+        """The ball: three translucent halos and a solid core. Blit it centred on the ball."""
+        def build():
+            outer = int(radius * 1.6) + 5
+            surface = pygame.Surface((outer * 2, outer * 2), pygame.SRCALPHA)
+            # draw.circle overwrites alpha instead of blending, so paint the widest halo
+            # first and give each smaller one the combined alpha of every halo under it
+            transparency = 1.0
+            for i in reversed(range(3)):
+                scale = 1 + i * 0.3
+                transparency *= 1 - max(0, 100 - i * 30) / 255
+                alpha = round(255 * (1 - transparency))
+                pygame.draw.circle(surface, (*color, alpha), (outer, outer), int(radius * scale))
+            pygame.draw.circle(surface, color, (outer, outer), radius)
+            return surface
+        return self.get(('glow_circle', radius, color), build)
+
+    def panel(self, width, height, color, alpha, border_radius, border=3):
+        """A rounded translucent box with a solid outline (buttons, status boxes)"""
+        def build():
+            surface = pygame.Surface((width, height), pygame.SRCALPHA)
+            pygame.draw.rect(surface, (*color, alpha), (0, 0, width, height), border_radius=border_radius)
+            if border:
+                pygame.draw.rect(surface, color, (0, 0, width, height), border, border_radius=border_radius)
+            return surface
+        return self.get(('panel', width, height, color, alpha, border_radius, border), build)
+
+    def paddle(self, width, height, color):
+        """Shadow, top-to-bottom shade and white outline; blit it 5 px up and left of the paddle"""
+        def build():
+            surface = pygame.Surface((width + 10, height + 10), pygame.SRCALPHA)
+            pygame.draw.rect(surface, (*color, 50), (5, 5, width, height), border_radius=8)
+            darker_color = tuple(max(0, c - 50) for c in color)
+            surface.blit(gradient_surface(width, height, color, darker_color), (5, 5))
+            pygame.draw.rect(surface, (255, 255, 255), (5, 5, width, height), 2, border_radius=8)
+            return surface
+        return self.get(('paddle', width, height, color), build)
+
+
+class ParticlePool:
+    """Fixed-capacity particle system kept in flat NumPy arrays.
+
+    Live particles are packed at the front of the arrays, so one update() moves,
+    ages and shrinks all of them and drops the dead ones in a single pass. They
+    are drawn with one blits() call from sprites pre-rendered per colour, size
+    and remaining life (which sets the alpha).
+    """
+
+    LIFE = 30  # Frames a particle lives
+    MAX_SIZE = 5
+
+    def __init__(self, capacity=10000, seed=None):
+        self.capacity = capacity
+        self.count = 0
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.vx = np.zeros(capacity)
+        self.vy = np.zeros(capacity)
+        self.life = np.zeros(capacity, dtype=np.int32)
+        self.size = np.zeros(capacity)
+        self.color = np.zeros(capacity, dtype=np.int32)  # Index into self.colors
+        self.colors = []
+        self.sprites = []  # Per colour: sprite list indexed by size * (LIFE + 1) + life
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.count
+
+    def color_index(self, color):
+        if color not in self.colors:
+            self.colors.append(color)
+            self.sprites.append(self.render_sprites(color))
+        return self.colors.index(color)
+
+    def render_sprites(self, color):
+        sprites = []
+        for size in range(self.MAX_SIZE + 1):
+            for life in range(self.LIFE + 1):
+                alpha = int((life / self.LIFE) * 255)
+                sprite = pygame.Surface((size * 2, size * 2), pygame.SRCALPHA)
+                pygame.draw.circle(sprite, (*color, alpha), (size, size), size)
+                sprites.append(sprite)
+        return sprites
+
+    def emit(self, x, y, count, color):
+        """Spawn `count` particles at (x, y); when the pool is full the extra ones are skipped"""
+        start = self.count
+        end = min(self.capacity, start + count)
+        n = end - start
+        self.x[start:end] = x
+        self.y[start:end] = y
+        self.vx[start:end] = self.rng.uniform(-3, 3, n)
+        self.vy[start:end] = self.rng.uniform(-3, 3, n)
+        self.life[start:end] = self.LIFE
+        self.size[start:end] = self.rng.integers(2, self.MAX_SIZE + 1, n)
+        self.color[start:end] = self.color_index(color)
+        self.count = end
+
+    def update(self):
+        """Move, age and shrink every particle, then pack the survivors to the front"""
+        n = self.count
+        self.x[:n] += self.vx[:n]
+        self.y[:n] += self.vy[:n]
+        self.life[:n] -= 1
+        np.maximum(self.size[:n] * 0.95, 1, out=self.size[:n])
+
+        alive = self.life[:n] > 0
+        survivors = int(alive.sum())
+        if survivors < n:
+            for field in (self.x, self.y, self.vx, self.vy, self.life, self.size, self.color):
+                field[:survivors] = field[:n][alive]
+            self.count = survivors
+
+    def draw(self, screen):
+        n = self.count
+        if not n:
+            return
+        size = self.size[:n]
+        left = (self.x[:n] - size).astype(np.int32).tolist()
+        top = (self.y[:n] - size).astype(np.int32).tolist()
+        sprite = (size.astype(np.int32) * (self.LIFE + 1) + self.life[:n]).tolist()
+        color = self.color[:n].tolist()
+        screen.blits([(self.sprites[c][s], (lx, ty)) for c, s, lx, ty in zip(color, sprite, left, top)],
+                     doreturn=False)
+
+
+class DirtyRenderer:
+    """Draws only what changed since the last frame, for displays where a full flip is expensive.
+
+    The client blits into this object instead of the screen. Each frame's blits
+    are recorded as a display list and compared with the previous frame's: the
+    rects of anything that appeared, moved, changed or went away are repainted
+    (clipped, in draw order, so translucent layers blend exactly as in a full
+    redraw) and pushed with pygame.display.update(rects). A new scene, or a
+    frame where most of the screen changed, falls back to a full flip.
+    """
+
+    MAX_RECTS = 24  # Beyond this, dirty rects are snapped to GRID_CELL squares
+    GRID_CELL = 50
+    FULL_REDRAW_AREA = 0.5  # Fraction of the screen dirty before a full flip is cheaper
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.items = []  # (surface, rect, alpha) in draw order, this frame
+        self.previous = []
+        self.scene = None
+        self.full_redraws = 0
+        self.partial_updates = 0
+
+    def blit(self, surface, dest):
+        # Alpha is captured now: a shared surface may be blitted again with another alpha
+        rect = pygame.Rect(dest[0], dest[1], *surface.get_size())
+        self.items.append((surface, rect, surface.get_alpha()))
+        return rect
+
+    def blits(self, blit_sequence, doreturn=True):
+        rects = [self.blit(surface, dest) for surface, dest in blit_sequence]
+        return rects if doreturn else None
+
+    def present(self, scene):
+        """Push this frame to the display and start recording the next one"""
+        items, self.items = self.items, []
+        previous, self.previous = self.previous, items
+
+        if scene != self.scene or not previous:
+            self.scene = scene
+            self.repaint(items, self.screen.get_rect())
+            pygame.display.flip()
+            self.full_redraws += 1
+            return
+
+        before = set((id(s), tuple(r), a) for s, r, a in previous)
+        after = set((id(s), tuple(r), a) for s, r, a in items)
+        dirty = [pygame.Rect(key[1]) for key in before ^ after]
+        if not dirty:
+            return
+
+        screen_rect = self.screen.get_rect()
+        dirty = [rect.clip(screen_rect) for rect in self.merge(dirty)]
+        dirty = [rect for rect in dirty if rect.w and rect.h]
+        if sum(rect.w * rect.h for rect in dirty) > self.FULL_REDRAW_AREA * screen_rect.w * screen_rect.h:
+            self.repaint(items, screen_rect)
+            pygame.display.flip()
+            self.full_redraws += 1
+            return
+
+        for rect in dirty:
+            self.repaint(items, rect)
+        pygame.display.update(dirty)
+        self.partial_updates += 1
+
+    def merge(self, rects):
+        """Fold overlapping rects together; past MAX_RECTS, snap them to a coarse grid instead"""
+        merged = []
+        for rect in sorted(rects, key=lambda r: (r.x, r.y)):
+            for i, other in enumerate(merged):
+                if rect.colliderect(other):
+                    merged[i] = other.union(rect)
+                    break
+            else:
+                merged.append(rect)
+        if len(merged) <= self.MAX_RECTS:
+            return merged
+
+        # Mark every grid cell a rect touches, then emit each row's runs of marked cells
+        cell = self.GRID_CELL
+        cells = set()
+        for rect in merged:
+            for row in range(rect.top // cell, (rect.bottom - 1) // cell + 1):
+                for col in range(rect.left // cell, (rect.right - 1) // cell + 1):
+                    cells.add((row, col))
+        runs = []
+        for row, col in sorted(cells):
+            last = runs[-1] if runs else None
+            if last is not None and last.y == row * cell and last.right == col * cell:
+                last.w += cell
+            else:
+                runs.append(pygame.Rect(col * cell, row * cell, cell, cell))
+        return runs
+
+    def repaint(self, items, area):
+        """Redraw every recorded blit that touches `area`, clipped to it"""
+        screen = self.screen
+        screen.set_clip(area)
+        for surface, rect, alpha in items:
+            if rect.colliderect(area):
+                if surface.get_alpha() != alpha:
+                    surface.set_alpha(alpha)
+                screen.blit(surface, rect)
+        screen.set_clip(None)
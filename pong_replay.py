@@ -0,0 +1,363 @@
+"""Match recordings: a compact, seekable file of every tick of a room, and tools to replay it.
+
+A recording is a sequence of length-prefixed frames (pong_net framing):
+
+    header    REPLAY_HEADER: magic, protocol version, keyframe interval, room, tick rate, start time,
+              then the match's rules (MATCH_CONFIG, as in a WELCOME), then REPLAY_SERVES: the
+              match seed and how many serves it had drawn by the first record
+    records   one snapshot per tick, encoded with the wire protocol: a KEYFRAME every
+              `keyframe_interval` records and a DELTA against the previous record otherwise
+    index     INDEX_MAGIC + the file offset of every keyframe record
+    trailer   TRAILER: offset of the index frame + END_MAGIC (fixed size, at the very end)
+
+Record n is tick first_tick + n, so seeking is one index lookup plus at most
+keyframe_interval - 1 deltas. A file cut short by a crash has no index; the
+reader rebuilds it with one scan.
+
+    python pong_replay.py info recordings/room1-1700000000000.pongrec
+    python pong_replay.py show FILE --tick 5400
+    python pong_replay.py verify FILE
+    python pong_replay.py play FILE --tick 5000 --speed 0.25
+"""
+import argparse
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+from pong_net import HEADER, pack_frame
+from pong_protocol import (decode_rules, encode_rules, MATCH_CONFIG, MSG_KEYFRAME, PROTOCOL_VERSION, ProtocolError,
+                           SnapshotDecoder, snapshot_layout, SPECTATOR_ID)
+
+FILE_MAGIC = b'PREC'
+INDEX_MAGIC = b'PIDX'
+END_MAGIC = b'PEND'
+REPLAY_HEADER = struct.Struct('!4sBHIHd')  # magic, protocol version, keyframe interval, room id,
+                                           # tick rate, start time (unix); MATCH_CONFIG follows
+REPLAY_SERVES = struct.Struct('!QI')  # match seed, serves drawn by the first record; after MATCH_CONFIG
+INDEX_ENTRY = struct.Struct('!Q')
+TRAILER = struct.Struct('!Q4s')  # index frame offset, END_MAGIC
+
+log = logging.getLogger('pong.replay')
+
+
+class Recorder:
+    """Appends one room's snapshots to a recording without blocking the tick loop.
+
+    record() only copies the snapshot values onto a queue; a writer thread
+    creates the file, then encodes whatever has piled up and writes it in one call.
+    """
+
+    KEYFRAME_INTERVAL = 300  # Records between keyframes: 5 s at 60 Hz
+
+    def __init__(self, path, room_id, rules, tick_rate, game_state, keyframe_interval=KEYFRAME_INTERVAL):
+        self.path = path
+        self.layout = snapshot_layout(rules)
+        self.keyframe_interval = keyframe_interval
+        self.queue = queue.SimpleQueue()
+        # Packed now, while the serve count is the one the first record follows; the writer writes it
+        self.header = pack_frame(
+            REPLAY_HEADER.pack(FILE_MAGIC, PROTOCOL_VERSION, keyframe_interval, room_id, tick_rate, time.time())
+            + encode_rules(rules) + REPLAY_SERVES.pack(game_state['seed'], game_state['serves']))
+        self.offset = len(self.header)
+        self.keyframe_offsets = []
+        self.records = 0
+        self.writer = threading.Thread(target=self.run, daemon=True)
+        self.writer.start()
+
+    def record(self, game_state):
+        """Queue the room's current state; called from the tick loop"""
+        self.queue.put(self.layout.values(game_state))
+
+    def close(self):
+        """Finish the file (index and trailer) once everything queued is written; doesn't wait"""
+        self.queue.put(None)
+
+    def run(self):
+        try:
+            file = open(self.path, 'wb')
+        except OSError as e:
+            log.error(f"❗ Can't record to {self.path}: {e}")
+            while self.queue.get() is not None:
+                pass  # Keep the queue from growing until the room closes the recording
+            return
+        file.write(self.header)
+        previous = None
+        done = False
+        while not done:
+            batch = [self.queue.get()]
+            try:
+                while True:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            chunks = []
+            for values in batch:
+                if values is None:
+                    done = True
+                    break
+                seq = self.records
+                if seq % self.keyframe_interval == 0:
+                    self.keyframe_offsets.append(self.offset)
+                    frame = pack_frame(self.layout.encode_keyframe(seq, values))
+                else:
+                    frame = pack_frame(self.layout.encode_delta(seq, seq - 1, previous, values))
+                chunks.append(frame)
+                self.offset += len(frame)
+                self.records += 1
+                previous = values
+            file.write(b''.join(chunks))
+            file.flush()
+
+        index = pack_frame(INDEX_MAGIC + b''.join(INDEX_ENTRY.pack(o) for o in self.keyframe_offsets))
+        file.write(index + TRAILER.pack(self.offset, END_MAGIC))
+        file.close()
+
+
+class ReplayReader:
+    """Memory-mapped recording with random access by tick"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = self.frame_at(0)
+        if header[:len(FILE_MAGIC)] != FILE_MAGIC:
+            raise ProtocolError(f"{path} is not a Pong recording")
+        if header[len(FILE_MAGIC)] != PROTOCOL_VERSION:
+            raise ProtocolError(f"recorded with protocol v{header[len(FILE_MAGIC)]}, this is v{PROTOCOL_VERSION}")
+        (_, _, self.keyframe_interval, self.room_id, tick_rate,
+         self.started_at) = REPLAY_HEADER.unpack_from(header)
+        rules_end = REPLAY_HEADER.size + MATCH_CONFIG.size
+        self.config = {  # As a WELCOME would give it
+            'rules': decode_rules(header[:rules_end], REPLAY_HEADER.size),
+            'tick_rate': tick_rate,
+            'udp_token': None,
+            'session_token': None,
+        }
+        # Recordings made before the header carried the seed end with the rules
+        self.seed, self.serves = (REPLAY_SERVES.unpack_from(header, rules_end) if len(header) > rules_end
+                                  else (None, None))
+        self.layout = snapshot_layout(self.config['rules'])
+        self.records_start = HEADER.size + len(header)
+        self.keyframe_offsets, self.records_end = self.read_index()
+        self.count = self.count_records()
+        self.first_tick = self.decode_from(0)[0][0] if self.count else 0
+
+    def frame_at(self, offset):
+        (length,) = HEADER.unpack_from(self.data, offset)
+        return self.data[offset + HEADER.size:offset + HEADER.size + length]
+
+    def read_index(self):
+        """Keyframe offsets from the index, or from a scan if the file was never finished"""
+        size = len(self.data)
+        if size >= TRAILER.size:
+            index_offset, magic = TRAILER.unpack_from(self.data, size - TRAILER.size)
+            if magic == END_MAGIC:
+                index = self.frame_at(index_offset)[len(INDEX_MAGIC):]
+                offsets = [o for (o,) in INDEX_ENTRY.iter_unpack(index)]
+                return offsets, index_offset
+
+        offsets = []
+        offset = self.records_start
+        while offset + HEADER.size <= size:
+            (length,) = HEADER.unpack_from(self.data, offset)
+            end = offset + HEADER.size + length
+            if end > size:
+                break  # Torn final write
+            if self.data[offset + HEADER.size] == MSG_KEYFRAME:
+                offsets.append(offset)
+            offset = end
+        return offsets, offset
+
+    def count_records(self):
+        """Full keyframe blocks plus however many records follow the last keyframe"""
+        if not self.keyframe_offsets:
+            return 0
+        count = (len(self.keyframe_offsets) - 1) * self.keyframe_interval
+        offset = self.keyframe_offsets[-1]
+        while offset < self.records_end:
+            (length,) = HEADER.unpack_from(self.data, offset)
+            offset += HEADER.size + length
+            count += 1
+        return count
+
+    def decode_from(self, record, limit=1):
+        """Up to `limit` (tick, values) starting at record number `record`"""
+        keyframe = record // self.keyframe_interval
+        offset = self.keyframe_offsets[keyframe]
+        decoder = SnapshotDecoder(self.layout)
+        seq = keyframe * self.keyframe_interval
+        results = []
+        while seq < self.count and len(results) < limit:
+            payload = self.frame_at(offset)
+            offset += HEADER.size + len(payload)
+            _, values = decoder.decode(payload)
+            if seq >= record:
+                results.append((values[0], values))
+            seq += 1
+        return results
+
+    def seek(self, tick):
+        """Snapshot values recorded at `tick`"""
+        record = tick - self.first_tick
+        if not 0 <= record < self.count:
+            raise IndexError(f"tick {tick} is outside {self.first_tick}..{self.first_tick + self.count - 1}")
+        return self.decode_from(record)[0][1]
+
+    def state_at(self, tick):
+        return self.layout.state(self.seek(tick))
+
+    def iter_states(self, start_tick=None):
+        """(tick, game_state) for every record from `start_tick` on, decoding sequentially"""
+        record = 0 if start_tick is None else max(0, start_tick - self.first_tick)
+        while record < self.count:
+            batch = self.decode_from(record, self.keyframe_interval)
+            for tick, values in batch:
+                yield tick, self.layout.state(values)
+            record += len(batch)
+
+    def close(self):
+        self.data.close()
+
+
+def score_events(reader):
+    """(tick, score1, score2) every time the score changed"""
+    events = []
+    last = None
+    for tick, state in reader.iter_states():
+        score = tuple(state['scores'])
+        if score != last:
+            if last is not None:
+                events.append((tick, *score))
+            last = score
+    return events
+
+
+def show_info(reader):
+    size = os.path.getsize(reader.path)
+    duration = reader.count / reader.config['tick_rate']
+    started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(reader.started_at))
+    print(f"🎞️  {reader.path}: room {reader.room_id}, started {started}, rules: {reader.config['rules']}")
+    print(f"   ticks {reader.first_tick}..{reader.first_tick + reader.count - 1} "
+          f"({duration:.1f} s at {reader.config['tick_rate']} Hz), "
+          f"{len(reader.keyframe_offsets)} keyframes every {reader.keyframe_interval} ticks")
+    print(f"   {size} bytes, {size / max(1, reader.count):.1f} bytes/tick")
+    for tick, score1, score2 in score_events(reader):
+        seconds = (tick - reader.first_tick) / reader.config['tick_rate']
+        print(f"   🎯 tick {tick} ({seconds:7.2f} s): {score1} - {score2}")
+
+
+def show_state(reader, tick):
+    state = reader.state_at(tick)
+    print(f"tick {tick} [{state['status']}] score {state['scores'][0]} - {state['scores'][1]}")
+    for number, ball in enumerate(state['balls'], 1):
+        print(f"  ball{number} ({ball['x']:.2f}, {ball['y']:.2f}) velocity ({ball['dx']:.3f}, {ball['dy']:.3f}) "
+              f"x{ball['multiplier']:.2f}")
+    print('  ' + ', '.join(f"paddle{number} y {paddle['y']:.2f} (input {paddle['input_seq']})"
+                           for number, paddle in enumerate(state['paddles'], 1)))
+
+
+def verify_physics(reader, tolerance=0.05):
+    """Re-run every recorded tick through MatchSimulation and compare with what was recorded.
+
+    Each tick starts from the previous recorded balls and this tick's recorded paddles
+    (inputs land between ticks). Serves are drawn again from the match seed and serve
+    count in the header, so ticks with a point, a kick-off or a restart are checked
+    too; recordings without them skip those. Returns the ticks where a ball went
+    somewhere the physics doesn't explain.
+    """
+    from pong_sim import MatchSimulation
+
+    rules = reader.config['rules']
+    sim = MatchSimulation(reader.config['tick_rate'], rules=rules)
+    centre = (rules.width / 2, rules.height / 2)
+    kick_offs = (('waiting_ready', 'playing'), ('game_over', 'waiting_ready'))  # start_game, restart_game
+    rallies = (('playing', 'playing'), ('playing', 'game_over'))
+    serves = reader.serves
+    mismatches = []
+    checked = 0
+    previous = None
+    for tick, state in reader.iter_states():
+        transition = previous and (previous['status'], state['status'])
+        if transition in kick_offs or transition in rallies:
+            expected = dict(previous, paddles=state['paddles'], seed=reader.seed, serves=serves)
+            balls = [dict(ball, crossing=None) for ball in previous['balls']]
+            served = False
+            for ball, actual in zip(balls, state['balls']):
+                if transition in rallies:
+                    sim.move_ball(expected, ball)
+                    # A point: the ball left the court and check_score served it again
+                    if 0 < ball['x'] < rules.width or (actual['x'], actual['y']) != centre:
+                        continue
+                served = True
+                if serves is not None:
+                    ball['multiplier'] = 1.0
+                    sim.reset_ball(expected, ball)
+                    if transition == kick_offs[0]:
+                        sim.move_ball(expected, ball)  # The kick-off tick plays on
+            sim.events.clear()
+            if serves is not None or not served:
+                serves = expected['serves']
+                error = max(abs(ball[k] - actual[k]) for ball, actual in zip(balls, state['balls'])
+                            for k in ('x', 'y', 'dx', 'dy', 'multiplier'))
+                if error > tolerance:
+                    mismatches.append((tick, error))
+                checked += 1
+        previous = state
+    return checked, mismatches
+
+
+def play(reader, start_tick=None, speed=1.0):
+    """Render the recording through the client's renderer"""
+    import pygame
+    from pong_client import PongClient
+
+    viewer = PongClient(host=None)
+    viewer.set_match(SPECTATOR_ID, dict(reader.config, tick_rate=reader.config['tick_rate'] * speed))
+    pygame.display.set_caption(f"Pong replay - {os.path.basename(reader.path)}")
+    tick_interval = 1 / viewer.match_config['tick_rate']
+    next_frame = time.monotonic()
+    for tick, state in reader.iter_states(start_tick):
+        if any(event.type == pygame.QUIT for event in pygame.event.get()):
+            break
+        viewer.apply_game_state(state)
+        viewer.draw()
+        next_frame += tick_interval
+        time.sleep(max(0.0, next_frame - time.monotonic()))
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and replay Pong match recordings")
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('info', "duration, size and every point scored"),
+                            ('show', "the recorded state at one tick"),
+                            ('verify', "re-simulate every tick and flag anything physics can't explain"),
+                            ('play', "watch the recording in the client renderer")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('file')
+        if name in ('show', 'play'):
+            command.add_argument('--tick', type=int, required=(name == 'show'))
+        if name == 'play':
+            command.add_argument('--speed', type=float, default=1.0)
+    args = parser.parse_args()
+
+    reader = ReplayReader(args.file)
+    if args.command == 'info':
+        show_info(reader)
+    elif args.command == 'show':
+        show_state(reader, args.tick)
+    elif args.command == 'verify':
+        checked, mismatches = verify_physics(reader)
+        for tick, error in mismatches:
+            print(f"❗ tick {tick}: ball off by {error:.3f} px from what the physics gives")
+        print(f"{'✅' if not mismatches else '❌'} {checked} ticks re-simulated, {len(mismatches)} mismatches")
+    elif args.command == 'play':
+        play(reader, args.tick, args.speed)
+    reader.close()
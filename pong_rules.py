@@ -0,0 +1,132 @@
+"""Match rules: the arena, the paddles, the ball's speed curve and the score to win.
+
+A MatchConfig is fixed for a match. The server sends it once, in the WELCOME,
+and both sides derive everything static from it (the court, where each paddle
+stands, how the ball speeds up), so snapshots only carry what moves. The
+defaults are the classic game; a server runs a variant with --rules, naming a
+preset or a JSON file of the settings that differ:
+
+    python pong_server.py --rules doubles
+    python pong_server.py --rules tournament.json    # {"balls": 2, "win_score": 7}
+
+Sides are numbered 0 (left) and 1 (right), and player_id % 2 is the side a
+player defends. With `team_size` 2 there are four players: 0 and 2 on the left,
+1 and 3 on the right. A side's first paddle stands `paddle_inset` from its own
+wall and its second `paddle_spacing` further in, so a ball that gets past the
+front paddle can still be saved by the back one.
+"""
+import json
+
+
+class MatchConfig:
+    """Everything static about a match; compare and hash by value"""
+
+    # Settings in wire order (see pong_protocol.MATCH_CONFIG)
+    FIELDS = ('width', 'height', 'paddle_width', 'paddle_height', 'paddle_inset', 'paddle_spacing',
+              'ball_radius', 'win_score', 'balls', 'team_size', 'base_speed', 'speed_up', 'max_speed')
+    WHOLE = FIELDS[:10]  # Packed as H/B, so they must be ints; the speeds go as doubles
+    MAX_BALLS = 8
+    MAX_TEAM_SIZE = 2
+
+    def __init__(self, width=800, height=600, paddle_width=15, paddle_height=100, paddle_inset=10,
+                 paddle_spacing=150, ball_radius=10, win_score=5, balls=1, team_size=1,
+                 base_speed=5, speed_up=0.05, max_speed=15):
+        self.width = width
+        self.height = height
+        self.paddle_width = paddle_width
+        self.paddle_height = paddle_height
+        self.paddle_inset = paddle_inset  # Gap between a side's first paddle and its wall
+        self.paddle_spacing = paddle_spacing  # How much further in a side's second paddle stands
+        self.ball_radius = ball_radius
+        self.win_score = win_score
+        self.balls = balls  # In play at once; each is served again on its own after a point
+        self.team_size = team_size  # Paddles (and players) per side
+        self.base_speed = base_speed  # |dx| of a serve, in pixels per 1/60 s
+        self.speed_up = speed_up  # Added to a ball's multiplier by every paddle hit
+        self.max_speed = max_speed  # Cap on |dx| and |dy| before the multiplier
+        self.check()
+
+        self.players = 2 * team_size
+        # Left edge of each player's paddle, and where the ball's centre meets its face
+        self.paddle_x = tuple(
+            paddle_inset + (player_id // 2) * paddle_spacing if player_id % 2 == 0
+            else width - paddle_inset - paddle_width - (player_id // 2) * paddle_spacing
+            for player_id in range(self.players))
+        self.faces = tuple(
+            x + paddle_width + ball_radius if player_id % 2 == 0 else x - ball_radius
+            for player_id, x in enumerate(self.paddle_x))
+
+    def check(self):
+        """Raise ValueError for settings no match could be played with"""
+        for name in self.FIELDS:
+            value = getattr(self, name)
+            if name in self.WHOLE:
+                if type(value) is not int:
+                    raise ValueError(f"{name} must be a whole number, not {value!r}")
+                if not 0 <= value <= 65535:
+                    raise ValueError(f"{name} must be 0 to 65535")
+            elif type(value) not in (int, float):
+                raise ValueError(f"{name} must be a number, not {value!r}")
+        if not 1 <= self.balls <= self.MAX_BALLS:
+            raise ValueError(f"balls must be 1 to {self.MAX_BALLS}")
+        if not 1 <= self.team_size <= self.MAX_TEAM_SIZE:
+            raise ValueError(f"team_size must be 1 to {self.MAX_TEAM_SIZE}")
+        if not 1 <= self.win_score <= 255:
+            raise ValueError("win_score must be 1 to 255")
+        if not 0 < self.paddle_height < self.height or self.height > 65535 or self.width > 65535:
+            raise ValueError("the paddles must fit the court, and the court 65535 px")
+        if 2 * self.ball_radius >= self.height:
+            raise ValueError("the ball must fit between the walls")
+        front = self.paddle_inset + (self.team_size - 1) * self.paddle_spacing + self.paddle_width
+        if front + self.ball_radius >= self.width / 2:
+            raise ValueError("each side's paddles must stay in its own half")
+        if not 0 < self.base_speed <= self.max_speed or self.speed_up < 0:
+            raise ValueError("speeds must be positive, with base_speed no more than max_speed")
+
+    def settings(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def replace(self, **changes):
+        """A copy with some settings changed"""
+        return MatchConfig(**dict(self.settings(), **changes))
+
+    def __eq__(self, other):
+        return isinstance(other, MatchConfig) and self.settings() == other.settings()
+
+    def __hash__(self):
+        return hash(tuple(self.settings().values()))
+
+    def __str__(self):
+        """The settings that differ from the classic game, or 'classic'"""
+        classic = MatchConfig().settings()
+        changed = [f"{name}={value:g}" for name, value in self.settings().items() if value != classic[name]]
+        return ', '.join(changed) or 'classic'
+
+    def __repr__(self):
+        return f"MatchConfig({self})"
+
+
+CLASSIC = MatchConfig()
+
+# Variants a server can run by name
+PRESETS = {
+    'classic': CLASSIC,
+    'multiball': CLASSIC.replace(balls=3, win_score=10),
+    'doubles': CLASSIC.replace(team_size=2, height=700, win_score=7),
+    'marathon': CLASSIC.replace(win_score=21, speed_up=0.02),
+}
+
+
+def load_rules(spec):
+    """A MatchConfig from a preset name or a JSON file of settings that differ from the classic game"""
+    if spec in PRESETS:
+        return PRESETS[spec]
+    try:
+        with open(spec) as f:
+            changes = json.load(f)
+    except FileNotFoundError:
+        raise ValueError(f"{spec!r} is neither a preset ({', '.join(PRESETS)}) nor a rules file") from None
+    unknown = set(changes) - set(MatchConfig.FIELDS)
+    if unknown:
+        raise ValueError(f"unknown settings in {spec}: {', '.join(sorted(unknown))}")
+    return CLASSIC.replace(**changes)
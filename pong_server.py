@@ -3,307 +3,1322 @@ import threading
 import pickle
 import time
 import random
-import struct
+import secrets
+import asyncio
+import argparse
+import logging
+import os
+from collections import deque, namedtuple
 
-class PongServer:
-    def __init__(self, host='localhost', port=5555):
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.bind((host, port))
-        self.server.listen(2)
-        print(f"🎮 Pong Server started on {host}:{port}")
-        print(f"⏳ Waiting for players to connect...")
-
-        self.game_state = {
-            'ball': {'x': 400, 'y': 300, 'dx': 5, 'dy': 5, 'radius': 10},
-            'paddle1': {'y': 250, 'score': 0},
-            'paddle2': {'y': 250, 'score': 0},
-            'width': 800,
-            'height': 600,
-            'paddle_width': 15,
-            'paddle_height': 100,
-            'status': 'waiting_connection',  # waiting_connection -> waiting_ready -> playing -> game_over
-            'player1_ready': False,
-            'player2_ready': False,
-            'win_score': 5,  # Fixed win score
-            'ball_speed_multiplier': 1.0,  # Increases with each hit
-            'winner': None,
-            'player1_play_again': False,
-            'player2_play_again': False
-        }
-
-        self.clients = []
-        self.running = True
-        self.game_started = False
-        
-        # Speed settings
-        self.BASE_SPEED = 5
-        self.SPEED_INCREASE_PER_HIT = 0.05  # 5% increase per hit
+from pong_bot import BotPlayer
+from pong_metrics import configure_logging, MetricsRegistry, process_metrics, serve_metrics
+from pong_net import ClockSync, FrameBuffer, pack_frame, recv_frame, set_nodelay, TrafficCounter
+from pong_protocol import (DATAGRAM_TOKEN, decode_client_message, decode_hello, decode_ping, decode_pong,
+                           decode_resume, decode_spectate, encode_ping, encode_pong, encode_welcome, HELLO_BOT,
+                           HELLO_UDP, legacy_state, message_type, MSG_PING, MSG_PONG, PROTOCOL_VERSION,
+                           SnapshotEncoder, snapshot_layout, SPECTATOR_ID)
+from pong_replay import Recorder
+from pong_rules import CLASSIC, load_rules
+from pong_sim import MatchSimulation
+from pong_spectate import SocketViewer, SpectatorFeed, TransportViewer
 
-    def handle_client(self, conn, player_id):
-        print(f"✅ Player {player_id + 1} connected")
-        conn.send(pickle.dumps(player_id))
+log = logging.getLogger('pong.server')
 
-        while self.running:
-            try:
-                # Receive 4-byte length header
-                length_data = b''
-                while len(length_data) < 4:
-                    chunk = conn.recv(4 - len(length_data))
-                    if not chunk:
-                        break
-                    length_data += chunk
-                
-                if len(length_data) < 4:
-                    break
-                
-                msg_length = struct.unpack('!I', length_data)[0]
-                
-                # Receive the actual message
-                data = b''
-                while len(data) < msg_length:
-                    chunk = conn.recv(min(8192, msg_length - len(data)))
-                    if not chunk:
-                        break
-                    data += chunk
-                
-                if len(data) < msg_length:
-                    break
+# What the scheduler publishes for other threads each send: never mutated once built
+Snapshot = namedtuple('Snapshot', 'seq values status')
 
-                client_data = pickle.loads(data)
-                
-                if isinstance(client_data, dict):
-                    paddle_y = client_data.get('paddle_y', 250)
-                    ready_status = client_data.get('ready', False)
-                    play_again = client_data.get('play_again', False)
-                else:
-                    paddle_y = client_data
-                    ready_status = False
-                    play_again = False
-                
-                paddle_y = max(0, min(paddle_y, self.game_state['height'] - self.game_state['paddle_height']))
-                
-                if player_id == 0:
-                    self.game_state['paddle1']['y'] = paddle_y
-                    self.game_state['player1_ready'] = ready_status
-                    self.game_state['player1_play_again'] = play_again
-                else:
-                    self.game_state['paddle2']['y'] = paddle_y
-                    self.game_state['player2_ready'] = ready_status
-                    self.game_state['player2_play_again'] = play_again
-                
-                # Check transitions
-                status = self.game_state['status']
-                
-                # Waiting ready -> Playing
-                if (status == 'waiting_ready' and 
-                    self.game_state['player1_ready'] and 
-                    self.game_state['player2_ready']):
-                    self.start_game()
-                
-                # Game over -> Restart
-                if (status == 'game_over' and
-                    self.game_state['player1_play_again'] and
-                    self.game_state['player2_play_again']):
-                    self.restart_game()
-                    
-            except Exception as e:
-                import traceback
-                print(f"❗ Error handling client {player_id + 1}: {e}")
-                traceback.print_exc()
+
+class InputSlot:
+    """A player's messages on their way from its connection to the tick.
+
+    The scheduler is the only reader, but there can be two writers: the
+    connection's reader thread and, with --udp, the datagram thread. put() holds
+    the slot's lock so the newest snapshot ack only moves forward, whichever
+    thread or reordered datagram delivers an older one last; the scheduler
+    hands it to the player's encoder, which no other thread touches. Moves may
+    reach the deque out of order, which the simulation already allows for: it
+    skips any input seq at or below the newest it has applied.
+    """
+
+    __slots__ = ('messages', 'ack', 'lock')
+
+    def __init__(self):
+        self.messages = deque()
+        self.ack = None  # Newest snapshot seq the player acknowledged
+        self.lock = threading.Lock()
+
+    def put(self, message):
+        with self.lock:
+            if 'ack' in message and (self.ack is None or message['ack'] > self.ack):
+                self.ack = message['ack']
+            self.messages.append(message)
+
+    def drain(self):
+        """Everything queued so far, oldest first"""
+        messages = self.messages
+        return [messages.popleft() for _ in range(len(messages))]
+
+
+class Session:
+    """The seat a binary player may take back with RESUME"""
+
+    __slots__ = ('token', 'room', 'player_id', 'conn', 'expires')
+
+    def __init__(self, token, room, player_id, conn):
+        self.token = token
+        self.room = room
+        self.player_id = player_id
+        self.conn = conn  # Connection seated for it now, or the dropped one while suspended
+        self.expires = None  # Monotonic deadline while suspended
+
+
+class SessionTable:
+    """Every seated binary player's Session by token, and which of them are suspended.
+
+    Held under the server lock. All suspensions get the same grace period, so
+    deadlines come in the order sessions were suspended and the oldest is always
+    first in the `suspended` dict: expiring is a look at its head, however many
+    sessions wait. A session costs one slotted object and two dict entries.
+
+    Tokens are random 64-bit numbers; with `shards` > 1 each is congruent to
+    `shard` modulo `shards`, so pong_shard's front door can tell which worker
+    holds a session from the token alone.
+    """
+
+    def __init__(self, grace, shard=0, shards=1):
+        self.grace = grace  # Seconds a dropped player's seat is held
+        self.shard = shard
+        self.shards = shards
+        self.sessions = {}  # token -> Session
+        self.suspended = {}  # token -> Session, oldest suspension first
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def open(self, room, player_id, conn):
+        token = 0
+        while not token or token in self.sessions:
+            token = secrets.randbelow(2**64 // self.shards) * self.shards + self.shard  # Unguessable; ours mod shards
+        session = self.sessions[token] = Session(token, room, player_id, conn)
+        return session
+
+    def get(self, token):
+        return self.sessions.get(token)
+
+    def suspend(self, session, now):
+        session.expires = now + self.grace
+        self.suspended[session.token] = session
+
+    def resume(self, session, conn):
+        self.suspended.pop(session.token, None)
+        session.conn = conn
+        session.expires = None
+
+    def close(self, session):
+        self.sessions.pop(session.token, None)
+        self.suspended.pop(session.token, None)
+
+    def expire(self, now):
+        """Close and return the suspended sessions whose grace period is over"""
+        expired = []
+        for session in self.suspended.values():
+            if session.expires > now:
                 break
+            expired.append(session)
+        for session in expired:
+            self.close(session)
+        return expired
+
+
+class TickScheduler:
+    """Fixed-timestep clock for the authoritative simulation.
+
+    Real time is fed into an accumulator on a monotonic clock and drained in
+    whole physics steps, so the tick rate never drifts with load. When the
+    process falls behind it catches up with several steps (up to max_catch_up)
+    and only then publishes one snapshot. Sending runs on its own, usually lower,
+    rate.
+    """
+
+    def __init__(self, tick_rate=60, send_rate=60, max_catch_up=5):
+        self.tick_rate = tick_rate
+        self.send_rate = send_rate
+        self.tick_interval = 1.0 / tick_rate
+        self.send_interval = 1.0 / send_rate
+        self.max_catch_up = max_catch_up
+
+        self.tick = 0  # Physics steps taken so far
+        self.accumulator = 0.0
+        self.last_time = None
+        self.next_send = None
+        self.lateness = 0.0  # How long after its due time the latest step ran
+        self.step_duration = 0.0  # Wall time of the latest step, across all rooms
+        self.max_step_duration = 0.0
+        self.overruns = 0  # Iterations that needed more than one step to catch up
+        self.dropped_ticks = 0  # Steps given up because the backlog exceeded max_catch_up
+
+    def advance(self, now):
+        """Returns (steps, send): physics steps due now and whether to publish after them"""
+        if self.last_time is None:
+            self.last_time = now
+            self.next_send = now
+            self.accumulator = self.tick_interval  # First tick runs immediately
+        self.accumulator += now - self.last_time
+        self.last_time = now
+
+        steps = int(self.accumulator / self.tick_interval)
+        if steps > 1:
+            self.overruns += 1
+        if steps > self.max_catch_up:
+            self.dropped_ticks += steps - self.max_catch_up
+            self.accumulator -= (steps - self.max_catch_up) * self.tick_interval
+            steps = self.max_catch_up
+        self.accumulator -= steps * self.tick_interval
+        self.lateness = self.accumulator
+        self.tick += steps
+
+        send = steps > 0 and now >= self.next_send
+        if send:
+            self.next_send += self.send_interval
+            if self.next_send <= now:
+                self.next_send = now + self.send_interval  # Too far behind to keep the phase
+        return steps, send
+
+    def record_step(self, duration):
+        self.step_duration = duration
+        self.max_step_duration = max(self.max_step_duration, duration)
+
+    def time_until_next(self, now):
+        """Seconds to sleep before the next step is due"""
+        return max(0.0, self.tick_interval - self.accumulator - (now - self.last_time))
+
+
+class GameRoom:
+    """A single match: the pairing of its players around a MatchSimulation that owns the rules.
+
+    Only the scheduler touches game_state. Network threads change `players`
+    by swapping in a new tuple under the server lock and queue inputs in each
+    connection's InputSlot; update() picks both up. Everyone else reads the
+    immutable `snapshot` the scheduler publishes.
+
+    A player whose connection dropped keeps its seat, marked `gone`, while the
+    server waits for it to resume; the match is suspended meanwhile. A seat
+    that passes to a new connection of the same session is a resume, not a
+    player leaving.
+
+    A seat may also hold a pong_bot.BotPlayer, which update() plays itself.
+    """
+
+    # What the simulation reports, as it appears in the room's log
+    EVENT_LOG = {
+        'start': "🚀 Game starting!",
+        'restart': "🔄 Restarting game...",
+        'hit': "⚡ Speed increased to x{1:.2f}",
+        'score': "🎯 {side} scores! Score: {1} - {2}",
+        'speed_reset': "🔄 Speed reset to x1.0",
+        'win': "🏆 {side} WINS! Final score: {1} - {2}",
+        'rewind': "🛟 Player {player}'s late input reached the ball {1} ticks back",
+    }
+    # Everything else is INFO; a line per hit is for debugging rallies
+    EVENT_LEVEL = {'hit': logging.DEBUG, 'rewind': logging.DEBUG}
 
-        conn.close()
-        if conn in self.clients:
-            self.clients.remove(conn)
-        print(f"❌ Player {player_id + 1} disconnected")
+    def __init__(self, room_id, tick_rate=60, seed=None, rewind_window=0.0, rules=CLASSIC):
+        self.room_id = room_id
+        self.tick_rate = tick_rate
+        self.rules = rules
+        self.layout = snapshot_layout(rules)
+        self.sim = MatchSimulation(tick_rate, rewind_window, rules)
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.game_state = self.sim.new_state(seed)
+
+        self.players = (None,) * rules.players  # Player slot -> connection; replaced, never changed in place
+        self.seated = self.players  # The players the simulation last heard about
+        self.alone_since = None  # Tick since which the seated players have been waiting for the rest
         self.game_started = False
-        self.game_state['status'] = 'waiting_connection'
+        self.snapshot_seq = 0  # Numbers every published snapshot for delta acks
+        self.snapshot = None  # Latest Snapshot
+        self.last_events = None  # Score / status part of the last snapshot sent
+        self.recorder = None  # pong_replay.Recorder while the server records this pairing
+        self.spectators = SpectatorFeed(self.layout)
+
+    def log(self, message, level=logging.INFO):
+        log.log(level, "[Room %s] %s", self.room_id, message)
+
+    def log_events(self):
+        """Log what the simulation did since the last call"""
+        for kind, *details in self.sim.events:
+            level = self.EVENT_LEVEL.get(kind, logging.INFO)
+            if log.isEnabledFor(level):
+                player = details[0] + 1 if details else None
+                side = f"{'Player' if self.rules.team_size == 1 else 'Team'} {player}"
+                self.log(self.EVENT_LOG[kind].format(*details, player=player, side=side), level)
+        self.sim.events.clear()
+
+    def is_full(self):
+        return None not in self.players
+
+    def is_empty(self):
+        return self.players.count(None) == len(self.players)
+
+    def set_seat(self, player_id, conn):
+        """Put `conn` (or None) in a player slot (under the server lock); the next update() tells the simulation.
+
+        Always a new tuple, even for the same connection, so update() looks at the seats again.
+        """
+        players = list(self.players)
+        players[player_id] = conn
+        self.players = tuple(players)
+
+    def add_player(self, conn):
+        """Seat a connection in the first free slot and return its player id (under the server lock)"""
+        player_id = self.players.index(None)
+        self.set_seat(player_id, conn)
+        return player_id
+
+    def remove_player(self, player_id):
+        """Free a player slot (under the server lock); a bot left on its own goes too"""
+        self.set_seat(player_id, None)
+        if all(conn is None or conn.bot for conn in self.players):
+            self.players = (None,) * len(self.players)
+
+    def suspend_player(self, player_id):
+        """Hold a dropped player's seat, already marked `gone`, for a resume (under the server lock)"""
+        self.set_seat(player_id, self.players[player_id])
+
+    @staticmethod
+    def resumed(before, now):
+        return now is not None and now.session is not None and now.session is before.session
+
+    def seats_changed(self, players):
+        """Catch the simulation up with players who left, joined, dropped or resumed since the last tick"""
+        left = [player_id for player_id, (before, now) in enumerate(zip(self.seated, players))
+                if before is not None and now is not before and not self.resumed(before, now)]
+        self.seated = players
+        self.alone_since = self.game_state['tick'] if 0 < players.count(None) < len(players) else None
+        if left:
+            # The match goes back to waiting for an opponent
+            self.game_started = False
+            for player_id in left:
+                self.sim.player_left(self.game_state, player_id)
+            if self.recorder is not None:
+                self.recorder.close()  # A recording covers one pairing of players
+                self.recorder = None
+        if None not in players and not self.game_started:
+            self.game_started = True
+            # Everyone connected, go to waiting ready
+            self.sim.players_joined(self.game_state)
+            self.log(f"👥 {self.everyone()} connected! Press READY to start (First to {self.rules.win_score})...")
+
+        dropped = [player_id for player_id, conn in enumerate(players) if conn is not None and conn.gone]
+        suspended = self.game_state['status'] == 'suspended'
+        if dropped and self.game_started and not suspended:
+            self.sim.suspend(self.game_state)
+            self.log(f"⏸️  Match suspended until player {dropped[0] + 1} resumes")
+        elif not dropped and suspended:
+            self.sim.resume(self.game_state)
+            self.log("▶️  Match resumed")
+
+    def everyone(self):
+        return "Both players" if len(self.players) == 2 else f"All {len(self.players)} players"
 
     def start_game(self):
-        """Start the game after both players are ready"""
-        print("🚀 Game starting!")
-        self.game_state['status'] = 'playing'
-        self.game_state['ball_speed_multiplier'] = 1.0
-        self.reset_ball()
+        """Skip the READY handshake (benchmarks and tools)"""
+        self.sim.start_game(self.game_state)
+        self.log_events()
 
     def restart_game(self):
-        """Restart the game"""
-        print("🔄 Restarting game...")
-        self.game_state['paddle1']['score'] = 0
-        self.game_state['paddle2']['score'] = 0
-        self.game_state['status'] = 'waiting_ready'
-        self.game_state['player1_ready'] = False
-        self.game_state['player2_ready'] = False
-        self.game_state['player1_play_again'] = False
-        self.game_state['player2_play_again'] = False
-        self.game_state['winner'] = None
-        self.game_state['ball_speed_multiplier'] = 1.0
-        self.reset_ball()
-
-    def check_winner(self):
-        """Check if someone won"""
-        p1_score = self.game_state['paddle1']['score']
-        p2_score = self.game_state['paddle2']['score']
-        win_score = self.game_state['win_score']
-        
-        if p1_score >= win_score:
-            self.game_state['winner'] = 0
-            self.game_state['status'] = 'game_over'
-            print(f"🏆 Player 1 WINS! Final score: {p1_score} - {p2_score}")
+        self.sim.restart_game(self.game_state)
+        self.log_events()
+
+    def update(self):
+        """Advance the room by one tick"""
+        players = self.players  # One consistent set of seats for the whole tick
+        if players is not self.seated:
+            self.seats_changed(players)
+
+        inputs = []
+        for player_id, conn in enumerate(players):
+            if conn is not None:
+                messages = conn.play(self.game_state, player_id) if conn.bot else conn.slot.drain()
+                inputs.extend((player_id, message) for message in messages)
+        self.sim.step(self.game_state, inputs)
+        if self.sim.events:
+            self.log_events()
+
+    def publish(self):
+        """Number the current state as the next snapshot and make it the one other threads see"""
+        self.snapshot_seq += 1
+        self.snapshot = Snapshot(self.snapshot_seq, self.layout.values(self.game_state), self.game_state['status'])
+
+    def close(self):
+        """Finish the recording and disconnect the spectators (scheduler thread, room already gone)"""
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        self.spectators.close()
+
+    def legacy_snapshot_message(self):
+        """Framed pickle of the whole state, for clients without the binary protocol"""
+        return pack_frame(pickle.dumps(legacy_state(self.game_state, self.rules)))
+
+    def welcome_message(self, player_id, binary, udp_token=None, session_token=None):
+        """Handshake reply telling a player its id (and, in binary, the match config and its session)"""
+        if binary:
+            return pack_frame(encode_welcome(player_id, self.rules, self.tick_rate, udp_token, session_token))
+        return pickle.dumps(player_id)  # Legacy clients expect a bare pickle
+
+
+class PlayerConnection:
+    """A player's blocking socket in the thread-per-client server"""
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.binary = False  # Set once the client negotiates the binary protocol
+        self.encoder = None  # Delta replication state, binary clients only
+        self.traffic = TrafficCounter()
+        self.room = None
+        self.player_id = None
+        self.udp_token = None  # Set when the client negotiated the UDP transport
+        self.udp_addr = None  # Learned from its first datagram
+        self.spectate = None  # Room id from a SPECTATE handshake; None for players
+        self.resume = None  # Session token from a RESUME handshake
+        self.session = None  # Session while seated, binary players only
+        self.gone = False  # Dropped, its seat held for a resume
+        self.against_bot = False  # Asked for a server bot as its opponent
+        self.bot = False
+        self.inputs = 0  # Messages received since joining
+        self.slot = InputSlot()
+        self.clock = ClockSync()
+        self.pong = None  # (its clock, ours) for a PING the next broadcast answers
+        self.pending = None  # Unsent tail of a frame the socket only took part of
+        self.dropped = 0  # Snapshots not sent because the socket was full
+        self.welcomed = False  # Its own thread wrote the WELCOME; the socket is the scheduler's from then on
+
+    def send_snapshot(self, msg):
+        """Write without ever blocking the scheduler; a player who stops reading misses snapshots.
+
+        A frame the socket took part of is finished before anything new goes out,
+        so the stream stays framed. A dropped snapshot costs nothing: the next
+        delta is encoded against whatever the client acknowledged.
+        """
+        if not self.welcomed:
+            return  # Seated, but the WELCOME isn't out yet; nothing is acked, so the next one is a keyframe
+        if self.pending is not None:
+            self.pending = self.write(self.pending)
+            if self.pending is not None:
+                self.dropped += 1
+                return
+        view = memoryview(msg)
+        self.pending = self.write(view)
+        if self.pending is view:
+            self.pending = None  # Not a byte went out: drop the whole frame
+            self.dropped += 1
+
+    def write(self, view):
+        """Send what the socket takes right now; returns the rest, or None once it's all gone"""
+        try:
+            sent = self.sock.send(view, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return view
+        self.traffic.count_out(sent)
+        return view[sent:] if sent < len(view) else None
+
+    def drop(self):
+        """End a connection whose session resumed elsewhere; its own thread then finishes"""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class PongServer:
+    """Lobby that matchmakes connections into rooms and ticks every room from one scheduler.
+
+    With `port` None it doesn't listen: connections are handed to it (see pong_shard.py).
+
+    A binary player that drops mid-match has `resume_grace` seconds to come back
+    with RESUME and its session token before its seat is given up (0: never held).
+
+    Server bots (pong_bot.py) of `bot_difficulty` and `bot_reaction` play anyone
+    who asks for one in their HELLO, and anyone left waiting alone for
+    `bot_after` seconds (None: never). `bot_matches` bot-only matches are opened
+    at start as a steady load.
+    """
+
+    STATS_INTERVAL = 10  # Seconds between traffic reports when stats are on
+    HELLO_TIMEOUT = 0.5  # Seconds to wait for a HELLO before assuming a legacy client
+    room_id_step = 1  # Shards number their rooms apart, so ids stay unique across processes
+
+    def __init__(self, host='localhost', port=5555, max_rooms=500, stats=False,
+                 tick_rate=60, send_rate=60, udp=False, record_dir=None, seed=None, metrics_port=None,
+                 rewind_window=0.25, resume_grace=10.0, bot_after=None, bot_difficulty=0.7, bot_reaction=0.15,
+                 bot_matches=0, rules=CLASSIC):
+        self.server = None
+        self.port = port
+        if port is not None:
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server.bind((host, port))
+            self.server.listen(socket.SOMAXCONN)
+            self.port = self.server.getsockname()[1]
+            log.info(f"🎮 Pong Server started on {host}:{self.port} (up to {max_rooms} rooms)")
+
+        # Optional UDP transport on the same port number
+        self.udp = None
+        self.udp_sessions = {}  # token -> connection
+        if udp:
+            self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp.bind((host, self.port))
+            log.info(f"📶 UDP transport enabled on {host}:{self.port}")
+        self.record_dir = record_dir
+        if record_dir is not None:
+            os.makedirs(record_dir, exist_ok=True)
+            log.info(f"⏺️  Recording every match to {record_dir}/")
+
+        self.rules = rules  # Every room plays the same MatchConfig
+        if rules != CLASSIC:
+            log.info(f"📐 Match rules: {rules}")
+
+        self.rooms = {}  # room_id -> GameRoom
+        self.max_rooms = max_rooms
+        self.next_room_id = 1
+        self.seeds = random.Random(seed)  # Deals each new room its match seed
+        self.rewind_window = rewind_window  # Lag compensation, see MatchSimulation
+        self.sessions = SessionTable(resume_grace)
+        self.bot_after = bot_after
+        self.bot_difficulty = bot_difficulty
+        self.bot_reaction = bot_reaction
+        self.bots_made = 0  # Numbers each bot's RNG seed
+        self.lock = threading.Lock()  # Guards self.rooms and room seating
+        self.running = True
+        self.stats = stats
+        self.clock = TickScheduler(tick_rate, send_rate)
+        self.next_stats = time.monotonic() + self.STATS_INTERVAL
+
+        self.metrics = MetricsRegistry()
+        self.tick_seconds = self.metrics.histogram(
+            'pong_tick_seconds', "Wall time of one physics step across all rooms")
+        self.serialize_seconds = self.metrics.histogram(
+            'pong_broadcast_serialize_seconds', "Time building one send's snapshots across all rooms")
+        self.send_seconds = self.metrics.histogram(
+            'pong_broadcast_send_seconds', "Time writing one send's snapshots to the players' sockets")
+        self.publish_seconds = self.metrics.histogram(
+            'pong_spectator_publish_seconds', "Time encoding and writing one send's snapshots to spectators")
+        self.metrics.collector(self.collect_metrics)
+        self.metrics.collector(process_metrics)
+        self.serialize_time = self.send_time = self.publish_time = 0.0  # This send so far
+        if metrics_port is not None:
+            serve_metrics(self.metrics, port=metrics_port)
+            log.info(f"📈 Metrics at http://127.0.0.1:{metrics_port}/metrics")
+        if bot_matches:
+            self.open_bot_matches(bot_matches)
+        if self.server is not None:
+            log.info(f"⏳ Waiting for players to connect...")
+
+    def join_room(self, conn, against_bot=False):
+        """Matchmake a connection into an open room, creating one if needed.
+
+        With `against_bot` it gets a new room with bots in the other seats.
+        Returns (room, player_id), or (None, None) when the server is full.
+        """
+        with self.lock:
+            if not against_bot:
+                for room in self.rooms.values():
+                    if not room.is_full():
+                        return room, room.add_player(conn)
+
+            room = self.open_room()
+            if room is None:
+                return None, None
+            player_id = room.add_player(conn)
+            if against_bot:
+                while not room.is_full():
+                    room.add_player(self.make_bot(room))
+            return room, player_id
+
+    def open_room(self):
+        """A new empty room, or None if max_rooms are open (under the lock)"""
+        if len(self.rooms) >= self.max_rooms:
+            return None
+        room = GameRoom(self.next_room_id, self.clock.tick_rate, seed=self.seeds.getrandbits(32),
+                        rewind_window=self.rewind_window, rules=self.rules)
+        self.next_room_id += self.room_id_step
+        self.rooms[room.room_id] = room
+        return room
+
+    def make_bot(self, room):
+        self.bots_made += 1
+        return BotPlayer(room.sim, self.bot_difficulty, self.bot_reaction,
+                         seed=f"{room.game_state['seed']}:{self.bots_made}")
+
+    def open_bot_matches(self, count):
+        """Rooms with a bot in every seat, as many as fit"""
+        with self.lock:
+            for _ in range(count):
+                room = self.open_room()
+                if room is None:
+                    break
+                while not room.is_full():
+                    room.add_player(self.make_bot(room))
+        log.info(f"🤖 {self.bots_made // self.rules.players} bot matches playing")
+
+    def seat_bots(self, rooms):
+        """Fill the free seats with bots once the seated players have waited bot_after seconds"""
+        wait = self.bot_after * self.clock.tick_rate
+        for room in rooms:
+            if room.alone_since is None or room.game_state['tick'] - room.alone_since < wait:
+                continue
+            with self.lock:
+                if room.is_full() or room.is_empty():
+                    continue  # Paired or gone since the last tick
+                seats = []
+                while not room.is_full():
+                    seats.append(room.add_player(self.make_bot(room)) + 1)
+            room.alone_since = None
+            taken = "a bot takes seat" if len(seats) == 1 else "bots take seats"
+            room.log(f"🤖 Nobody came, so {taken} {', '.join(map(str, seats))}")
+
+    def leave_room(self, room, player_id):
+        """Free a player's slot; the scheduler closes the room once nobody is left"""
+        with self.lock:
+            room.remove_player(player_id)
+
+    def seat_player(self, conn):
+        """Give a player back the seat its RESUME names, or matchmake it into a new one.
+
+        Returns (room, player_id, resumed); room is None when the server is full.
+        """
+        if conn.resume is not None:
+            room, player_id = self.resume_session(conn)
+            if room is not None:
+                return room, player_id, True
+            log.info(f"🔁 No session to resume for {conn.addr}, matchmaking it afresh")
+
+        room, player_id = self.join_room(conn, conn.against_bot)
+        if room is not None and conn.binary and self.sessions.grace:
+            with self.lock:
+                conn.session = self.sessions.open(room, player_id, conn)
+        return room, player_id, False
+
+    def resume_session(self, conn):
+        """Seat `conn` where its session's player sat; (None, None) if the session is gone.
+
+        A connection still seated for the session, one whose drop the server
+        hasn't noticed yet, is replaced and shut down.
+        """
+        with self.lock:
+            session = self.sessions.get(conn.resume)
+            if session is None:
+                return None, None
+            room, player_id, previous = session.room, session.player_id, session.conn
+            self.sessions.resume(session, conn)
+            conn.session = session
+            room.set_seat(player_id, conn)
+        if not previous.gone:
+            previous.drop()
+        return room, player_id
+
+    def drop_player(self, conn):
+        """A player's connection ended: hold its seat for a resume if it has a session, else free it"""
+        room, player_id, session = conn.room, conn.player_id, conn.session
+        with self.lock:
+            if room.players[player_id] is not conn:
+                return  # Its session resumed on a newer connection
+            held = session is not None and room.is_full()
+            if held:
+                conn.gone = True
+                self.sessions.suspend(session, time.monotonic())
+                room.suspend_player(player_id)
+            else:
+                if session is not None:
+                    self.sessions.close(session)
+                room.remove_player(player_id)
+        if held:
+            room.log(f"📴 Player {player_id + 1} dropped, holding the seat {self.sessions.grace:g}s for a resume")
+        else:
+            room.log(f"❌ Player {player_id + 1} disconnected")
+
+    def expire_sessions(self, now):
+        """Give up the seats of dropped players whose grace period ran out"""
+        if not self.sessions.suspended:
+            return
+        with self.lock:
+            expired = self.sessions.expire(now)
+            for session in expired:
+                session.room.remove_player(session.player_id)
+        for session in expired:
+            session.room.log(f"⌛ Player {session.player_id + 1} didn't resume in time, seat freed")
+
+    def close_empty_rooms(self, rooms):
+        """Drop rooms everyone has left, unless someone was seated again meanwhile"""
+        for room in rooms:
+            if not room.is_empty():
+                continue
+            with self.lock:
+                if not room.is_empty():
+                    continue
+                self.rooms.pop(room.room_id, None)
+            room.close()
+            room.log("🧹 Room closed")
+
+    def room_to_watch(self, room_id):
+        """The room a spectator asked for; for room id 0, the first match in play"""
+        with self.lock:
+            if room_id:
+                return self.rooms.get(room_id)
+            for room in self.rooms.values():
+                if room.is_full():
+                    return room
+            return next(iter(self.rooms.values()), None)
+
+    def add_spectator(self, room, viewer):
+        """Start feeding a spectator whose WELCOME went out; False if the room closed meanwhile"""
+        with self.lock:
+            if self.rooms.get(room.room_id) is not room:
+                return False
+            room.spectators.add(viewer)
+        room.log(f"👀 Spectator joined ({len(room.spectators)} watching)")
+        return True
+
+    def negotiate(self, conn):
+        """Wait briefly for a binary HELLO; clients that stay silent are legacy pickle clients"""
+        conn.sock.settimeout(self.HELLO_TIMEOUT)
+        try:
+            payload = recv_frame(conn.sock)
+        except socket.timeout:
+            payload = None
+        finally:
+            conn.sock.settimeout(None)
+
+        if payload is None:
             return True
-        elif p2_score >= win_score:
-            self.game_state['winner'] = 1
-            self.game_state['status'] = 'game_over'
-            print(f"🏆 Player 2 WINS! Final score: {p1_score} - {p2_score}")
+        return self.accept_hello(conn, payload)
+
+    def accept_hello(self, conn, payload):
+        """Switch a connection to the binary protocol (and maybe UDP) if its HELLO is valid.
+
+        A SPECTATE instead makes the connection a spectator of the room it names.
+        """
+        spectate = decode_spectate(payload)
+        if spectate is not None and spectate[0] == PROTOCOL_VERSION:
+            conn.binary = True
+            conn.spectate = spectate[1]
             return True
-        
-        return False
 
-    def update_game(self):
+        hello = decode_hello(payload)
+        resume = decode_resume(payload)
+        if resume is not None:
+            hello, conn.resume = resume[:2], resume[2]
+        if hello is None or hello[0] != PROTOCOL_VERSION:
+            log.warning(f"🚫 {conn.addr} sent an unsupported hello {hello}")
+            return False
+        conn.binary = True
+        conn.encoder = SnapshotEncoder(snapshot_layout(self.rules))  # Fresh, so a resumed player starts from a keyframe
+        conn.against_bot = bool(hello[1] & HELLO_BOT)
+        if hello[1] & HELLO_UDP and self.udp is not None:
+            with self.lock:
+                token = secrets.randbits(32)  # A guessed token would redirect this player's snapshots
+                while token in self.udp_sessions:
+                    token = secrets.randbits(32)
+                conn.udp_token = token
+                self.udp_sessions[token] = conn
+        return True
+
+    def forget_udp(self, conn):
+        if conn.udp_token is not None:
+            with self.lock:
+                self.udp_sessions.pop(conn.udp_token, None)
+
+    def handle_datagram(self, data, addr):
+        """An INPUTS datagram: the token prefix says which connection it belongs to"""
+        if len(data) < DATAGRAM_TOKEN.size:
+            return
+        (token,) = DATAGRAM_TOKEN.unpack_from(data)
+        conn = self.udp_sessions.get(token)
+        if conn is None or conn.room is None:
+            return
+        conn.udp_addr = addr
+        conn.traffic.count_in(len(data))
+        try:
+            self.handle_message(conn, conn.room, conn.player_id, memoryview(data)[DATAGRAM_TOKEN.size:])
+        except Exception as e:
+            conn.room.log(f"❗ Bad datagram from player {conn.player_id + 1}: {e}", logging.WARNING)
+
+    def send_datagram(self, conn, payload):
+        try:
+            self.udp.sendto(payload, socket.MSG_DONTWAIT, conn.udp_addr)
+            conn.traffic.count_out(len(payload))
+        except OSError:
+            pass  # Full socket buffer: this snapshot is lost like any other datagram
+
+    def run_udp(self):
+        buffer = bytearray(2048)
+        view = memoryview(buffer)
         while self.running:
-            if len(self.clients) == 2 and self.game_state['status'] == 'playing':
-                ball = self.game_state['ball']
-                multiplier = self.game_state['ball_speed_multiplier']
-
-                # Update ball position
-                ball['x'] += ball['dx'] * multiplier
-                ball['y'] += ball['dy'] * multiplier
-
-                # Ball collision with top/bottom
-                if ball['y'] <= ball['radius'] or ball['y'] >= self.game_state['height'] - ball['radius']:
-                    ball['dy'] *= -1
-                    ball['y'] = max(ball['radius'], min(ball['y'], self.game_state['height'] - ball['radius']))
-
-                # Ball collision with paddles
-                p1 = self.game_state['paddle1']
-                p2 = self.game_state['paddle2']
-                pw = self.game_state['paddle_width']
-                ph = self.game_state['paddle_height']
-
-                # Left paddle collision (Player 1)
-                if (ball['x'] - ball['radius'] <= 10 + pw and
-                    ball['dx'] < 0 and
-                    p1['y'] <= ball['y'] <= p1['y'] + ph):
-                    ball['dx'] = abs(ball['dx'])
-                    ball['x'] = 10 + pw + ball['radius']
-                    
-                    # INCREASE SPEED ON HIT
-                    self.game_state['ball_speed_multiplier'] += self.SPEED_INCREASE_PER_HIT
-                    print(f"⚡ Speed increased to x{self.game_state['ball_speed_multiplier']:.2f}")
-                    
-                    # Add spin
-                    hit_pos = (ball['y'] - p1['y']) / ph
-                    ball['dy'] += (hit_pos - 0.5) * 3
-
-                # Right paddle collision (Player 2)
-                if (ball['x'] + ball['radius'] >= self.game_state['width'] - 10 - pw and
-                    ball['dx'] > 0 and
-                    p2['y'] <= ball['y'] <= p2['y'] + ph):
-                    ball['dx'] = -abs(ball['dx'])
-                    ball['x'] = self.game_state['width'] - 10 - pw - ball['radius']
-                    
-                    # INCREASE SPEED ON HIT
-                    self.game_state['ball_speed_multiplier'] += self.SPEED_INCREASE_PER_HIT
-                    print(f"⚡ Speed increased to x{self.game_state['ball_speed_multiplier']:.2f}")
-                    
-                    # Add spin
-                    hit_pos = (ball['y'] - p2['y']) / ph
-                    ball['dy'] += (hit_pos - 0.5) * 3
-
-                # Cap base ball speed
-                max_base_speed = 15
-                if abs(ball['dx']) > max_base_speed:
-                    ball['dx'] = max_base_speed if ball['dx'] > 0 else -max_base_speed
-                if abs(ball['dy']) > max_base_speed:
-                    ball['dy'] = max_base_speed if ball['dy'] > 0 else -max_base_speed
-
-                # Scoring
-                if ball['x'] <= 0:
-                    p2['score'] += 1
-                    print(f"🎯 Player 2 scores! Score: {p1['score']} - {p2['score']}")
-                    
-                    # Check winner
-                    if not self.check_winner():
-                        # RESET SPEED AFTER SCORE
-                        self.game_state['ball_speed_multiplier'] = 1.0
-                        print(f"🔄 Speed reset to x1.0")
-                        self.reset_ball()
-                        
-                elif ball['x'] >= self.game_state['width']:
-                    p1['score'] += 1
-                    print(f"🎯 Player 1 scores! Score: {p1['score']} - {p2['score']}")
-                    
-                    # Check winner
-                    if not self.check_winner():
-                        # RESET SPEED AFTER SCORE
-                        self.game_state['ball_speed_multiplier'] = 1.0
-                        print(f"🔄 Speed reset to x1.0")
-                        self.reset_ball()
-
-            time.sleep(0.016)  # ~60 FPS
-
-    def reset_ball(self):
-        """Reset ball to center"""
-        ball = self.game_state['ball']
-        ball['x'] = 400
-        ball['y'] = 300
-        
-        # Random direction
-        direction = random.choice([-1, 1])
-        ball['dx'] = self.BASE_SPEED * direction
-        ball['dy'] = random.uniform(-3, 3)
+            try:
+                size, addr = self.udp.recvfrom_into(buffer)
+            except OSError:
+                break
+            self.handle_datagram(view[:size], addr)
+
+    def handle_client(self, conn):
+        if not self.negotiate(conn):
+            conn.sock.close()
+            return
+        if conn.spectate is not None:
+            self.watch(conn)
+            return
+
+        room, player_id, resumed = self.seat_player(conn)
+        if room is None:
+            log.warning(f"🚫 Server full ({self.max_rooms} rooms), rejecting {conn.addr}")
+            conn.sock.close()
+            return
+
+        conn.room, conn.player_id = room, player_id
+        self.log_seated(conn, resumed)
+        try:
+            conn.sock.sendall(self.welcome(conn))
+            conn.welcomed = True
+        except OSError:
+            pass  # Gone before the handshake finished: free the seat below
+
+        # Whatever the player sent since the last read is handled in one go, straight from the buffer
+        frames = FrameBuffer()
+        while self.running and conn.welcomed:
+            try:
+                received = frames.recv_into(conn.sock)
+                if not received:
+                    break
+
+                conn.traffic.count_in(received)
+                for payload in frames.pop_frames():
+                    self.handle_message(conn, room, player_id, payload)
+
+            except ConnectionError:
+                break  # Reset by the client: just another way of leaving
+            except Exception as e:
+                log.exception(f"[Room {room.room_id}] ❗ Error handling client {player_id + 1}: {e}")
+                break
+
+        conn.sock.close()
+        self.forget_udp(conn)
+        self.drop_player(conn)
+
+    def watch(self, conn):
+        """Serve a spectator. The scheduler writes its snapshots; this thread only waits for it to go."""
+        room = self.room_to_watch(conn.spectate)
+        if room is None:
+            log.warning(f"🚫 No room {conn.spectate or 'in play'} to watch for {conn.addr}")
+            conn.sock.close()
+            return
+
+        conn.sock.sendall(room.welcome_message(SPECTATOR_ID, True))
+        viewer = SocketViewer(conn.sock)
+        if self.add_spectator(room, viewer):
+            try:
+                while conn.sock.recv(4096):
+                    pass  # Spectators send nothing; this returns once they leave or are dropped
+            except OSError:
+                pass
+            room.spectators.remove(viewer)
+            room.log(f"👋 Spectator left ({len(room.spectators)} watching)")
+        conn.sock.close()
+
+    def log_seated(self, conn, resumed):
+        if resumed:
+            conn.room.log(f"🔁 Player {conn.player_id + 1} resumed ({self.describe_transport(conn)})")
+        else:
+            conn.room.log(f"✅ Player {conn.player_id + 1} connected ({self.describe_transport(conn)})")
+            if conn.against_bot:
+                conn.room.log("🤖 A bot takes the other seat" if len(conn.room.players) == 2
+                              else "🤖 Bots take the other seats")
+            elif conn.room.is_full():
+                conn.room.log(f"✨ {conn.room.everyone()} connected!")
+
+    def welcome(self, conn):
+        session_token = conn.session.token if conn.session is not None else None
+        return conn.room.welcome_message(conn.player_id, conn.binary, conn.udp_token, session_token)
+
+    def describe_transport(self, conn):
+        if not conn.binary:
+            return 'legacy pickle'
+        return 'binary, UDP' if conn.udp_token is not None else 'binary'
+
+    def handle_message(self, conn, room, player_id, payload):
+        """Decode one player message, note its snapshot ack and apply it to the room"""
+        if conn.binary:
+            msg_type = message_type(payload)
+            if msg_type == MSG_PING:
+                # Answered by the scheduler, the only thread that writes snapshots to this socket
+                conn.pong = (decode_ping(payload), time.monotonic())
+                return
+            if msg_type == MSG_PONG:
+                conn.clock.pong(*decode_pong(payload), time.monotonic())
+                return
+        conn.inputs += 1
+        conn.slot.put(decode_client_message(payload, conn.binary))
+
+    def clock_messages(self, conn, now):
+        """Framed PONG for the player's latest PING, plus a PING of our own when one is due"""
+        msg = b''
+        if conn.pong is not None:
+            ping_time, received = conn.pong
+            conn.pong = None
+            msg += pack_frame(encode_pong(ping_time, received, now))
+        if conn.clock.ping_due(now):
+            msg += pack_frame(encode_ping(now))
+        return msg
+
+    def broadcast(self, room):
+        """Send a room's latest snapshot to its players and to its spectators"""
+        players = room.seated  # Whoever the snapshot was simulated for
+        if None in players and not room.spectators:
+            return
+
+        start = time.perf_counter()
+        seq, values, _ = room.snapshot
+        if room.spectators:
+            room.spectators.publish(seq, values)
+            published = time.perf_counter()
+            self.publish_time += published - start
+            start = published
+        if None in players:
+            return
+
+        events = room.layout.event_values(values)
+        events_changed = events != room.last_events
+        room.last_events = events
+
+        # Encode everything first, then write, so the two are timed apart
+        outgoing = []  # (conn, message, over UDP)
+        legacy_msg = None
+        now = time.monotonic()
+        for conn in players:
+            if conn.gone or conn.bot:
+                continue  # Dropped (a resume starts it over from a keyframe), or played right here
+            if not conn.binary:
+                if legacy_msg is None:
+                    legacy_msg = room.legacy_snapshot_message()
+                outgoing.append((conn, legacy_msg, False))
+                continue
+            if conn.slot.ack is not None:
+                conn.encoder.acknowledge(conn.slot.ack)
+            if conn.udp_addr is not None:
+                # Delta against whatever this client last acknowledged
+                outgoing.append((conn, conn.encoder.encode(seq, values), True))
+                msg = self.clock_messages(conn, now)
+                if events_changed:
+                    # Scores and status changes also go over the reliable channel
+                    msg = pack_frame(room.layout.encode_keyframe(seq, values)) + msg
+                if not msg:
+                    continue
+            else:
+                msg = pack_frame(conn.encoder.encode(seq, values)) + self.clock_messages(conn, now)
+            outgoing.append((conn, msg, False))
+        encoded = time.perf_counter()
+
+        for conn, msg, datagram in outgoing:
+            if datagram:
+                self.send_datagram(conn, msg)
+                continue
+            try:
+                conn.send_snapshot(msg)
+            except OSError:
+                pass  # The client's own thread notices the dead socket and frees the slot
+            except Exception as e:
+                log.exception(f"[Room {room.room_id}] ❗ Error sending to player {conn.player_id + 1}: {e}")
+        self.serialize_time += encoded - start
+        self.send_time += time.perf_counter() - encoded
+
+    def report_stats(self):
+        """Log scheduler health and per-client bandwidth for every room"""
+        clock = self.clock
+        log.info(f"⏱️  Tick {clock.tick} @ {clock.tick_rate} Hz, send {clock.send_rate} Hz: "
+              f"step {clock.step_duration * 1000:.2f} ms (max {clock.max_step_duration * 1000:.2f} ms), "
+              f"{clock.overruns} overruns, {clock.dropped_ticks} dropped ticks")
+
+        total_in = total_out = 0
+        for room in list(self.rooms.values()):
+            for player_id, conn in enumerate(room.players):
+                if conn is None or conn.bot:
+                    continue
+                in_rate, out_rate = conn.traffic.rates()
+                total_in += in_rate
+                total_out += out_rate
+                if conn.encoder is not None:
+                    detail = f"{conn.encoder.deltas} deltas / {conn.encoder.keyframes} keyframes"
+                else:
+                    detail = "legacy pickle"
+                if conn.dropped:
+                    detail += f", {conn.dropped} dropped on a full socket"
+                room.log(f"📊 Player {player_id + 1}: in {in_rate:.0f} B/s, out {out_rate:.0f} B/s ({detail})")
+            feed = room.spectators
+            if feed:
+                _, out_rate = feed.traffic.rates()
+                total_out += out_rate
+                room.log(f"👀 {len(feed)} spectators: out {out_rate:.0f} B/s "
+                         f"({feed.throttled} snapshots throttled, {feed.dropped} slow viewers dropped)")
+        log.info(f"📊 Total: in {total_in:.0f} B/s, out {total_out:.0f} B/s")
+
+    def collect_metrics(self):
+        """Metric families read from the scheduler, rooms and connections at scrape time"""
+        clock = self.clock
+        rooms = list(self.rooms.values())
+        received, sent, inputs, rtts, offsets, spectator_sent = [], [], [], [], [], []
+        playing = spectators = bots = 0
+        for room in rooms:
+            snapshot = room.snapshot  # Read once: the scheduler may publish the next one meanwhile
+            playing += snapshot is not None and snapshot.status == 'playing'
+            spectators += len(room.spectators)
+            if room.spectators:
+                spectator_sent.append(('pong_spectator_sent_bytes_total', {'room': room.room_id},
+                                       room.spectators.traffic.bytes_out))
+            for player_id, conn in enumerate(room.players):
+                if conn is None or conn.bot:
+                    bots += conn is not None
+                    continue
+                labels = {'room': room.room_id, 'player': player_id + 1}
+                received.append(('pong_client_received_bytes_total', labels, conn.traffic.bytes_in))
+                sent.append(('pong_client_sent_bytes_total', labels, conn.traffic.bytes_out))
+                inputs.append(('pong_client_input_messages_total', labels, conn.inputs))
+                if conn.clock.rtt is not None:
+                    rtts.append(('pong_client_rtt_seconds', labels, conn.clock.rtt))
+                    offsets.append(('pong_client_clock_offset_seconds', labels, conn.clock.offset))
+
+        def single(name, kind, help, value):
+            return (name, kind, help, [(name, None, value)])
+
+        return [
+            single('pong_ticks_total', 'counter', "Physics steps taken", clock.tick),
+            single('pong_tick_overruns_total', 'counter',
+                   "Scheduler iterations that needed several steps to catch up", clock.overruns),
+            single('pong_dropped_ticks_total', 'counter',
+                   "Steps given up because the backlog was too long", clock.dropped_ticks),
+            single('pong_tick_lateness_seconds', 'gauge',
+                   "How long after its due time the latest step ran", clock.lateness),
+            single('pong_rooms', 'gauge', "Open rooms", len(rooms)),
+            single('pong_matches_playing', 'gauge', "Rooms with a rally in progress", playing),
+            single('pong_spectators', 'gauge', "Connected spectators", spectators),
+            single('pong_bots', 'gauge', "Seats played by server bots", bots),
+            single('pong_sessions', 'gauge', "Players who can resume their seat", len(self.sessions)),
+            single('pong_sessions_suspended', 'gauge', "Dropped players whose seat is held for a resume",
+                   len(self.sessions.suspended)),
+            ('pong_client_received_bytes_total', 'counter', "Bytes received from each player", received),
+            ('pong_client_sent_bytes_total', 'counter', "Bytes sent to each player", sent),
+            ('pong_client_input_messages_total', 'counter', "Messages received from each player", inputs),
+            ('pong_client_rtt_seconds', 'gauge', "Smoothed PING round trip to each player", rtts),
+            ('pong_client_clock_offset_seconds', 'gauge', "Each player's clock minus the server's", offsets),
+            ('pong_spectator_sent_bytes_total', 'counter', "Bytes sent to each room's spectators", spectator_sent),
+        ]
+
+    def tick_rooms(self, now):
+        """Run the physics steps that are due, then publish one snapshot per room if a send is due.
+
+        Returns how long to sleep before calling again.
+        """
+        steps, send = self.clock.advance(now)
+        rooms = list(self.rooms.values())
+
+        for _ in range(steps):
+            start = time.perf_counter()
+            for room in rooms:
+                room.update()
+                if self.record_dir is not None and room.is_full():
+                    self.record(room)
+            duration = time.perf_counter() - start
+            self.clock.record_step(duration)
+            self.tick_seconds.observe(duration)
+        if steps:
+            self.expire_sessions(now)
+            if self.bot_after is not None:
+                self.seat_bots(rooms)
+            self.close_empty_rooms(rooms)
+
+        if send:
+            for room in rooms:
+                room.publish()
+                self.broadcast(room)
+            self.serialize_seconds.observe(self.serialize_time)
+            self.send_seconds.observe(self.send_time)
+            if self.publish_time:
+                self.publish_seconds.observe(self.publish_time)
+            self.serialize_time = self.send_time = self.publish_time = 0.0
+
+        if self.stats and now >= self.next_stats:
+            self.next_stats += self.STATS_INTERVAL
+            self.report_stats()
 
-    def broadcast_game_state(self):
+        return self.clock.time_until_next(time.monotonic())
+
+    def record(self, room):
+        """Append this tick to the room's recording, starting one for a new pairing"""
+        if room.recorder is None:
+            path = os.path.join(self.record_dir, f"room{room.room_id}-{int(time.time() * 1000)}.pongrec")
+            room.recorder = Recorder(path, room.room_id, room.rules, room.tick_rate, room.game_state)
+            room.log(f"⏺️  Recording to {path}")
+        room.recorder.record(room.game_state)
+
+    def finish_recordings(self):
+        """Close every recording and wait for its file to be complete (on shutdown)"""
+        for room in list(self.rooms.values()):
+            if room.recorder is not None:
+                room.recorder.close()  # Let the writer finish the file with its index
+                room.recorder.writer.join()
+
+    def run_scheduler(self):
+        """Single loop that drives all rooms at a fixed rate"""
         while self.running:
-            if len(self.clients) == 2:
-                if not self.game_started:
-                    self.game_started = True
-                    # Both players connected, go to waiting ready
-                    self.game_state['status'] = 'waiting_ready'
-                    print("👥 Both players connected! Press READY to start (First to 5)...")
-
-                data = pickle.dumps(self.game_state)
-                msg = struct.pack('!I', len(data)) + data  # Length prefix + data
-                
-                for client in self.clients[:]:
-                    try:
-                        client.sendall(msg)  # Use sendall to ensure complete send
-                    except:
-                        if client in self.clients:
-                            self.clients.remove(client)
-
-            time.sleep(0.016)  # ~60 FPS
+            time.sleep(self.tick_rooms(time.monotonic()))
 
     def start(self):
-        threading.Thread(target=self.update_game, daemon=True).start()
-        threading.Thread(target=self.broadcast_game_state, daemon=True).start()
+        threading.Thread(target=self.run_scheduler, daemon=True).start()
+        if self.udp is not None:
+            threading.Thread(target=self.run_udp, daemon=True).start()
 
         while self.running:
-            if len(self.clients) < 2:
-                conn, addr = self.server.accept()
-                print(f"📡 Connection from {addr}")
-                
-                player_id = len(self.clients)
-                self.clients.append(conn)
-                
-                threading.Thread(
-                    target=self.handle_client,
-                    args=(conn, player_id),
-                    daemon=True
-                ).start()
-                
-                if len(self.clients) == 2:
-                    print("✨ Both players connected!")
-            else:
-                time.sleep(0.1)
+            conn, addr = self.server.accept()
+            log.info(f"📡 Connection from {addr}")
+            set_nodelay(conn)
+
+            threading.Thread(
+                target=self.handle_client,
+                args=(PlayerConnection(conn, addr),),
+                daemon=True
+            ).start()
         
-        print("\n⏹️  Shutting down server...")
+        log.info("⏹️  Shutting down server...")
         self.server.close()
     
+class AsyncClientProtocol(asyncio.Protocol):
+    """One player connection on the asyncio server.
+
+    Snapshots are written without blocking. While the socket can't keep up, only
+    the newest snapshot is held back and older ones are dropped, so one stalled
+    client never delays the scheduler or the other players.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.addr = None
+        self.room = None
+        self.player_id = None
+        self.binary = False
+        self.encoder = None
+        self.traffic = TrafficCounter()
+        self.udp_token = None
+        self.udp_addr = None
+        self.hello_timer = None
+        self.frames = FrameBuffer()
+        self.paused = False
+        self.pending = None  # Newest snapshot waiting for the socket to drain
+        self.dropped = 0
+        self.spectate = None  # Room id from a SPECTATE handshake; None for players
+        self.resume = None
+        self.session = None
+        self.gone = False
+        self.against_bot = False
+        self.bot = False
+        self.viewer = None  # TransportViewer once watching
+        self.watching = None  # Room a spectator watches
+        self.inputs = 0
+        self.slot = InputSlot()
+        self.clock = ClockSync()
+        self.pong = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.addr = transport.get_extra_info('peername')
+        log.info(f"📡 Connection from {self.addr}")
+
+        # Keep the kernel-side backlog to a handful of snapshots
+        transport.set_write_buffer_limits(high=self.server.WRITE_BUFFER_HIGH)
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            set_nodelay(sock)  # asyncio only does this for sockets created with IPPROTO_TCP
+        # Clients that don't say HELLO in time are legacy pickle clients
+        loop = asyncio.get_running_loop()
+        self.hello_timer = loop.call_later(self.server.HELLO_TIMEOUT, self.join)
+
+    def join(self):
+        """Finish the handshake: take a room seat and send the welcome"""
+        self.hello_timer = None
+        if self.spectate is not None:
+            self.watch()
+            return
+        self.room, self.player_id, resumed = self.server.seat_player(self)
+        if self.room is None:
+            log.warning(f"🚫 Server full ({self.server.max_rooms} rooms), rejecting {self.addr}")
+            self.transport.close()
+            return
+
+        self.server.log_seated(self, resumed)
+        self.transport.write(self.server.welcome(self))
+
+    def watch(self):
+        """Finish a spectator's handshake; the room's feed writes to it from then on"""
+        room = self.server.room_to_watch(self.spectate)
+        if room is None:
+            log.warning(f"🚫 No room {self.spectate or 'in play'} to watch for {self.addr}")
+            self.transport.close()
+            return
+        self.transport.write(room.welcome_message(SPECTATOR_ID, True))
+        self.viewer = TransportViewer(self.transport)
+        if self.server.add_spectator(room, self.viewer):
+            self.watching = room
+        else:
+            self.transport.close()
+
+    def data_received(self, data):
+        self.traffic.count_in(len(data))
+        self.frames.feed(data)
+        try:
+            for payload in self.frames.pop_frames():
+                if self.hello_timer is not None:
+                    self.hello_timer.cancel()
+                    if not self.server.accept_hello(self, payload):
+                        self.transport.close()
+                        return
+                    self.join()
+                elif self.room is not None:
+                    self.server.handle_message(self, self.room, self.player_id, payload)
+        except Exception as e:
+            log.exception(f"❗ Error handling client {self.addr}: {e}")
+            self.transport.close()
+
+    def send_snapshot(self, msg):
+        if self.transport.is_closing():
+            return
+        if self.paused:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = msg
+        else:
+            self.transport.write(msg)
+            self.traffic.count_out(len(msg))
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        if self.pending is not None:
+            msg, self.pending = self.pending, None
+            self.send_snapshot(msg)
+
+    def connection_lost(self, exc):
+        if self.hello_timer is not None:
+            self.hello_timer.cancel()
+        if self.watching is not None:
+            self.watching.spectators.remove(self.viewer)
+            self.watching.log(f"👋 Spectator left ({len(self.watching.spectators)} watching)")
+            return
+        self.server.forget_udp(self)
+        if self.room is None:
+            return
+        self.server.drop_player(self)
+
+    def drop(self):
+        self.transport.abort()
+
+
+class AsyncUdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.handle_datagram(data, addr)
+
+
+class AsyncPongServer(PongServer):
+    """PongServer on a single asyncio event loop instead of a thread per client"""
+
+    WRITE_BUFFER_HIGH = 4096  # Bytes queued per client before snapshots start being dropped
+
+    udp_transport = None
+
+    def send_datagram(self, conn, payload):
+        self.udp_transport.sendto(payload, conn.udp_addr)
+        conn.traffic.count_out(len(payload))
+
+    async def run_scheduler_async(self):
+        while self.running:
+            await asyncio.sleep(self.tick_rooms(time.monotonic()))
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        self.server.setblocking(False)
+        listener = await loop.create_server(lambda: AsyncClientProtocol(self), sock=self.server)
+        if self.udp is not None:
+            self.udp.setblocking(False)
+            self.udp_transport, _ = await loop.create_datagram_endpoint(
+                lambda: AsyncUdpProtocol(self), sock=self.udp)
+        async with listener:
+            await self.run_scheduler_async()
+        log.info("⏹️  Shutting down server...")
+
+    def start(self):
+        asyncio.run(self.serve())
+
+
 if __name__ == "__main__":
-    server = PongServer()
+    parser = argparse.ArgumentParser(description="Pong match server")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--max-rooms', type=int, default=500)
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="serve every connection from one asyncio event loop")
+    parser.add_argument('--stats', action='store_true',
+                        help=f"print tick timing and per-client bandwidth every {PongServer.STATS_INTERVAL}s")
+    parser.add_argument('--tick-rate', type=int, default=60, help="physics steps per second")
+    parser.add_argument('--send-rate', type=int, default=60, help="snapshots per second")
+    parser.add_argument('--udp', action='store_true',
+                        help="also offer snapshots and inputs over UDP on the same port")
+    parser.add_argument('--record', metavar='DIR',
+                        help="write a replay file of every match to DIR (see pong_replay.py)")
+    parser.add_argument('--seed', type=int,
+                        help="seed for the match seeds, to make a session's serves reproducible")
+    parser.add_argument('--rewind-window', type=float, default=0.25, metavar='SECONDS',
+                        help="lag compensation: how late a paddle input may still reach the ball (0: off)")
+    parser.add_argument('--resume-grace', type=float, default=10.0, metavar='SECONDS',
+                        help="how long a dropped player's seat is held for it to reconnect (0: not at all)")
+    parser.add_argument('--bot-after', type=float, metavar='SECONDS',
+                        help="give a player who waited this long alone a bot opponent (default: never)")
+    parser.add_argument('--bot-difficulty', type=float, default=0.7, help="server bots' aim and speed, 0 to 1")
+    parser.add_argument('--bot-reaction', type=float, default=0.15, metavar='SECONDS',
+                        help="how long server bots take to react to the ball changing course")
+    parser.add_argument('--bot-matches', type=int, default=0, metavar='N',
+                        help="open N matches of two bots, as a steady load")
+    parser.add_argument('--rules', default='classic', metavar='PRESET|FILE',
+                        help="match rules: classic, multiball, doubles, marathon or a JSON file of settings")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="DEBUG adds a line per paddle hit")
+    parser.add_argument('--log-rate', type=float, default=0, metavar='LINES',
+                        help="cap INFO and DEBUG lines per second (default: no cap)")
+    args = parser.parse_args()
+    try:
+        rules = load_rules(args.rules)
+    except ValueError as e:
+        parser.error(str(e))
+
+    log_limiter = configure_logging(args.log_level, args.log_rate)
+
+    server_class = AsyncPongServer if args.use_async else PongServer
+    server = server_class(args.host, args.port, args.max_rooms, stats=args.stats,
+                          tick_rate=args.tick_rate, send_rate=args.send_rate, udp=args.udp,
+                          record_dir=args.record, seed=args.seed, metrics_port=args.metrics_port,
+                          rewind_window=args.rewind_window, resume_grace=args.resume_grace,
+                          bot_after=args.bot_after, bot_difficulty=args.bot_difficulty,
+                          bot_reaction=args.bot_reaction, bot_matches=args.bot_matches, rules=rules)
+    server.metrics.collector(log_limiter.collect)
     try:
         server.start()
     except KeyboardInterrupt:
-        print("\n⏹️  Server stopped by user")
-        server.running = False
\ No newline at end of file
+        log.info("⏹️  Server stopped by user")
+        server.running = False
+        server.finish_recordings()
@@ -0,0 +1,459 @@
+"""Sharded deployment: a front door that hands connections to one match process per core.
+
+One process can only use one core for its rooms, however it serves them. Here
+the front door accepts every connection on the public port, waits for its first
+frame, and passes the socket itself (SCM_RIGHTS over a Unix socket) to one of
+N worker processes. Each worker is an AsyncPongServer with its own rooms and
+tick loop, so the front door never touches game traffic again.
+
+    python pong_shard.py --port 5555 --workers 4 --metrics-port 9100
+
+Workers report their load a couple of times a second. Players go to a worker
+with an open seat, else to the least loaded one, and the next player follows
+to fill the room. Room ids are numbered apart per worker (worker i has ids i+1,
+i+1+N, ...), so a spectator asking for a room goes straight to its worker.
+Session tokens are numbered apart the same way (token % N is the worker), so a
+player's RESUME reaches the worker holding its seat. The
+front door's metrics endpoint adds the workers' reports up under the
+single-server metric names (pong_load.py can watch it), plus a pong_shard_*
+series per worker.
+
+The UDP transport isn't offered. Datagrams can't be handed on by the front
+door, so players asking for UDP stay on TCP.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import selectors
+import socket
+import time
+
+from pong_metrics import (configure_logging, DURATION_BUCKETS, format_value, MetricsRegistry, process_metrics,
+                          serve_metrics, stop_logging)
+from pong_net import HEADER
+from pong_protocol import (decode_hello, decode_resume, decode_spectate, HELLO_BOT, message_type, MSG_RESUME,
+                           MSG_SPECTATE, PROTOCOL_VERSION)
+from pong_rules import CLASSIC, load_rules
+from pong_server import AsyncClientProtocol, AsyncPongServer, PongServer
+
+log = logging.getLogger('pong.shard')
+
+HANDOFF_PLAYER = b'P'  # Its HELLO (or SPECTATE, RESUME) is still unread in the socket
+HANDOFF_LEGACY = b'L'  # Said nothing within HELLO_TIMEOUT: a legacy pickle client
+PEEK_SIZE = 64  # Bytes peeked for a connection's first frame; HELLO, SPECTATE and RESUME are far smaller
+CONTROL_MESSAGE_SIZE = 65536  # Largest load report
+
+
+class ShardWorker(AsyncPongServer):
+    """AsyncPongServer that is handed its connections by the front door instead of listening"""
+
+    REPORT_INTERVAL = 0.5  # Seconds between load reports
+
+    def __init__(self, index, shards, control, bot_matches=0, **options):
+        super().__init__(port=None, **options)
+        self.index = index
+        self.control = control  # SOCK_SEQPACKET to the front door: sockets in, load reports out
+        self.next_room_id = index + 1
+        self.room_id_step = shards
+        self.sessions.shard, self.sessions.shards = index, shards
+        if bot_matches:
+            self.open_bot_matches(bot_matches)  # Once its room ids are numbered apart
+
+    def receive_handoffs(self):
+        try:
+            kinds, fds, _, _ = socket.recv_fds(self.control, 1, 1)
+        except OSError:
+            kinds, fds = b'', []
+        if not kinds:
+            log.info(f"🚪 Shard {self.index}: front door closed, stopping")
+            self.running = False
+            asyncio.get_running_loop().remove_reader(self.control.fileno())
+            return
+        sock = socket.socket(fileno=fds[0])
+        asyncio.get_running_loop().create_task(self.adopt(sock, kinds == HANDOFF_LEGACY))
+
+    async def adopt(self, sock, legacy):
+        sock.setblocking(False)
+        loop = asyncio.get_running_loop()
+        _, protocol = await loop.connect_accepted_socket(lambda: AsyncClientProtocol(self), sock)
+        if legacy and protocol.hello_timer is not None:
+            protocol.hello_timer.cancel()  # The front door already waited for its HELLO
+            protocol.join()
+
+    def load(self):
+        """What the front door places players by and adds up for its metrics"""
+        rooms = list(self.rooms.values())
+        seated = [(sum(conn is not None for conn in room.players), len(room.players)) for room in rooms]
+        ticks = self.tick_seconds
+        return {
+            'shard': self.index,
+            'rooms': len(rooms),
+            'players': sum(players for players, _ in seated),
+            'open_seats': sum(seats - players for players, seats in seated if 0 < players < seats),
+            'playing': sum(room.snapshot is not None and room.snapshot.status == 'playing' for room in rooms),
+            'spectators': sum(len(room.spectators) for room in rooms),
+            'sessions_suspended': len(self.sessions.suspended),
+            'ticks': self.clock.tick,
+            'dropped_ticks': self.clock.dropped_ticks,
+            'lateness': self.clock.lateness,
+            'tick_counts': ticks.counts,
+            'tick_sum': ticks.sum,
+            'process': {name: samples[0][2] for name, _, _, samples in process_metrics()},
+        }
+
+    async def report_load(self):
+        while self.running:
+            try:
+                self.control.send(json.dumps(self.load()).encode())
+            except OSError:
+                return  # Gone; receive_handoffs stops the worker
+            await asyncio.sleep(self.REPORT_INTERVAL)
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.control.fileno(), self.receive_handoffs)
+        reporter = loop.create_task(self.report_load())
+        await self.run_scheduler_async()
+        reporter.cancel()
+        log.info(f"⏹️  Shard {self.index} shutting down...")
+
+
+def run_worker(index, shards, control, inherited, options, log_level, log_rate):
+    for sock in inherited:
+        sock.close()  # The front door's control sockets: holding them would hide it exiting
+    configure_logging(log_level, log_rate)  # The front door's listener thread didn't survive the fork
+    server = ShardWorker(index, shards, control, **options)
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        server.running = False
+    server.finish_recordings()
+    stop_logging()  # A worker process skips atexit, which would otherwise flush the log
+
+
+class Shard:
+    """The front door's view of one worker process"""
+
+    def __init__(self, index, process, control):
+        self.index = index
+        self.process = process
+        self.control = control
+        self.report = None  # Latest load report
+        self.since_report = 0  # Players handed over since that report
+        self.handoffs = 0
+        self.alive = True
+
+    def players(self):
+        return (self.report['players'] if self.report else 0) + self.since_report
+
+    def open_seats(self):
+        return (self.report['open_seats'] if self.report else 0) - self.since_report
+
+
+class FrontDoor:
+    """Accepts every connection and passes it, socket and all, to a worker process"""
+
+    STATS_INTERVAL = 10  # Seconds between placement reports when stats are on
+    PARTIAL_POLL = 0.01  # Seconds between looks at a connection whose first frame is incomplete
+
+    def __init__(self, host, port, workers, options, stats=False, metrics_port=None,
+                 log_level='INFO', log_rate=0):
+        self.shards = []
+        context = multiprocessing.get_context('fork')
+        for index in range(workers):
+            ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            inherited = [ours] + [shard.control for shard in self.shards]
+            process = context.Process(target=run_worker, daemon=True,
+                                      args=(index, workers, theirs, inherited, options, log_level, log_rate))
+            process.start()
+            theirs.close()
+            self.shards.append(Shard(index, process, ours))
+
+        # Bound after the workers are forked, so none of them holds the listening socket
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(socket.SOMAXCONN)
+        self.server.setblocking(False)
+        self.port = self.server.getsockname()[1]
+        log.info(f"🚪 Front door on {host}:{self.port}, {workers} shard processes")
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server, selectors.EVENT_READ, 'accept')
+        for shard in self.shards:
+            self.selector.register(shard.control, selectors.EVENT_READ, shard)
+        self.waiting = {}  # Socket -> deadline for its first frame
+        self.partial = set()  # Waiting sockets holding part of a frame, polled instead of selected
+        self.seats = options.get('rules', CLASSIC).players  # Per room
+        self.filling = None  # Shard given the first player of a room, which the next players join
+        self.filling_seats = 0  # Seats in that room still to hand out
+        self.running = True
+        self.stats = stats
+        self.next_stats = time.monotonic() + self.STATS_INTERVAL
+
+        self.metrics = MetricsRegistry()
+        self.metrics.collector(self.collect_metrics)
+        self.metrics.collector(process_metrics)
+        if metrics_port is not None:
+            serve_metrics(self.metrics, port=metrics_port)
+            log.info(f"📈 Metrics at http://127.0.0.1:{metrics_port}/metrics")
+
+    def accept(self):
+        try:
+            sock, addr = self.server.accept()
+        except BlockingIOError:
+            return
+        self.waiting[sock] = time.monotonic() + PongServer.HELLO_TIMEOUT
+        self.selector.register(sock, selectors.EVENT_READ, 'first frame')
+
+    def first_frame(self, sock):
+        """Route a connection once its first frame is in; returns False while it is still partial"""
+        try:
+            data = sock.recv(PEEK_SIZE, socket.MSG_PEEK)
+        except OSError:
+            data = b''
+        if not data:
+            self.forget(sock)
+            sock.close()  # Left before saying anything
+            return True
+        if len(data) < HEADER.size:
+            return False
+        (length,) = HEADER.unpack_from(data)
+        if HEADER.size + length > len(data) and HEADER.size + length <= PEEK_SIZE:
+            return False
+
+        payload = data[HEADER.size:HEADER.size + length]
+        if message_type(payload) == MSG_SPECTATE:
+            spectate = decode_spectate(payload)
+            if spectate is not None and spectate[0] == PROTOCOL_VERSION:
+                self.hand_over(sock, self.shard_for_room(spectate[1]), HANDOFF_PLAYER)
+                return True
+        if message_type(payload) == MSG_RESUME:
+            resume = decode_resume(payload)
+            if resume is not None and resume[0] == PROTOCOL_VERSION:
+                # A token the worker doesn't know (or a dead worker's) matchmakes afresh
+                shard = self.shards[resume[2] % len(self.shards)]
+                self.hand_over(sock, shard if shard.alive else self.place_player(), HANDOFF_PLAYER)
+                return True
+        hello = decode_hello(payload)
+        if hello is not None and hello[1] & HELLO_BOT:
+            # Its room is full at once, with a bot: nobody follows it there
+            self.hand_over(sock, min(self.live_shards(), key=Shard.players), HANDOFF_PLAYER)
+            return True
+        self.hand_over(sock, self.place_player(), HANDOFF_PLAYER)
+        return True
+
+    def live_shards(self):
+        return [shard for shard in self.shards if shard.alive]
+
+    def shard_for_room(self, room_id):
+        """Room ids encode their worker; room 0 means any match in play"""
+        live = self.live_shards()
+        if room_id:
+            return self.shards[(room_id - 1) % len(self.shards)]
+        return max(live, key=lambda shard: shard.report['playing'] if shard.report else 0)
+
+    def place_player(self):
+        """Fill the room a recent player opened, else a worker with an open seat, else the least loaded"""
+        if self.filling_seats and self.filling.alive:
+            self.filling_seats -= 1
+            return self.filling
+        live = self.live_shards()
+        for shard in live:
+            if shard.open_seats() > 0:
+                return shard
+        self.filling = min(live, key=Shard.players)
+        self.filling_seats = self.seats - 1
+        return self.filling
+
+    def hand_over(self, sock, shard, kind):
+        self.forget(sock)
+        if shard.alive:
+            try:
+                socket.send_fds(shard.control, [kind], [sock.fileno()])
+                shard.since_report += 1
+                shard.handoffs += 1
+            except OSError:
+                self.shard_died(shard)
+        sock.close()  # The worker has its own descriptor for it now
+
+    def forget(self, sock):
+        if self.waiting.pop(sock, None) is None:
+            return
+        if sock in self.partial:
+            self.partial.discard(sock)
+        else:
+            self.selector.unregister(sock)
+
+    def receive_report(self, shard):
+        try:
+            message = shard.control.recv(CONTROL_MESSAGE_SIZE)
+        except OSError:
+            message = b''
+        if not message:
+            self.shard_died(shard)
+            return
+        shard.report = json.loads(message)
+        shard.since_report = 0
+
+    def shard_died(self, shard):
+        if not shard.alive:
+            return
+        shard.alive = False
+        self.selector.unregister(shard.control)
+        log.error(f"💥 Shard {shard.index} exited (code {shard.process.exitcode}), "
+                  f"its {shard.players()} players are gone")
+        if not any(shard.alive for shard in self.shards):
+            self.running = False
+
+    def report_stats(self):
+        for shard in self.shards:
+            report = shard.report or {}
+            log.info(f"📊 Shard {shard.index}: {report.get('rooms', 0)} rooms, {shard.players()} players, "
+                     f"{report.get('playing', 0)} playing, {shard.handoffs} handed over"
+                     + ("" if shard.alive else " (dead)"))
+
+    def collect_metrics(self):
+        """The workers' latest reports, added up under the names a single PongServer exports"""
+        reports = [shard.report for shard in self.shards if shard.alive and shard.report]
+
+        def total(key):
+            return sum(report[key] for report in reports)
+
+        def single(name, kind, help, value):
+            return (name, kind, help, [(name, None, value)])
+
+        def per_shard(name, kind, help, value):
+            return (name, kind, help, [(name, {'shard': shard.index}, value(shard))
+                                       for shard in self.shards if shard.report])
+
+        tick_counts = [sum(counts) for counts in zip(*(report['tick_counts'] for report in reports))]
+        tick_samples = []
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS + (float('inf'),), tick_counts):
+            cumulative += count
+            tick_samples.append(('pong_tick_seconds_bucket', {'le': format_value(bound)}, cumulative))
+        tick_samples.append(('pong_tick_seconds_sum', None, total('tick_sum')))
+        tick_samples.append(('pong_tick_seconds_count', None, cumulative))
+
+        return [
+            # The slowest shard's clock: a healthy deployment ticks every one at the full rate
+            single('pong_ticks_total', 'counter', "Physics steps taken by the slowest shard",
+                   min((report['ticks'] for report in reports), default=0)),
+            single('pong_dropped_ticks_total', 'counter',
+                   "Steps given up because the backlog was too long, all shards", total('dropped_ticks')),
+            single('pong_tick_lateness_seconds', 'gauge', "Latest step's lateness on the latest shard",
+                   max((report['lateness'] for report in reports), default=0)),
+            ('pong_tick_seconds', 'histogram', "Wall time of one physics step across a shard's rooms",
+             tick_samples),
+            single('pong_rooms', 'gauge', "Open rooms, all shards", total('rooms')),
+            single('pong_matches_playing', 'gauge', "Rooms with a rally in progress, all shards", total('playing')),
+            single('pong_spectators', 'gauge', "Connected spectators, all shards", total('spectators')),
+            single('pong_sessions_suspended', 'gauge', "Dropped players whose seat is held for a resume, all shards",
+                   total('sessions_suspended')),
+            single('pong_shard_processes_cpu_seconds_total', 'counter', "CPU time of every shard process",
+                   sum(report['process']['process_cpu_seconds_total'] for report in reports)),
+            single('pong_shard_processes_resident_memory_bytes', 'gauge', "Resident memory of every shard process",
+                   sum(report['process'].get('process_resident_memory_bytes', 0) for report in reports)),
+            per_shard('pong_shard_rooms', 'gauge', "Open rooms on each shard", lambda shard: shard.report['rooms']),
+            per_shard('pong_shard_players', 'gauge', "Seated players on each shard", Shard.players),
+            per_shard('pong_shard_matches_playing', 'gauge', "Rallies in progress on each shard",
+                      lambda shard: shard.report['playing']),
+            per_shard('pong_shard_cpu_seconds_total', 'counter', "CPU time of each shard process",
+                      lambda shard: shard.report['process']['process_cpu_seconds_total']),
+            per_shard('pong_shard_handoffs_total', 'counter', "Connections handed to each shard",
+                      lambda shard: shard.handoffs),
+        ]
+
+    def start(self):
+        while self.running:
+            now = time.monotonic()
+            timeout = min(self.waiting.values(), default=now + 1) - now
+            if self.partial:
+                timeout = min(timeout, self.PARTIAL_POLL)
+            for key, _ in self.selector.select(max(0.0, min(timeout, 1))):
+                if key.data == 'accept':
+                    self.accept()
+                elif key.data == 'first frame':
+                    if not self.first_frame(key.fileobj):
+                        # Still readable until the rest arrives; poll it rather than spin on it
+                        self.selector.unregister(key.fileobj)
+                        self.partial.add(key.fileobj)
+                else:
+                    self.receive_report(key.data)
+            for sock in list(self.partial):
+                self.first_frame(sock)
+
+            now = time.monotonic()
+            for sock, deadline in list(self.waiting.items()):
+                if now >= deadline:
+                    # Still partial, or silent: a legacy client, which only ever plays
+                    self.hand_over(sock, self.place_player(), HANDOFF_LEGACY)
+            if self.stats and now >= self.next_stats:
+                self.next_stats += self.STATS_INTERVAL
+                self.report_stats()
+
+    def stop(self):
+        """Close the front door; each worker stops once its control socket does"""
+        self.running = False
+        self.server.close()
+        for shard in self.shards:
+            shard.control.close()
+        for shard in self.shards:
+            shard.process.join(timeout=5)
+            if shard.process.is_alive():
+                shard.process.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pong server sharded over several processes")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="shard processes (default: one per core)")
+    parser.add_argument('--max-rooms', type=int, default=500, help="per shard")
+    parser.add_argument('--stats', action='store_true',
+                        help=f"print each shard's load every {FrontDoor.STATS_INTERVAL}s")
+    parser.add_argument('--tick-rate', type=int, default=60, help="physics steps per second")
+    parser.add_argument('--send-rate', type=int, default=60, help="snapshots per second")
+    parser.add_argument('--record', metavar='DIR',
+                        help="write a replay file of every match to DIR (see pong_replay.py)")
+    parser.add_argument('--rewind-window', type=float, default=0.25, metavar='SECONDS',
+                        help="lag compensation: how late a paddle input may still reach the ball (0: off)")
+    parser.add_argument('--resume-grace', type=float, default=10.0, metavar='SECONDS',
+                        help="how long a dropped player's seat is held for it to reconnect (0: not at all)")
+    parser.add_argument('--bot-after', type=float, metavar='SECONDS',
+                        help="give a player who waited this long alone a bot opponent (default: never)")
+    parser.add_argument('--bot-difficulty', type=float, default=0.7, help="server bots' aim and speed, 0 to 1")
+    parser.add_argument('--bot-reaction', type=float, default=0.15, metavar='SECONDS',
+                        help="how long server bots take to react to the ball changing course")
+    parser.add_argument('--bot-matches', type=int, default=0, metavar='N',
+                        help="open N matches of two bots on each shard, as a steady load")
+    parser.add_argument('--rules', default='classic', metavar='PRESET|FILE',
+                        help="match rules: classic, multiball, doubles, marathon or a JSON file of settings")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="serve the shards' combined metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="DEBUG adds a line per paddle hit")
+    parser.add_argument('--log-rate', type=float, default=0, metavar='LINES',
+                        help="cap INFO and DEBUG lines per second, per process (default: no cap)")
+    args = parser.parse_args()
+    try:
+        rules = load_rules(args.rules)
+    except ValueError as e:
+        parser.error(str(e))
+
+    options = dict(max_rooms=args.max_rooms, tick_rate=args.tick_rate, send_rate=args.send_rate,
+                   record_dir=args.record, rewind_window=args.rewind_window, resume_grace=args.resume_grace,
+                   bot_after=args.bot_after, bot_difficulty=args.bot_difficulty, bot_reaction=args.bot_reaction,
+                   bot_matches=args.bot_matches, rules=rules)
+    configure_logging(args.log_level, args.log_rate)
+    door = FrontDoor(args.host, args.port, args.workers, options, stats=args.stats,
+                     metrics_port=args.metrics_port, log_level=args.log_level, log_rate=args.log_rate)
+    try:
+        door.start()
+    except KeyboardInterrupt:
+        log.info("⏹️  Front door stopped by user")
+    door.stop()
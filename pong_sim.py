@@ -0,0 +1,335 @@
+"""The Pong rules as a pure, deterministic simulation, free of sockets and printing.
+
+A match is a plain state dict. MatchSimulation.step(state, inputs) applies the
+players' messages for one tick in order, advances the balls and returns the
+state. Serves are drawn from an RNG seeded with the match seed and the number
+of serves so far, both kept in the state, so the next state depends only on the
+current state and the inputs: the same seed and inputs give byte-identical
+matches on every run and every machine.
+
+    sim = MatchSimulation()
+    state = sim.new_state(seed=1234)
+    sim.players_joined(state)
+    sim.step(state, [(0, {'paddle_y': 250, 'ready': True}), (1, {'paddle_y': 250, 'ready': True})])
+
+The court, the paddles, the speed curve, the number of balls and players per
+side come from the simulation's MatchConfig (pong_rules); the state only holds
+what changes. Its lists are indexed by player id ('paddles', 'ready',
+'play_again'), by ball ('balls') or by side ('scores'; 'winner' is a side). A
+tick costs one sweep per ball against the paddles of the side it is heading for.
+
+What happened during a step (serves, hits, points, wins) is appended to
+`sim.events` for the caller to log or count.
+
+Lag compensation: a player's paddle moves reach the server late, so a ball the
+player saw themselves block can already be past the paddle. With a
+`rewind_window`, the point isn't scored until the window has passed. If an
+input from that player arrives in time, was made while their screen still
+showed the ball short of the paddle (its view tick), and puts the paddle where
+the ball crossed, the ball is rewound to that moment, bounced and brought back
+to the present.
+"""
+import random
+
+from pong_protocol import RULES_TICK_RATE
+from pong_rules import CLASSIC
+
+
+class MatchSimulation:
+    """Rules for one MatchConfig and tick rate; holds no match state of its own apart from the event list"""
+
+    MAX_INPUT_MOVE = 100  # Largest paddle move accepted from a single input
+    MAX_BOUNCES = 16  # Impacts resolved per ball per tick; any time left after that is dropped, not carried over
+    SPIN = 3  # dy added by a hit at the paddle's very edge, half that at a quarter of its height
+    SERVE_SPREAD = 3  # Largest |dy| of a serve
+
+    def __init__(self, tick_rate=RULES_TICK_RATE, rewind_window=0.0, rules=CLASSIC):
+        self.rules = rules
+        self.tick_rate = tick_rate
+        self.step_scale = RULES_TICK_RATE / tick_rate
+        self.rewind_ticks = round(rewind_window * tick_rate)  # 0: score a miss at once
+        self.defenders = tuple(tuple(range(side, rules.players, 2)) for side in (0, 1))  # Player ids per side
+        self.events = []  # (kind, *details) since the caller last cleared it
+
+    def new_state(self, seed=0):
+        """A fresh match waiting for its players"""
+        rules = self.rules
+        rest = (rules.height - rules.paddle_height) / 2
+        return {
+            'tick': 0,  # Physics steps since the room opened
+            'seed': seed,  # Serves are drawn from (seed, serves)
+            'serves': 0,
+            'balls': [self.new_ball() for _ in range(rules.balls)],
+            'paddles': [{'y': rest, 'input_seq': 0} for _ in range(rules.players)],  # input_seq: last input applied
+            'scores': [0, 0],
+            'status': 'waiting_connection',  # waiting_connection -> waiting_ready -> playing -> game_over
+            'suspended_status': None,  # What the status was before a dropped player suspended the match
+            'ready': [False] * rules.players,
+            'play_again': [False] * rules.players,
+            'winner': None,
+        }
+
+    def new_ball(self):
+        rules = self.rules
+        return {
+            'x': rules.width / 2, 'y': rules.height / 2, 'dx': rules.base_speed, 'dy': rules.base_speed,
+            'multiplier': 1.0,  # Increases with each hit
+            'crossing': None,  # Where it got past a paddle, while a late input may still reach it
+        }
+
+    def players_joined(self, state):
+        """Every seat is taken: wait for READY"""
+        state['status'] = 'waiting_ready'
+
+    def player_left(self, state, player_id):
+        """A seat emptied; whoever takes it next numbers its inputs from 1 again"""
+        state['status'] = 'waiting_connection'
+        state['suspended_status'] = None
+        state['paddles'][player_id]['input_seq'] = 0
+
+    def suspend(self, state):
+        """A seated player's connection dropped: freeze the match until they resume"""
+        state['suspended_status'] = state['status']
+        state['status'] = 'suspended'
+
+    def resume(self, state):
+        """The dropped player is back: carry on from where the match froze"""
+        state['status'] = state['suspended_status']
+        state['suspended_status'] = None
+
+    def step(self, state, inputs=()):
+        """Apply `inputs` ((player_id, message) pairs, in arrival order), then advance one tick"""
+        for player_id, message in inputs:
+            self.apply_input(state, player_id, message)
+
+        state['tick'] += 1
+        if state['status'] == 'playing':
+            for ball in state['balls']:
+                self.move_ball(state, ball)
+            self.check_score(state)
+        return state
+
+    def apply_input(self, state, player_id, client_data):
+        """Apply one decoded client message"""
+        paddle = state['paddles'][player_id]
+        max_y = self.rules.height - self.rules.paddle_height
+
+        if not isinstance(client_data, dict):
+            client_data = {'paddle_y': client_data, 'ready': False, 'play_again': False}
+
+        if 'moves' in client_data:
+            # Binary clients send sequenced relative moves they have already predicted.
+            # UDP repeats unacknowledged moves, so skip any this paddle already reflects.
+            moved = False
+            for input_seq, move in client_data['moves']:
+                if input_seq <= paddle['input_seq']:
+                    continue
+                move = max(-self.MAX_INPUT_MOVE, min(move, self.MAX_INPUT_MOVE))
+                paddle['y'] = max(0, min(paddle['y'] + move, max_y))
+                paddle['input_seq'] = input_seq
+                moved = True
+            if moved:
+                for ball in state['balls']:
+                    crossing = ball['crossing']
+                    if crossing is not None and crossing['player'] == player_id:
+                        self.rewind_hit(state, ball, crossing, client_data.get('view_tick'))
+        else:
+            paddle['y'] = max(0, min(client_data.get('paddle_y', max_y / 2), max_y))
+
+        if 'ready' not in client_data and 'moves' in client_data:
+            return  # UDP input only; ready / play again come over TCP
+
+        state['ready'][player_id] = client_data.get('ready', False)
+        state['play_again'][player_id] = client_data.get('play_again', False)
+
+        # Check transitions
+        status = state['status']
+
+        # Waiting ready -> Playing
+        if status == 'waiting_ready' and all(state['ready']):
+            self.start_game(state)
+
+        # Game over -> Restart
+        if status == 'game_over' and all(state['play_again']):
+            self.restart_game(state)
+
+    def start_game(self, state):
+        """Start the game after every player is ready"""
+        self.events.append(('start',))
+        state['status'] = 'playing'
+        for ball in state['balls']:
+            ball['multiplier'] = 1.0
+            self.reset_ball(state, ball)
+
+    def restart_game(self, state):
+        """Back to waiting for READY, scores cleared"""
+        self.events.append(('restart',))
+        players = self.rules.players
+        state['scores'] = [0, 0]
+        state['status'] = 'waiting_ready'
+        state['ready'] = [False] * players
+        state['play_again'] = [False] * players
+        state['winner'] = None
+        for ball in state['balls']:
+            ball['multiplier'] = 1.0
+            self.reset_ball(state, ball)
+
+    def check_score(self, state):
+        """Award a point for every ball that left the court, serving it again or ending the match"""
+        for ball in state['balls']:
+            if ball['x'] <= 0:
+                scorer = 1
+            elif ball['x'] >= self.rules.width:
+                scorer = 0
+            else:
+                continue
+            crossing = ball['crossing']
+            if crossing is not None and state['tick'] - crossing['tick'] < self.rewind_ticks:
+                continue  # The player who missed may have an input on its way that reached the ball
+
+            scores = state['scores']
+            scores[scorer] += 1
+            self.events.append(('score', scorer) + tuple(scores))
+
+            if scores[scorer] >= self.rules.win_score:
+                state['winner'] = scorer
+                state['status'] = 'game_over'
+                self.events.append(('win', scorer) + tuple(scores))
+                return
+            # RESET SPEED AFTER SCORE
+            ball['multiplier'] = 1.0
+            self.events.append(('speed_reset',))
+            self.reset_ball(state, ball)
+
+    def move_ball(self, state, ball, remaining=1.0):
+        """Sweep a ball through one tick, bouncing at the exact moment of every impact.
+
+        Walls and paddle faces are planes the ball's centre can't cross. Each pass
+        finds the earliest crossing left in the tick, moves the ball there, bounces
+        it and carries on with the time that remains, so the ball can't skip over
+        a paddle however fast it goes. Paddles only stop a ball coming at their
+        face, from the other side's half. `remaining` is the fraction of the tick
+        to simulate.
+        """
+        rules = self.rules
+        paddles = state['paddles']
+        faces = rules.faces
+        ph = rules.paddle_height
+        top = rules.ball_radius
+        bottom = rules.height - rules.ball_radius
+
+        for _ in range(self.MAX_BOUNCES):
+            speed = ball['multiplier'] * self.step_scale
+            vx = ball['dx'] * speed
+            vy = ball['dy'] * speed
+
+            # Earliest impact before the tick ends
+            impact, hit = float('inf'), None
+            if vy < 0 and ball['y'] + vy * remaining <= top:
+                impact, hit = (top - ball['y']) / vy, 'top'
+            if vy > 0 and ball['y'] + vy * remaining >= bottom:
+                t = (bottom - ball['y']) / vy
+                if t < impact:
+                    impact, hit = t, 'bottom'
+            # Paddles only count if the ball is level with them as it reaches the face
+            missed = None  # (time, player, face) if the ball gets past a paddle
+            if vx < 0:
+                for player_id in self.defenders[0]:
+                    face = faces[player_id]
+                    if ball['x'] >= face and ball['x'] + vx * remaining <= face:
+                        t = (face - ball['x']) / vx
+                        if t < impact:
+                            paddle_y = paddles[player_id]['y']
+                            if paddle_y <= ball['y'] + vy * t <= paddle_y + ph:
+                                impact, hit = t, player_id
+                            elif missed is None or t < missed[0]:
+                                missed = (t, player_id, face)
+            elif vx > 0:
+                for player_id in self.defenders[1]:
+                    face = faces[player_id]
+                    if ball['x'] <= face and ball['x'] + vx * remaining >= face:
+                        t = (face - ball['x']) / vx
+                        if t < impact:
+                            paddle_y = paddles[player_id]['y']
+                            if paddle_y <= ball['y'] + vy * t <= paddle_y + ph:
+                                impact, hit = t, player_id
+                            elif missed is None or t < missed[0]:
+                                missed = (t, player_id, face)
+
+            if missed is not None and missed[0] < impact and ball['crossing'] is None:
+                t, player_id, face = missed
+                ball['crossing'] = {'tick': state['tick'], 'player': player_id,
+                                    'ball': dict(ball, x=face, y=ball['y'] + vy * t),
+                                    'remaining': remaining - t}
+
+            if hit is None:
+                ball['x'] += vx * remaining
+                ball['y'] += vy * remaining
+                return
+
+            impact = max(0.0, min(impact, remaining))
+            remaining -= impact
+            if hit == 'top' or hit == 'bottom':
+                # Ball collision with top/bottom
+                ball['x'] += vx * impact
+                ball['y'] = top if hit == 'top' else bottom
+                ball['dy'] *= -1
+            else:
+                # Paddle collision: back towards the other side
+                ball['x'] = faces[hit]
+                ball['y'] += vy * impact
+                ball['dx'] = abs(ball['dx']) if hit % 2 == 0 else -abs(ball['dx'])
+                self.paddle_hit(state, ball, hit)
+
+    def rewind_hit(self, state, ball, crossing, view_tick):
+        """Turn a miss into a hit if the late input that just moved the paddle reached the ball"""
+        ticks_ago = state['tick'] - crossing['tick']
+        if not view_tick or view_tick > crossing['tick'] or ticks_ago >= self.rewind_ticks:
+            return  # The player already saw the ball go past, or it's too late to rewind
+        player_id = crossing['player']
+        paddle = state['paddles'][player_id]
+        if not paddle['y'] <= crossing['ball']['y'] <= paddle['y'] + self.rules.paddle_height:
+            return
+
+        self.events.append(('rewind', player_id, ticks_ago))
+        ball.update(crossing['ball'])  # Its crossing was still None then
+        ball['dx'] = abs(ball['dx']) if player_id % 2 == 0 else -abs(ball['dx'])
+        self.paddle_hit(state, ball, player_id)
+        # Back to the present: the rest of the tick it crossed in, then every tick since
+        self.move_ball(state, ball, crossing['remaining'])
+        for _ in range(ticks_ago):
+            self.move_ball(state, ball)
+
+    def paddle_hit(self, state, ball, player_id):
+        """Speed up and spin a ball after it bounced off `player_id`'s paddle"""
+        rules = self.rules
+        ball['crossing'] = None  # Returned, so an earlier miss by a teammate no longer loses the point
+
+        # INCREASE SPEED ON HIT
+        ball['multiplier'] += rules.speed_up
+        self.events.append(('hit', player_id, ball['multiplier']))
+
+        # Add spin
+        hit_pos = (ball['y'] - state['paddles'][player_id]['y']) / rules.paddle_height
+        ball['dy'] += (hit_pos - 0.5) * self.SPIN
+
+        # Cap base ball speed
+        max_base_speed = rules.max_speed
+        if abs(ball['dx']) > max_base_speed:
+            ball['dx'] = max_base_speed if ball['dx'] > 0 else -max_base_speed
+        if abs(ball['dy']) > max_base_speed:
+            ball['dy'] = max_base_speed if ball['dy'] > 0 else -max_base_speed
+
+    def reset_ball(self, state, ball):
+        """Serve a ball from the centre in a direction drawn from (seed, serve number)"""
+        rng = random.Random(f"{state['seed']}:{state['serves']}")
+        state['serves'] += 1
+        ball['crossing'] = None
+
+        ball['x'] = self.rules.width / 2
+        ball['y'] = self.rules.height / 2
+
+        # Random direction
+        direction = rng.choice([-1, 1])
+        ball['dx'] = self.rules.base_speed * direction
+        ball['dy'] = rng.uniform(-self.SERVE_SPREAD, self.SERVE_SPREAD)
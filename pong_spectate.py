@@ -0,0 +1,187 @@
+"""Read-only spectator streams, shared by the match server and pong_relay.py.
+
+A SpectatorFeed fans one match out to any number of viewers. Each published
+snapshot is encoded once: a keyframe, plus a delta against each earlier
+snapshot some viewer last received (one per send rate in use, so a handful at
+most). Every viewer on the same baseline is handed the same immutable bytes
+object; nothing is encoded or copied per viewer.
+
+Viewers send nothing back, so the feed can't use acks. Over TCP, a snapshot
+that has been written will arrive, so the feed deltas against the last
+snapshot written to each viewer.
+
+Each viewer's send rate adapts to its socket. When its backlog is still
+draining, the feed skips it and halves its rate, down to one snapshot in
+MAX_STRIDE. Clean sends double the rate back up. A viewer stuck at the lowest
+rate for DROP_AFTER seconds is disconnected. Viewer sockets get a small kernel
+send buffer (VIEWER_SEND_BUFFER), so a backlog shows within seconds instead of
+after megabytes. The feed never blocks, so players are never delayed by a slow
+viewer.
+"""
+import socket
+import time
+from collections import OrderedDict
+
+from pong_net import pack_frame, TrafficCounter
+from pong_protocol import forget_before
+
+VIEWER_SEND_BUFFER = 8192  # Bytes of kernel send buffer per viewer: a few seconds of snapshots
+
+
+class ViewerRate:
+    """Per-viewer send state; the feed keeps one per viewer"""
+
+    __slots__ = ('stride', 'last_seq', 'slow_since', 'clean_sends')
+
+    def __init__(self):
+        self.stride = 1  # Send every stride-th snapshot
+        self.last_seq = None  # Newest snapshot written to this viewer
+        self.slow_since = None  # When it first backed up at MAX_STRIDE
+        self.clean_sends = 0  # Sends in a row without a backlog
+
+
+class SpectatorFeed:
+    """Fans one match's snapshots out to its spectators"""
+
+    MAX_STRIDE = 8  # Slowest rate a viewer is throttled to before being dropped
+    RECOVER_AFTER = 60  # Clean sends before a throttled viewer's rate is doubled again
+    DROP_AFTER = 5.0  # Seconds a viewer may stay backed up at MAX_STRIDE
+
+    def __init__(self, layout):
+        self.layout = layout  # pong_protocol.SnapshotLayout of the match
+        self.viewers = {}  # viewer -> ViewerRate
+        self.history = OrderedDict()  # seq -> values, oldest first, for baselines viewers might have
+        self.seq = None
+        self.values = None
+        self.keyframe = None  # Framed keyframe of the current snapshot, built on first use
+        self.deltas = {}  # baseline seq -> framed delta to the current snapshot
+        self.traffic = TrafficCounter()
+        self.throttled = 0  # Snapshots skipped for backed-up viewers
+        self.dropped = 0  # Viewers disconnected for being too slow
+
+    def __len__(self):
+        return len(self.viewers)
+
+    def add(self, viewer):
+        self.viewers[viewer] = ViewerRate()
+
+    def remove(self, viewer):
+        self.viewers.pop(viewer, None)
+
+    def publish(self, seq, values, now=None):
+        """Encode a new snapshot and offer it to every viewer"""
+        if now is None:
+            now = time.monotonic()
+        self.history[seq] = values
+        forget_before(self.history, seq - 2 * self.MAX_STRIDE)  # The relay's upstream seqs skip
+        self.seq, self.values = seq, values
+        self.keyframe = None
+        self.deltas = {}
+        for viewer, rate in list(self.viewers.items()):
+            self.offer(viewer, rate, now)
+
+    def frame_for(self, baseline_seq):
+        """The shared framed payload for a viewer whose newest snapshot is `baseline_seq`"""
+        frame = self.deltas.get(baseline_seq)
+        if frame is not None:
+            return frame
+        baseline = self.history.get(baseline_seq)
+        if baseline is None:
+            if self.keyframe is None:
+                self.keyframe = pack_frame(self.layout.encode_keyframe(self.seq, self.values))
+            return self.keyframe
+        frame = self.deltas[baseline_seq] = pack_frame(
+            self.layout.encode_delta(self.seq, baseline_seq, baseline, self.values))
+        return frame
+
+    def offer(self, viewer, rate, now):
+        if rate.last_seq is not None and self.seq - rate.last_seq < rate.stride:
+            return
+
+        if viewer.backed_up():
+            self.throttled += 1
+            rate.clean_sends = 0
+            if rate.stride < self.MAX_STRIDE:
+                rate.stride *= 2
+            elif rate.slow_since is None:
+                rate.slow_since = now
+            elif now - rate.slow_since > self.DROP_AFTER:
+                self.dropped += 1
+                self.remove(viewer)
+                viewer.drop()
+            return
+
+        frame = self.frame_for(rate.last_seq)
+        viewer.write(frame)
+        self.traffic.count_out(len(frame))
+        rate.last_seq = self.seq
+        rate.slow_since = None
+        rate.clean_sends += 1
+        if rate.stride > 1 and rate.clean_sends >= self.RECOVER_AFTER:
+            rate.stride //= 2
+            rate.clean_sends = 0
+
+    def close(self):
+        """Disconnect every viewer (the match is gone)"""
+        for viewer in list(self.viewers):
+            viewer.drop()
+        self.viewers.clear()
+
+
+class SocketViewer:
+    """A spectator on a plain socket, written without blocking from the scheduler thread.
+
+    A frame the kernel only partly accepts stays pending as a memoryview into the
+    shared buffer and is finished before anything newer is written.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.pending = None
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, VIEWER_SEND_BUFFER)
+
+    def backed_up(self):
+        if self.pending is not None:
+            self.send(self.pending)
+        return self.pending is not None
+
+    def write(self, frame):
+        self.send(memoryview(frame))
+
+    def send(self, view):
+        try:
+            sent = self.sock.send(view, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.pending = None  # Gone; its own thread notices and removes it
+            return
+        self.pending = view[sent:] if sent < len(view) else None
+
+    def drop(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class TransportViewer:
+    """A spectator on an asyncio transport"""
+
+    WRITE_BUFFER_HIGH = 4096  # Bytes still queued in the transport that count as a backlog
+
+    def __init__(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, VIEWER_SEND_BUFFER)
+
+    def backed_up(self):
+        return self.transport.get_write_buffer_size() > self.WRITE_BUFFER_HIGH
+
+    def write(self, frame):
+        if not self.transport.is_closing():
+            self.transport.write(frame)
+
+    def drop(self):
+        self.transport.abort()